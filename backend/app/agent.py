@@ -1,88 +1,86 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
-from langchain_core.tools import tool
 from typing import List, Dict
 from sqlalchemy.orm import Session
 from . import rag
 from . import models
 import json
-from .tools.store_locator import store_locator
+import time
+from .tools.memo import ToolMemo, use_tool_memo
+from .tools.registry import get_tool_registry, get_tool_specs, tool_config, dispatch_tool
+from .services.semantic_cache import response_cache, is_generic_question
+from .services.telemetry import TurnMetrics
+from .services.cancellation import CancellationToken, TurnCancelled, CANCELLED_TURNS
+from .services.prompt_cache import record_prompt_prefix
+from .services.intent_router import route_intent, intent_router_enabled, ANSWER, CALL_TOOL, INTENT_ROUTES
 
-# Define Tools
+# Tools are shared process-wide (see tools/registry.py)
 def create_tools(db: Session):
-    
-    @tool
-    def product_retriever(query: str, skin_type: str = "all") -> str:
-        """
-        Search for skincare products using Hybrid Search (Vector + Keyword).
-        Returns a JSON list of products.
-        Args:
-            query: The search query (e.g., "moisturizer for acne").
-            skin_type: User's skin type to filter by (e.g., "oily", "dry", "all").
-        """
-        filters = {}
-        if skin_type and skin_type != "all":
-            filters["skin_type"] = skin_type
-            
-        results = rag.hybrid_search(db, query, filters=filters, limit=3)
-        
-        if not results:
-            return "[]"
-            
-        # Format results as JSON for the LLM and Frontend
-        product_list = []
-        for p in results:
-            # Generate Affiliate Link (Amazon Search Fallback)
-            # In a real app, this would be a specific ASIN link from a database
-            affiliate_tag = "skinairecs-20"
-            encoded_name = p.name.replace(" ", "+")
-            affiliate_url = f"https://www.amazon.com/s?k={encoded_name}&tag={affiliate_tag}"
-            
-            # Enrich metadata - parse from JSON string if needed
-            raw_meta = p.metadata_info
-            if isinstance(raw_meta, str):
-                try:
-                    metadata = json.loads(raw_meta)
-                except (json.JSONDecodeError, TypeError):
-                    metadata = {}
-            else:
-                metadata = raw_meta or {}
-            metadata["affiliate_url"] = affiliate_url
-            
-            product_list.append({
-                "name": p.name,
-                "brand": p.brand,
-                "description": p.description,
-                "metadata": metadata
-            })
-        return json.dumps(product_list)
-
-    @tool
-    def ingredient_checker(ingredients: str, allergy: str) -> str:
-        """
-        Checks if a list of ingredients contains a specific allergen.
-        Args:
-            ingredients: Comma-separated list of ingredients.
-            allergy: The allergen to check for (e.g., "peanuts").
-        """
-        # Simple string check for now (Case insensitive)
-        if allergy.lower() in ingredients.lower():
-            return f"WARNING: Contains {allergy}!"
-        return "Safe."
+    """
+    Registered tools bound to a DB session, for calling tools directly
+    outside the agent loop. Order: product_retriever, ingredient_checker, store_locator.
+    """
+    return [t.with_config(tool_config(db)) for t in get_tool_registry().values()]
+
+# Prompt layout: this static prefix is byte-identical for every user and turn, so
+# providers can reuse their cached prompt prefix (tool specs + this text). The
+# per-user sections and per-turn hints are appended after it, never before.
+SYSTEM_PREFIX = """<role>
+You are a highly personalized Dermatology Consultant. You have access to the user's real-time inventory and skin history.
+Your goal is to provide advice that is GROUNDED in their actual situation.
+</role>
 
-    return [product_retriever, ingredient_checker, store_locator]
+<instructions>
+1. USE THEIR PRODUCTS: If suggesting a routine, prioritize products they already own (listed in <inventory>). Only suggest new products if they are missing a core step (e.g. have no sunscreen).
+2. CHECK HISTORY: If they rated their skin poorly (1-3) recently, ask follow-up questions about that specific day/event.
+3. BE SPECIFIC: Don't say "use a moisturizer". Say "use your CeraVe Moisturizing Cream".
+4. SAFETY: Always check ingredients if they mention allergies.
+5. TOOLS: Use 'product_retriever' if you need to find *new* products to recommend. Use 'store_locator' if they ask where to buy.
+</instructions>
+"""
+
+# Per-user section for anonymous turns and for generic questions answered into
+# the shared response cache (also for signed-in users: the answer is replayed to
+# everyone). It switches off the prefix's personalisation instructions (1-3),
+# which would otherwise ask the model to use an inventory and history it lacks.
+ANONYMOUS_CONTEXT = """
+<user_profile>
+Not available: this answer is general and may be shown to any user. There is no <inventory> or skin history.
+</user_profile>
+<general_answer>
+Instructions 1-3 do not apply. Give guidance that holds for anyone: do not refer to the user's own products, ratings or history, do not invent them, and do not ask about them.
+</general_answer>
+"""
 
 class SkincareAgent:
-    def __init__(self, llm, db_session: Session):
+    def __init__(self, llm, db_session: Session, tool_memo: ToolMemo = None):
         self.db = db_session
-        self.tools = create_tools(db_session)
+        # Conversation-scoped cache of tool outputs (fresh per agent if not shared)
+        self.tool_memo = tool_memo or ToolMemo()
+        self.tools = get_tool_registry()
         self.llm = llm
-        self.llm_with_tools = self.llm.bind_tools(self.tools)
+        self._llm_with_tools = None
+        self.turn_metrics = None  # TurnMetrics of the current/last run_stream
+        self.cancel_token = CancellationToken()
+        self.stage = None  # Step the current turn is in (for cancellation metrics)
 
+    @property
+    def llm_with_tools(self):
+        """LLM bound to the shared tool specs (bound lazily, only when a call needs it)."""
+        if self._llm_with_tools is None:
+            self._llm_with_tools = self.llm.bind_tools(get_tool_specs())
+        return self._llm_with_tools
 
     def build_system_context(self, user_id: int) -> str:
         """
-        Constructs a Just-in-Time System Prompt tailored to the user's data.
+        Constructs a Just-in-Time System Prompt tailored to the user's data:
+        the shared SYSTEM_PREFIX followed by the user's own sections.
+        """
+        return SYSTEM_PREFIX + self.build_user_context(user_id)
+
+    def build_user_context(self, user_id: int) -> str:
+        """
+        Per-user prompt sections (profile, inventory, journal), appended after SYSTEM_PREFIX.
         """
         # 1. Fetch Profile
         user = self.db.query(models.User).filter(models.User.id == user_id).first()
@@ -110,14 +108,9 @@ class SkincareAgent:
         if entries:
             journal_text = "\n".join([f"- {e.date.date()}: Condition {e.overall_condition}/5. Notes: {e.notes or 'None'}" for e in entries])
 
-        # 4. Construct XML System Prompt
+        # 4. Construct XML sections
         # Using Anthropic-style XML tags for clarity
-        system_prompt = f"""
-<role>
-You are a highly personalized Dermatology Consultant. You have access to the user's real-time inventory and skin history.
-Your goal is to provide advice that is GROUNDED in their actual situation.
-</role>
-
+        return f"""
 <user_profile>
 {profile_text}
 </user_profile>
@@ -131,30 +124,75 @@ The user currently owns and uses:
 Recent skin journal entries:
 {journal_text}
 </skin_history>
-
-<instructions>
-1. USE THEIR PRODUCTS: If suggesting a routine, prioritize products they already own (listed in <inventory>). Only suggest new products if they are missing a core step (e.g. have no sunscreen).
-2. CHECK HISTORY: If they rated their skin poorly (1-3) recently, ask follow-up questions about that specific day/event.
-3. BE SPECIFIC: Don't say "use a moisturizer". Say "use your CeraVe Moisturizing Cream".
-4. SAFETY: Always check ingredients if they mention allergies.
-5. TOOLS: Use 'product_retriever' if you need to find *new* products to recommend. Use 'store_locator' if they ask where to buy.
-</instructions>
 """
-        return system_prompt
 
-    def run_stream(self, user_message: str, chat_history: List[Dict] = [], user_location: str = None, image_base64: str = None, user_id: int = None):
+    @property
+    def model_name(self) -> str:
+        """Identity of the underlying model (used to scope cached answers)."""
+        return getattr(self.llm, "model_name", None) or getattr(self.llm, "model", None) or type(self.llm).__name__
+
+    def run_stream(self, user_message: str, chat_history: List[Dict] = [], user_location: str = None, image_base64: str = None, user_id: int = None, include_metrics: bool = False, cancel_token: CancellationToken = None):
         """
         Runs the agent loop and YIELDS chunks of the final text.
         Structure of yield:
         { "type": "text", "content": "..." }
         { "type": "products", "content": [...] }
+        { "type": "metrics", "content": {...} }  (last, only if include_metrics)
+
+        Generic questions (no user context needed) are served from the semantic
+        response cache when it is enabled. Small talk and product searches are
+        routed locally, without the tool-decision LLM call (services/intent_router.py).
+
+        If cancel_token is cancelled (client disconnected), pending tool calls are
+        skipped and the LLM stream is abandoned at the next chunk.
         """
-        
+        self.turn_metrics = TurnMetrics(model=self.model_name)
+        self.cancel_token = cancel_token or CancellationToken()
+        self.stage = "context"
+        completed = False
+        try:
+            for chunk in self._stream_with_cache(user_message, chat_history, user_location, image_base64, user_id):
+                if self.turn_metrics.first_token_at is None and json.loads(chunk).get("type") == "text":
+                    self.turn_metrics.mark_first_token()
+                yield chunk
+            completed = True
+        except TurnCancelled:
+            pass
+        finally:
+            if not completed and self.cancel_token.cancelled:
+                CANCELLED_TURNS.inc(model=self.model_name, stage=self.stage)
+        if not completed:
+            return
+
+        self.turn_metrics.publish()
+        if include_metrics:
+            yield self.turn_metrics.to_event()
+
+    def _stream_with_cache(self, user_message: str, chat_history: List[Dict], user_location: str, image_base64: str, user_id: int):
+        if not (response_cache.enabled and is_generic_question(user_message, chat_history, image_base64, user_location)):
+            yield from self._generate_stream(user_message, chat_history, user_location, image_base64, user_id)
+            return
+
+        cached = response_cache.lookup(user_message, namespace=self.model_name)
+        if cached is not None:
+            self.turn_metrics.cache_hit = True
+            yield from cached
+            return
+
+        # Answer WITHOUT the user's profile so the result is safe to replay for anyone
+        recorded = []
+        for chunk in self._generate_stream(user_message, chat_history, user_location, image_base64, user_id=None):
+            recorded.append(chunk)
+            yield chunk
+        response_cache.store(user_message, recorded, namespace=self.model_name)
+
+    def _generate_stream(self, user_message: str, chat_history: List[Dict], user_location: str, image_base64: str, user_id: int):
         # DYNAMIC CONTEXT BUILDING
+        # Stable prefix first, then per-user sections, then per-turn hints
         if user_id:
-            system_text = self.build_system_context(user_id)
+            system_text = SYSTEM_PREFIX + self.build_user_context(user_id)
         else:
-            system_text = "You are a helpful skin assistant."
+            system_text = SYSTEM_PREFIX + ANONYMOUS_CONTEXT
         
         # Add image analysis instructions if image is provided
         if image_base64:
@@ -190,57 +228,69 @@ Recent skin journal entries:
         else:
             messages.append(HumanMessage(content=user_message))
         
-        # 1. First Call (Synchronous Decision)
-        # We don't stream here because we need to know if it wants to use tools first.
-        response = self.llm_with_tools.invoke(messages)
+        # 1. Local intent routing: skip the decision call when the rules are confident
+        route = None
+        if intent_router_enabled():
+            route = route_intent(user_message, chat_history, image_base64, user_location)
+            INTENT_ROUTES.inc(intent=route.intent or "unknown", action=route.action)
+            self.turn_metrics.route = {"intent": route.intent, "action": route.action, "reason": route.reason}
+
+        if route is not None and route.action == ANSWER:
+            # No tools needed: stream the reply straight away, no tools bound
+            self.turn_metrics.prompt_prefix = record_prompt_prefix(SYSTEM_PREFIX)
+            yield from self._stream_synthesis(self.llm, messages)
+            return
+
+        self.turn_metrics.prompt_prefix = record_prompt_prefix(SYSTEM_PREFIX, get_tool_specs())
+        if route is not None and route.action == CALL_TOOL:
+            response = AIMessage(content="", tool_calls=[{
+                "name": route.tool_name,
+                "args": route.tool_args,
+                "id": f"router_{route.tool_name}",
+            }])
+        else:
+            # First Call (Synchronous Decision)
+            # We don't stream here because we need to know if it wants to use tools first.
+            self.stage = "tool_decision"
+            self.cancel_token.raise_if_cancelled()
+            decision_start = time.perf_counter()
+            response = self.llm_with_tools.invoke(messages)
+            self.turn_metrics.record_tool_decision(time.perf_counter() - decision_start, response)
         
         found_products = []
 
         if response.tool_calls:
             # 2. Execute Tools
             messages.append(response) # Add the intent to call tool
-            for tool_call in response.tool_calls:
-                function_name = tool_call["name"]
-                args = tool_call["args"]
+            with use_tool_memo(self.tool_memo):
+                for tool_call in response.tool_calls:
+                    function_name = tool_call["name"]
+                    args = tool_call["args"]
                 
-                # Find matching tool
-                tool_result = "Error: Tool not found"
-                if function_name == "product_retriever":
-                    tool = self.tools[0]
-                    tool_result = tool.invoke(args)
-                    
+                    self.stage = "tools"
+                    self.cancel_token.raise_if_cancelled()
+                    tool_start = time.perf_counter()
+                    tool_result = dispatch_tool(function_name, args, db=self.db)
+                    self.turn_metrics.record_tool(function_name, time.perf_counter() - tool_start)
+
                     # Capture Products!
-                    try:
-                        products = json.loads(tool_result)
-                        if isinstance(products, list):
-                            found_products.extend(products)
-                    except:
-                        pass 
-
-                elif function_name == "ingredient_checker":
-                    tool = self.tools[1]
-                    tool_result = tool.invoke(args)
-
-                elif function_name == "store_locator":
-                    # Tool index 2
-                    tool = self.tools[2] 
-                    tool_result = tool.invoke(args)
-                
-                from langchain_core.messages import ToolMessage
-                messages.append(ToolMessage(tool_call_id=tool_call["id"], content=str(tool_result)))
+                    if function_name == "product_retriever":
+                        try:
+                            products = json.loads(tool_result)
+                            if isinstance(products, list):
+                                found_products.extend(products)
+                        except:
+                            pass 
+
+                    from langchain_core.messages import ToolMessage
+                    messages.append(ToolMessage(tool_call_id=tool_call["id"], content=str(tool_result)))
             
             # Yield Products first if we have them
             if found_products:
                  yield json.dumps({"type": "products", "content": found_products}) + "\n"
 
             # 3. Second Call (Streamed Synthesis)
-            for chunk in self.llm_with_tools.stream(messages):
-                # Check for injected products (Mock or otherwise)
-                if hasattr(chunk, "additional_kwargs") and "products" in chunk.additional_kwargs:
-                     yield json.dumps({"type": "products", "content": chunk.additional_kwargs["products"]}) + "\n"
-                     
-                if chunk.content:
-                    yield json.dumps({"type": "text", "content": chunk.content}) + "\n"
+            yield from self._stream_synthesis(self.llm_with_tools, messages)
             
         else:
             # No tool call, just stream the content from the first response? 
@@ -251,3 +301,18 @@ Recent skin journal entries:
             if response.content:
                 yield json.dumps({"type": "text", "content": response.content}) + "\n"
 
+    def _stream_synthesis(self, llm, messages):
+        """Stream the final answer from `llm` as NDJSON text/products events."""
+        self.stage = "synthesis"
+        self.cancel_token.raise_if_cancelled()
+        self.turn_metrics.start_synthesis()
+        for chunk in llm.stream(messages):
+            # Leaving the loop closes the provider stream
+            self.cancel_token.raise_if_cancelled()
+            self.turn_metrics.record_synthesis_chunk(chunk)
+            # Check for injected products (Mock or otherwise)
+            if hasattr(chunk, "additional_kwargs") and "products" in chunk.additional_kwargs:
+                 yield json.dumps({"type": "products", "content": chunk.additional_kwargs["products"]}) + "\n"
+                 
+            if chunk.content:
+                yield json.dumps({"type": "text", "content": chunk.content}) + "\n"
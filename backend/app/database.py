@@ -1,7 +1,10 @@
 import os
-from sqlalchemy import create_engine
+import logging
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+logger = logging.getLogger(__name__)
+
 # Database configuration with testing support
 # Priority: 1. DATABASE_URL env var, 2. SQLite for testing/local, 3. PostgreSQL default
 TESTING = os.getenv("TESTING", "0") == "1"
@@ -32,10 +35,51 @@ else:
 # Export flag for models.py to know whether to use PostgreSQL-specific types
 IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
 
+if IS_SQLITE:
+    # SQLite ignores foreign keys (and ON DELETE CASCADE) unless enabled per connection
+    @event.listens_for(engine, "connect")
+    def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def add_missing_columns(bind=None) -> list:
+    """
+    Add model columns that an existing table lacks (create_all only creates
+    missing tables, never columns). Only nullable columns can be added this
+    way; others are reported and skipped. Returns the "table.column" names added.
+    """
+    bind = bind or engine
+    inspector = inspect(bind)
+    quote = bind.dialect.identifier_preparer.quote
+    added = []
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            new_columns = set()
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable or column.primary_key:
+                    logger.warning("cannot add non-nullable column %s.%s; migrate it manually", table.name, column.name)
+                    continue
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+                new_columns.add(column.name)
+                added.append(f"{table.name}.{column.name}")
+            for index in table.indexes:
+                if new_columns and {column.name for column in index.columns} <= new_columns:
+                    index.create(conn)
+    if added:
+        logger.info("added columns: %s", ", ".join(added))
+    return added
+
 def get_db():
     db = SessionLocal()
     try:
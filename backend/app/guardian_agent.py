@@ -2,29 +2,50 @@
 LangGraph Guardian Orchestrator - Agentic RAG with Safety Gate
 
 This module implements a state-driven DAG orchestrator that:
-1. Retrieves user context (allergies, skin type, negative log)
-2. Searches for products using hybrid RAG
+1. Retrieves user context (allergies, skin type, negative log) and, in
+   parallel, searches for products using hybrid RAG
 3. Runs Safety Guard checks (Tier 1 Rule-Based + Tier 2 LLM)
 4. BLOCKS store/purchase recommendations if CRITICAL risk is detected
 5. Synthesizes final response with streaming support
 """
 
-from typing import TypedDict, Annotated, List, Dict, Optional, Literal
+from typing import TypedDict, Annotated, Callable, List, Dict, Optional, Literal
 import operator
+import os
 import json
-from langgraph.graph import StateGraph, END
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, BaseMessage
-from sqlalchemy.orm import Session
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+from langgraph.graph import StateGraph, START, END
+from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.config import get_stream_writer
+from sqlalchemy.orm import Session, selectinload, sessionmaker
 
 from . import models
 from . import rag
-from .services.conflict_rules import check_routine_conflicts, RiskLevel
+from .services.conflict_rules import check_mask_conflicts, RiskLevel
+from .services.rule_masks import current_mask, ingredients_mask
+from .services import safety_verdicts
+from .services.ingredients import parse_label_list
+from .services.shelf_ingredients import product_match_names
+from .services.telemetry import TurnMetrics
+from .services.metrics import REGISTRY
+from .services.cancellation import CancellationToken, TurnCancelled, CANCELLED_TURNS
 
 
 # ============================================================================
 # STATE DEFINITION (The "Backpack")
 # ============================================================================
 
+def merge_context(current: Dict, update: Dict) -> Dict:
+    """Reducer: parallel context branches each contribute part of user_context."""
+    return {**(current or {}), **(update or {})}
+
+
 class AgentState(TypedDict):
     """
     The state that flows through the entire agent execution graph.
@@ -35,10 +56,13 @@ class AgentState(TypedDict):
     user_id: int
     user_location: Optional[str]
     
-    # Context from ContextManager
-    user_context: Dict  # skin_type, allergies, blacklist, shelf_ingredients
+    # Context from ContextManager (profile and shelf branches are merged)
+    user_context: Annotated[Dict, merge_context]  # skin_type, allergies, blacklist, shelf_ingredients
+    
+    # Products from ProductRetriever (speculative, before skin_type is known)
+    speculative_products: List[Dict]
     
-    # Products from ProductRetriever
+    # Products filtered by the user's skin type
     candidate_products: List[Dict]
     
     # Safety payload from SafetyGuard
@@ -50,6 +74,9 @@ class AgentState(TypedDict):
     # Message history for LLM
     messages: Annotated[List[BaseMessage], operator.add]
     
+    # Nodes that ran out of budget and degraded: [{"node", "degradation"}]
+    degradations: Annotated[List[Dict], operator.add]
+    
     # Final output
     final_response: str
     response_chunks: List[str]  # For streaming
@@ -59,14 +86,13 @@ class AgentState(TypedDict):
 # NODE IMPLEMENTATIONS
 # ============================================================================
 
-def node_get_context(state: AgentState, db: Session) -> Dict:
+def node_get_profile(state: AgentState, db: Session) -> Dict:
     """
-    ContextManager Node: Fetches user's profile, allergies, and shelf ingredients.
-    This MUST run before any product search to set constraints.
+    ContextManager Node (profile branch): skin type, concerns and allergies.
+    This MUST complete before products are selected, to set constraints.
     """
     user_id = state["user_id"]
     
-    # 1. Fetch Profile
     user = db.query(models.User).filter(models.User.id == user_id).first()
     profile_data = {}
     if user and user.profile:
@@ -78,8 +104,27 @@ def node_get_context(state: AgentState, db: Session) -> Dict:
             "allergies": []  # Would come from medical history table
         }
     
-    # 2. Fetch Active Shelf Products + Their Ingredients
-    products = db.query(models.UserProduct).filter(
+    # Negative Log (Products that failed)
+    # This would be used for inverse deduction of ingredients to avoid
+    blacklist_ingredients = []
+    # TODO: Query from product_history or journal for failed products
+    
+    return {
+        "user_context": {
+            **profile_data,
+            "blacklist_ingredients": blacklist_ingredients
+        }
+    }
+
+
+def node_get_shelf(state: AgentState, db: Session) -> Dict:
+    """
+    ContextManager Node (shelf branch): active shelf products and their ingredients.
+    Independent of the profile, so it runs in parallel with it.
+    """
+    user_id = state["user_id"]
+    
+    products = db.query(models.UserProduct).options(selectinload(models.UserProduct.ingredient_rows)).filter(
         models.UserProduct.user_id == user_id,
         models.UserProduct.status == 'active'
     ).all()
@@ -87,140 +132,225 @@ def node_get_context(state: AgentState, db: Session) -> Dict:
     shelf_products = []
     shelf_ingredients = []
     for p in products:
+        ingredients = product_match_names(p)
         shelf_products.append({
             "name": p.product_name,
             "brand": p.brand,
-            "category": p.category
+            "category": p.category,
+            "ingredients": ingredients  # Judged pairwise by Tier 2
         })
-        # Extract ingredients from notes (temporary until dedicated column)
-        if p.notes and p.notes.startswith("Ingredients:"):
-            ingredients = p.notes.replace("Ingredients:", "").strip().split(", ")
-            shelf_ingredients.extend(ingredients)
-    
-    # 3. Fetch Negative Log (Products that failed)
-    # This would be used for inverse deduction of ingredients to avoid
-    blacklist_ingredients = []
-    # TODO: Query from product_history or journal for failed products
+        shelf_ingredients.extend(ingredients)
     
+    # Label entries, not canonical names: qualifiers like "(AHA)" match rules
+    shelf_ingredients = list(dict.fromkeys(shelf_ingredients))
+    shelf_rule_mask, rule_mask_version = ingredients_mask(shelf_ingredients)
     return {
         "user_context": {
-            **profile_data,
             "shelf_products": shelf_products,
-            "shelf_ingredients": list(set(shelf_ingredients)),
-            "blacklist_ingredients": blacklist_ingredients
+            "shelf_ingredients": shelf_ingredients,
+            "shelf_rule_mask": shelf_rule_mask,
+            "shelf_rule_mask_version": rule_mask_version
         }
     }
 
 
-def node_retrieve_products(state: AgentState, db: Session, llm) -> Dict:
+# Speculative retrieval fetches this many times the final limit, unfiltered,
+# so most skin-type selections can be served without a second search.
+RETRIEVAL_LIMIT = 5
+SPECULATIVE_FACTOR = 3
+
+
+def _product_payload(p) -> Dict:
+    """Product row -> dict with parsed metadata, evidence grade and ingredients."""
+    # Parse metadata
+    raw_meta = p.metadata_info
+    if isinstance(raw_meta, str):
+        try:
+            metadata = json.loads(raw_meta)
+        except (json.JSONDecodeError, TypeError):
+            metadata = {}
+    else:
+        metadata = raw_meta or {}
+    
+    # Evidence Grading based on source
+    # 🟢 Clinical Trial, 🟡 Dermatologist Consensus, 🔴 Anecdotal
+    evidence_grade = "🟡"  # Default to consensus
+    if "clinical" in str(p.description).lower():
+        evidence_grade = "🟢"
+    elif "review" in str(metadata).lower():
+        evidence_grade = "🔴"
+    
+    # Extract ingredients for safety checking (as labelled: qualifiers like "(AHA)" match rules)
+    ingredients = parse_label_list(getattr(p, 'ingredients_text', None))
+    
+    return {
+        "id": p.id,
+        "name": p.name,
+        "brand": p.brand,
+        "description": p.description,
+        "ingredients": ingredients,
+        "rule_mask": getattr(p, "rule_mask", None),
+        "rule_mask_version": getattr(p, "rule_mask_version", None),
+        "evidence_grade": evidence_grade,
+        "metadata": metadata
+    }
+
+
+def _product_payloads(rows) -> List[Dict]:
     """
-    ProductRetriever Node: Uses hybrid search with skin_type filter.
+    Payloads for product rows. Read-only: a missing or stale rule mask is
+    recomputed in memory by the safety gate (rule_masks.current_mask) and
+    persisted by the offline jobs (ingest, compute_product_conflicts.py), never
+    by committing the request's session.
+    """
+    return [_product_payload(p) for p in rows]
+
+
+def node_retrieve_products(state: AgentState, db: Session, llm, keyword_only: bool = False) -> Dict:
+    """
+    ProductRetriever Node: Speculative hybrid search, run in parallel with the
+    context branches. The skin_type is not known yet, so it searches unfiltered
+    with a wider limit; node_select_products applies the filter.
     Appends evidence grading to each product.
     """
     query = state["user_query"]
+    results = rag.hybrid_search(db, query, limit=RETRIEVAL_LIMIT * SPECULATIVE_FACTOR, keyword_only=keyword_only)
+    return {"speculative_products": _product_payloads(results)}
+
+
+def _skin_type_filter(state: AgentState) -> Dict:
     skin_type = state["user_context"].get("skin_type", "all")
-    
-    filters = {}
-    if skin_type and skin_type != "unknown":
-        filters["skin_type"] = skin_type
-    
-    results = rag.hybrid_search(db, query, filters=filters, limit=5)
-    
-    if not results:
-        return {"candidate_products": []}
-    
-    products = []
-    for p in results:
-        # Parse metadata
-        raw_meta = p.metadata_info
-        if isinstance(raw_meta, str):
-            try:
-                metadata = json.loads(raw_meta)
-            except (json.JSONDecodeError, TypeError):
-                metadata = {}
-        else:
-            metadata = raw_meta or {}
-        
-        # Evidence Grading based on source
-        # 🟢 Clinical Trial, 🟡 Dermatologist Consensus, 🔴 Anecdotal
-        evidence_grade = "🟡"  # Default to consensus
-        if "clinical" in str(p.description).lower():
-            evidence_grade = "🟢"
-        elif "review" in str(metadata).lower():
-            evidence_grade = "🔴"
-        
-        # Extract ingredients for safety checking
-        ingredients = []
-        if hasattr(p, 'ingredients_text') and p.ingredients_text:
-            ingredients = [i.strip() for i in p.ingredients_text.split(",")]
-        
-        products.append({
-            "id": p.id,
-            "name": p.name,
-            "brand": p.brand,
-            "description": p.description,
-            "ingredients": ingredients,
-            "evidence_grade": evidence_grade,
-            "metadata": metadata
-        })
-    
-    return {"candidate_products": products}
+    # "all"/"unknown" mean no constraint (as in the product_retriever tool)
+    if skin_type and skin_type not in ("all", "unknown"):
+        return {"skin_type": skin_type}
+    return {}
+
+
+def node_select_products(state: AgentState, db: Session) -> Dict:
+    """
+    Fan-in after context + speculative retrieval: keep the products matching
+    the user's skin_type (same predicate as the SQL filter, rag.metadata_matches).
+    If fewer than RETRIEVAL_LIMIT of the speculative results match, run the
+    filtered search the sequential graph used, so the answer never sees fewer
+    candidates than before; speculative matches it did not return are kept
+    after its results.
+    """
+    filters = _skin_type_filter(state)
+    speculative = state.get("speculative_products", [])
+    
+    if not filters:
+        return {"candidate_products": speculative[:RETRIEVAL_LIMIT]}
+    
+    matching = [p for p in speculative if rag.metadata_matches(p["metadata"], filters)]
+    if len(matching) >= RETRIEVAL_LIMIT:
+        return {"candidate_products": matching[:RETRIEVAL_LIMIT]}
+    
+    # Retrieval already ran out of budget on the vector search: stay on keywords
+    keyword_only = {"node": "retrieve_products", "degradation": "keyword_only"} in state.get("degradations", [])
+    results = _product_payloads(rag.hybrid_search(db, state["user_query"], filters=filters, limit=RETRIEVAL_LIMIT,
+                                                  keyword_only=keyword_only))
+    seen = {p["id"] for p in results}
+    merged = results + [p for p in matching if p.get("id") not in seen]
+    return {"candidate_products": merged[:RETRIEVAL_LIMIT]}
+
+
+# Severity order of safety_payload risk levels (UNKNOWN is reported separately)
+RISK_ORDER = {level: rank for rank, level in enumerate(safety_verdicts.RISK_LEVELS)}
 
 
-def node_safety_gate(state: AgentState, db: Session, llm) -> Dict:
+def node_safety_gate(state: AgentState, db: Session, llm, tier2_timeout: Optional[float] = None) -> Dict:
     """
     SafetyGuard Node: The Guardian.
     
     Tier 1: Deterministic rule-based checks (fast, <300ms)
-    Tier 2: LLM analysis for complex formulations (if Tier 1 passes)
-    
-    Returns risk_level: CRITICAL | WARNING | ADVICE | SAFE
+    Tier 2: LLM analysis for complex formulations (if Tier 1 passes),
+            judged and cached per (candidate, shelf product) pair
+            (services/safety_verdicts.py) and bounded by tier2_timeout;
+            past it the Tier-1 result stands and the turn records a
+            "tier1_only" degradation
+    
+    Returns risk_level: CRITICAL | WARNING | ADVICE | SAFE, or UNKNOWN when the
+    shelf could not be loaded (the check did not run; never reported as SAFE)
     """
     candidate_products = state.get("candidate_products", [])
-    shelf_ingredients = state.get("user_context", {}).get("shelf_ingredients", [])
+    user_context = state.get("user_context", {})
+    if user_context.get("shelf_unavailable"):
+        return _degraded("safety_gate", "unverified", {
+            "safety_payload": {
+                "risk_level": "UNKNOWN",
+                "conflicts": [],
+                "blocked": False,
+                "unverified": True
+            }
+        })
+    shelf_ingredients = user_context.get("shelf_ingredients", [])
     
     all_conflicts = []
     highest_risk = "SAFE"
+    unflagged = []
     
-    for product in candidate_products:
-        product_ingredients = product.get("ingredients", [])
-        
-        if not product_ingredients:
-            continue
-        
-        # TIER 1: Rule-Based Checks
-        conflicts = check_routine_conflicts(product_ingredients, shelf_ingredients)
-        
+    def raise_risk(risk_level):
+        nonlocal highest_risk
+        if RISK_ORDER.get(risk_level, 0) > RISK_ORDER[highest_risk]:
+            highest_risk = risk_level
+    
+    def record(product, conflicts):
         for conflict in conflicts:
-            conflict["product_name"] = product["name"]
+            conflict = {**conflict, "product_name": product["name"]}
             all_conflicts.append(conflict)
-            
-            # Track highest risk level
-            if conflict["risk_level"] == "CRITICAL":
-                highest_risk = "CRITICAL"
-            elif conflict["risk_level"] == "WARNING" and highest_risk != "CRITICAL":
-                highest_risk = "WARNING"
-            elif conflict["risk_level"] == "ADVICE" and highest_risk == "SAFE":
-                highest_risk = "ADVICE"
+            raise_risk(conflict["risk_level"])
     
-    # TIER 2: LLM Analysis (only if Tier 1 didn't find CRITICAL)
-    # This would analyze complex interactions not in the rule database
-    if highest_risk != "CRITICAL" and candidate_products:
-        # TODO: Implement LLM-based INCI analysis for edge cases
-        pass
+    # TIER 1: Rule-Based Checks, as bitwise ANDs of precomputed rule-side masks
+    # (recomputed here only if they predate the current rule set)
+    shelf_mask = current_mask(user_context.get("shelf_rule_mask"),
+                              user_context.get("shelf_rule_mask_version"), shelf_ingredients)
+    for product in candidate_products:
+        if not product.get("ingredients"):
+            continue
+        product_mask = current_mask(product.get("rule_mask"), product.get("rule_mask_version"),
+                                    product["ingredients"])
+        conflicts = check_mask_conflicts(product_mask, shelf_mask) if shelf_mask else []
+        if conflicts:
+            record(product, conflicts)
+        else:
+            unflagged.append(product)
     
-    return {
+    # TIER 2: LLM Analysis (only if Tier 1 didn't find CRITICAL)
+    # Covers interactions not in the rule database, for the products Tier 1
+    # did not flag, against each shelf product. Verdicts are cached per pair, so
+    # the LLM is only called for pairs it has not seen yet.
+    tier2_degraded = False
+    shelf_products = [p for p in user_context.get("shelf_products", []) if p.get("ingredients")]
+    if highest_risk != "CRITICAL" and unflagged and shelf_products and llm is not None \
+            and safety_verdicts.tier2_enabled():
+        if tier2_timeout is not None and tier2_timeout <= 0:
+            verdicts, tier2_degraded = [], True
+        else:
+            try:
+                verdicts = safety_verdicts.tier2_verdicts(llm, unflagged, shelf_products, db,
+                                                          timeout=tier2_timeout)
+            except safety_verdicts.Tier2TimedOut as e:
+                verdicts, tier2_degraded = e.verdicts, True
+        for product, verdict in verdicts:
+            record(product, verdict["conflicts"])
+            raise_risk(verdict["risk_level"])  # A verdict may rate the pair without itemizing
+    
+    update = {
         "safety_payload": {
             "risk_level": highest_risk,
             "conflicts": all_conflicts,
             "blocked": highest_risk == "CRITICAL"
         }
     }
+    if tier2_degraded:
+        return _degraded("safety_gate", "tier1_only", update)
+    return update
 
 
 def node_store_locator(state: AgentState) -> Dict:
     """
-    StoreLocator Node: Only runs if SafetyGuard allows.
+    StoreLocator Node: Runs in parallel with SafetyGuard; its results are
+    discarded if the Guardian blocks (CRITICAL).
     Uses Google Places API to find nearby stores.
     """
     from .tools.store_locator import store_locator
@@ -228,7 +358,7 @@ def node_store_locator(state: AgentState) -> Dict:
     user_location = state.get("user_location", "")
     products = state.get("candidate_products", [])
     
-    if not products or not user_location:
+    if not products or not user_location or not wants_store(state):
         return {"store_results": []}
     
     # Search for first product
@@ -260,18 +390,26 @@ def node_synthesis_warning(state: AgentState, llm) -> Dict:
     
     return {
         "final_response": warning_text,
-        "response_chunks": [warning_text]
+        "response_chunks": [warning_text],
+        "store_results": []  # Never point a blocked user to a store
     }
 
 
-def node_synthesis_response(state: AgentState, llm) -> Dict:
+UNVERIFIED_NOTICE = ("⚠️ I couldn't load your shelf just now, so these suggestions were NOT checked "
+                     "for conflicts with your routine.\n\n")
+
+
+def node_synthesis_response(state: AgentState, llm, on_token: Optional[Callable] = None) -> Dict:
     """
     Synthesis Node (ALLOWED): Generates the final helpful response.
-    Streams tokens for real-time UX.
+    Streams tokens for real-time UX: each chunk is passed to `on_token`
+    as it arrives (the graph forwards them to run_stream).
     """
     products = state.get("candidate_products", [])
     safety = state.get("safety_payload", {})
-    stores = state.get("store_results", [])
+    unverified = safety.get("unverified", False)
+    # Never point the user to a store for products that were not safety-checked
+    stores = [] if unverified else state.get("store_results", [])
     context = state.get("user_context", {})
     query = state.get("user_query", "")
     
@@ -291,6 +429,10 @@ Found Products:
         for c in safety["conflicts"]:
             prompt += f"- {c['ingredient_a']} + {c['ingredient_b']}: {c['recommended_adjustment']}\n"
     
+    if unverified:
+        prompt += ("\n⚠️ These products could NOT be checked against the user's shelf. "
+                   "Do not call them safe for their routine.\n")
+    
     if stores:
         prompt += f"\nNearby stores: {stores[0].get('name', 'Available locally')}\n"
     
@@ -302,12 +444,31 @@ Found Products:
         HumanMessage(content=prompt)
     ]
     
+    notice = UNVERIFIED_NOTICE if unverified else ""
+    
+    if on_token is not None and hasattr(llm, "stream"):
+        chunks = []
+        if notice:
+            chunks.append(notice)
+            on_token(AIMessageChunk(content=notice))
+        for chunk in llm.stream(messages):
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            if text:
+                chunks.append(text)
+                on_token(chunk)
+        return {
+            "final_response": "".join(chunks),
+            "response_chunks": chunks,
+            "store_results": stores
+        }
+    
     response = llm.invoke(messages)
-    final_text = response.content if hasattr(response, 'content') else str(response)
+    final_text = notice + (response.content if hasattr(response, 'content') else str(response))
     
     return {
         "final_response": final_text,
-        "response_chunks": [final_text]
+        "response_chunks": [final_text],
+        "store_results": stores
     }
 
 
@@ -315,98 +476,372 @@ Found Products:
 # GUARDIAN ROUTER (Conditional Edges)
 # ============================================================================
 
-def safety_guard_router(state: AgentState) -> Literal["blocked", "store", "synthesis"]:
+def wants_store(state: AgentState) -> bool:
+    """Does the user want store/buying info?"""
+    query = state.get("user_query", "").lower()
+    location_keywords = ["buy", "near me", "store", "where", "purchase", "get"]
+    return any(keyword in query for keyword in location_keywords)
+
+
+def safety_guard_router(state: AgentState) -> Literal["blocked", "synthesis"]:
     """
     The Guardian: Routes based on safety check results.
     
-    CRITICAL → blocked (cannot proceed)
-    User wants location → store → synthesis
-    Otherwise → synthesis
+    CRITICAL → blocked (cannot proceed; store results are discarded)
+    Otherwise → synthesis (with store results, if they were requested; an
+    UNKNOWN risk drops them and the answer says the check did not run)
     """
     risk = state.get("safety_payload", {}).get("risk_level", "SAFE")
-    query = state.get("user_query", "").lower()
     
     # GUARDIAN LOGIC: Block if CRITICAL
     if risk == "CRITICAL":
         return "blocked"
     
-    # Check if user wants store/buying info
-    location_keywords = ["buy", "near me", "store", "where", "purchase", "get"]
-    if any(keyword in query for keyword in location_keywords):
-        return "store"
-    
     return "synthesis"
 
 
+# ============================================================================
+# DEADLINES & NODE BUDGETS
+# ============================================================================
+
+# Each invocation carries a request deadline (GUARDIAN_DEADLINE_SECONDS) and
+# every I/O node a budget (GUARDIAN_BUDGET_<NODE>, seconds), capped by the time
+# left before the deadline. A node over budget degrades instead of waiting:
+#   get_profile / get_shelf -> last known context for the user; with no shelf
+#                              at all the safety gate reports risk UNKNOWN
+#                              (fails closed: never treated as an empty shelf)
+#   retrieve_products       -> keyword-only search (no embedding call)
+#   store_locator           -> skipped
+#   safety_tier2            -> the safety gate keeps its Tier-1 result (the
+#                              rule checks themselves always run)
+# synthesis never degrades. Degradations are recorded in the
+# state (and streamed) so responses produced under pressure are visible.
+
+DEFAULT_DEADLINE_SECONDS = 10.0
+DEFAULT_NODE_BUDGETS = {
+    "get_profile": 0.5,
+    "get_shelf": 0.5,
+    "retrieve_products": 2.0,
+    "store_locator": 1.5,
+    "safety_tier2": 3.0,
+}
+
+GUARDIAN_DEGRADATIONS = REGISTRY.counter(
+    "guardian_degradations_total", "Guardian nodes that exceeded their budget and degraded", ["node", "degradation"])
+
+# Budgeted work runs in one small pool per node; a timed-out task is abandoned
+# (it finishes in the background with its own DB session) and the node
+# degrades. Abandoned tasks keep their slot until they finish, so a node whose
+# slots are all taken degrades at once instead of queueing behind them, and a
+# hanging dependency (e.g. the embedding API) cannot starve the other nodes.
+BUDGET_WORKERS_PER_NODE = int(os.getenv("GUARDIAN_BUDGET_WORKERS", "8"))
+_budget_pools: Dict[str, ThreadPoolExecutor] = {}
+_budget_slots: Dict[str, threading.BoundedSemaphore] = {}
+_budget_pools_lock = threading.Lock()
+
+
+class BudgetExceeded(TimeoutError):
+    """A node did not finish within its budget (or the request deadline passed)."""
+
+
+def node_budgets_from_env() -> Dict[str, float]:
+    return {
+        node: float(os.getenv(f"GUARDIAN_BUDGET_{node.upper()}", default))
+        for node, default in DEFAULT_NODE_BUDGETS.items()
+    }
+
+
+def _remaining_budget(config: RunnableConfig, node: str) -> float:
+    configurable = config["configurable"]
+    budget = (configurable.get("node_budgets") or {}).get(node, float("inf"))
+    deadline = configurable.get("deadline")
+    if deadline is not None:
+        budget = min(budget, deadline - time.monotonic())
+    return budget
+
+
+def _budget_pool(node: str):
+    with _budget_pools_lock:
+        if node not in _budget_pools:
+            _budget_pools[node] = ThreadPoolExecutor(
+                max_workers=BUDGET_WORKERS_PER_NODE, thread_name_prefix=f"guardian-{node}")
+            _budget_slots[node] = threading.BoundedSemaphore(BUDGET_WORKERS_PER_NODE)
+        return _budget_pools[node], _budget_slots[node]
+
+
+def _run_within_budget(config: RunnableConfig, node: str, fn: Callable):
+    """
+    Run fn() within the node's budget; raises BudgetExceeded if it takes longer,
+    or right away if the node's workers are all busy (never queued).
+    """
+    budget = _remaining_budget(config, node)
+    if budget == float("inf"):
+        return fn()
+    if budget <= 0:
+        raise BudgetExceeded(node)
+    pool, slots = _budget_pool(node)
+    if not slots.acquire(blocking=False):
+        raise BudgetExceeded(node)
+    future = pool.submit(fn)
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=budget)
+    except FutureTimeout:
+        raise BudgetExceeded(node)
+
+
+def _degraded(node: str, degradation: str, update: Dict) -> Dict:
+    GUARDIAN_DEGRADATIONS.inc(node=node, degradation=degradation)
+    return {**update, "degradations": [{"node": node, "degradation": degradation}]}
+
+
+class ContextCache:
+    """Last successfully loaded context branch per user, for degraded turns."""
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return entry[0]
+
+    def set(self, key: tuple, value: Dict):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+context_cache = ContextCache()
+
+
+def _load_context(config: RunnableConfig, node: str, user_id: int, load: Callable,
+                  unavailable: Optional[Dict] = None) -> Dict:
+    """
+    Load a context branch within budget, falling back to the cached copy, else
+    to `unavailable` (the user_context keys that mark the branch as missing).
+    """
+    try:
+        result = _run_within_budget(config, node, load)
+    except BudgetExceeded:
+        cached = context_cache.get((node, user_id))
+        if cached is not None:
+            return _degraded(node, "cached_context", cached)
+        return _degraded(node, "context_unavailable", {"user_context": dict(unavailable or {})})
+    context_cache.set((node, user_id), result)
+    return result
+
+
 # ============================================================================
 # GRAPH BUILDER
 # ============================================================================
 
-def create_guardian_graph(db: Session, llm):
+def guardian_config(db: Session, llm, session_factory=None,
+                    node_budgets: Optional[Dict[str, float]] = None) -> RunnableConfig:
+    """
+    Per-invocation config carrying the request's DB session and LLM to the nodes.
+    Parallel branches open their own sessions from `session_factory` (a
+    Session is not thread-safe); by default it is bound to db's engine.
+    """
+    if session_factory is None and db is not None:
+        session_factory = sessionmaker(bind=db.get_bind(), autocommit=False, autoflush=False)
+    return {"configurable": {
+        "db": db,
+        "llm": llm,
+        "session_factory": session_factory,
+        "node_budgets": node_budgets if node_budgets is not None else node_budgets_from_env(),
+        "deadline": None,  # Set per invocation (time.monotonic() based)
+        "node_timings": {},
+    }}
+
+
+def _db(config: RunnableConfig) -> Session:
+    return config["configurable"]["db"]
+
+
+def _llm(config: RunnableConfig):
+    return config["configurable"]["llm"]
+
+
+@contextmanager
+def _branch_session(config: RunnableConfig):
+    """A private session for a node that runs in parallel with other DB nodes."""
+    factory = config["configurable"].get("session_factory")
+    if factory is None:
+        yield _db(config)
+        return
+    db = factory()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _timed(name: str):
+    """
+    Record a node's own duration in the invocation's node_timings (parallel
+    nodes finish in the same step, so stream event times can't be used).
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(state: AgentState, config: RunnableConfig) -> Dict:
+            started = time.perf_counter()
+            try:
+                return fn(state, config)
+            finally:
+                timings = config["configurable"].get("node_timings")
+                if timings is not None:
+                    timings[name] = time.perf_counter() - started
+        return wrapper
+    return decorator
+
+
+# Node wrappers: resolve db/llm from the invocation config, so the compiled
+# graph holds no per-request state and can be shared by every request.
+@_timed("get_profile")
+def profile_node(state: AgentState, config: RunnableConfig) -> Dict:
+    def load():
+        with _branch_session(config) as db:
+            return node_get_profile(state, db)
+    return _load_context(config, "get_profile", state["user_id"], load)
+
+
+@_timed("get_shelf")
+def shelf_node(state: AgentState, config: RunnableConfig) -> Dict:
+    def load():
+        with _branch_session(config) as db:
+            return node_get_shelf(state, db)
+    return _load_context(config, "get_shelf", state["user_id"], load, unavailable={"shelf_unavailable": True})
+
+
+@_timed("retrieve_products")
+def retrieve_node(state: AgentState, config: RunnableConfig) -> Dict:
+    def search(keyword_only: bool = False):
+        with _branch_session(config) as db:
+            return node_retrieve_products(state, db, _llm(config), keyword_only=keyword_only)
+    try:
+        return _run_within_budget(config, "retrieve_products", search)
+    except BudgetExceeded:
+        return _degraded("retrieve_products", "keyword_only", search(keyword_only=True))
+
+
+@_timed("select_products")
+def select_node(state: AgentState, config: RunnableConfig) -> Dict:
+    return node_select_products(state, _db(config))
+
+
+@_timed("safety_gate")
+def safety_node(state: AgentState, config: RunnableConfig) -> Dict:
+    budget = _remaining_budget(config, "safety_tier2")
+    with _branch_session(config) as db:
+        return node_safety_gate(state, db, _llm(config),
+                                tier2_timeout=None if budget == float("inf") else budget)
+
+
+@_timed("store_locator")
+def store_node(state: AgentState, config: RunnableConfig) -> Dict:
+    if not wants_store(state):
+        return {"store_results": []}
+    try:
+        return _run_within_budget(config, "store_locator", lambda: node_store_locator(state))
+    except BudgetExceeded:
+        return _degraded("store_locator", "skipped", {"store_results": []})
+
+
+def guardian_join(state: AgentState) -> Dict:
+    """Fan-in of safety_gate and store_locator; routing happens on its edges."""
+    return {}
+
+
+@_timed("synthesis_warning")
+def warning_node(state: AgentState, config: RunnableConfig) -> Dict:
+    return node_synthesis_warning(state, _llm(config))
+
+
+@_timed("synthesis_response")
+def response_node(state: AgentState, config: RunnableConfig) -> Dict:
+    # Tokens go out on the graph's "custom" stream as they are generated
+    writer = get_stream_writer()
+    cancel_token = config["configurable"].get("cancel_token")
+    
+    def on_token(chunk):
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()  # stops the provider stream
+        writer({"type": "token", "chunk": chunk})
+    
+    writer({"type": "synthesis_started"})
+    return node_synthesis_response(state, _llm(config), on_token=on_token)
+
+
+def create_guardian_graph():
     """
     Creates the LangGraph DAG with Guardian safety gate.
+    The db session and LLM are passed per invocation via guardian_config().
     
-    Flow:
-    START → get_context → retrieve_products → safety_gate
+    Flow (branches on one line run in parallel):
+    START → get_profile | get_shelf | retrieve_products (speculative)
+          → select_products
+          → safety_gate | store_locator
+          → guardian
           ↓
-    [CRITICAL] → synthesis_warning → END
-    [SAFE + location] → store_locator → synthesis → END
+    [CRITICAL] → synthesis_warning → END   (store results discarded)
     [SAFE] → synthesis → END
+    [UNKNOWN] → synthesis → END            (shelf unavailable: store results
+                                            discarded, answer flags the gap)
     """
-    
-    # Create node wrappers that inject db and llm
-    def context_node(state):
-        return node_get_context(state, db)
-    
-    def retrieve_node(state):
-        return node_retrieve_products(state, db, llm)
-    
-    def safety_node(state):
-        return node_safety_gate(state, db, llm)
-    
-    def store_node(state):
-        return node_store_locator(state)
-    
-    def warning_node(state):
-        return node_synthesis_warning(state, llm)
-    
-    def response_node(state):
-        return node_synthesis_response(state, llm)
-    
     # Build graph
     workflow = StateGraph(AgentState)
     
     # Add nodes
-    workflow.add_node("get_context", context_node)
+    workflow.add_node("get_profile", profile_node)
+    workflow.add_node("get_shelf", shelf_node)
     workflow.add_node("retrieve_products", retrieve_node)
+    workflow.add_node("select_products", select_node)
     workflow.add_node("safety_gate", safety_node)
     workflow.add_node("store_locator", store_node)
+    workflow.add_node("guardian", guardian_join)
     workflow.add_node("synthesis_warning", warning_node)
     workflow.add_node("synthesis_response", response_node)
     
-    # Define edges
-    workflow.set_entry_point("get_context")
-    workflow.add_edge("get_context", "retrieve_products")
-    workflow.add_edge("retrieve_products", "safety_gate")
+    # Fan-out: context branches and speculative retrieval are independent
+    for branch in ("get_profile", "get_shelf", "retrieve_products"):
+        workflow.add_edge(START, branch)
+    workflow.add_edge(["get_profile", "get_shelf", "retrieve_products"], "select_products")
     
-    # Conditional edge from safety_gate (THE GUARDIAN)
+    # Store lookup runs alongside the safety check
+    workflow.add_edge("select_products", "safety_gate")
+    workflow.add_edge("select_products", "store_locator")
+    workflow.add_edge(["safety_gate", "store_locator"], "guardian")
+    
+    # Conditional edge after the fan-in (THE GUARDIAN)
     workflow.add_conditional_edges(
-        "safety_gate",
+        "guardian",
         safety_guard_router,
         {
             "blocked": "synthesis_warning",
-            "store": "store_locator",
             "synthesis": "synthesis_response"
         }
     )
     
-    workflow.add_edge("store_locator", "synthesis_response")
     workflow.add_edge("synthesis_warning", END)
     workflow.add_edge("synthesis_response", END)
     
     return workflow.compile()
 
 
+@lru_cache(maxsize=1)
+def get_guardian_graph():
+    """The compiled guardian graph, built once per process and shared by all requests."""
+    return create_guardian_graph()
+
+
 # ============================================================================
 # AGENT CLASS (Public Interface)
 # ============================================================================
@@ -416,10 +851,22 @@ class GuardianAgent:
     The Guardian Agent - A safety-first LangGraph orchestrator.
     """
     
-    def __init__(self, llm, db_session: Session):
+    def __init__(self, llm, db_session: Session, deadline_seconds: float = None,
+                 node_budgets: Dict[str, float] = None):
         self.db = db_session
         self.llm = llm
-        self.graph = create_guardian_graph(db_session, llm)
+        self.graph = get_guardian_graph()
+        self.config = guardian_config(db_session, llm, node_budgets=node_budgets)
+        self.deadline_seconds = deadline_seconds or float(
+            os.getenv("GUARDIAN_DEADLINE_SECONDS", str(DEFAULT_DEADLINE_SECONDS)))
+    
+    def _invocation_config(self) -> RunnableConfig:
+        """self.config with this run's deadline and fresh node timings."""
+        return {"configurable": {
+            **self.config["configurable"],
+            "deadline": time.monotonic() + self.deadline_seconds,
+            "node_timings": {},
+        }}
     
     def run(self, user_query: str, user_id: int, user_location: str = None) -> Dict:
         """
@@ -431,64 +878,121 @@ class GuardianAgent:
             "user_id": user_id,
             "user_location": user_location,
             "user_context": {},
+            "speculative_products": [],
             "candidate_products": [],
             "safety_payload": {},
             "store_results": [],
+            "degradations": [],
             "messages": [],
             "final_response": "",
             "response_chunks": []
         }
         
-        final_state = self.graph.invoke(initial_state)
+        final_state = self.graph.invoke(initial_state, self._invocation_config())
         return final_state
     
-    def run_stream(self, user_query: str, user_id: int, user_location: str = None):
+    def run_stream(self, user_query: str, user_id: int, user_location: str = None, include_metrics: bool = False, cancel_token: CancellationToken = None):
         """
         Stream execution for real-time UX.
         Yields JSON chunks for frontend consumption.
+        Node durations are published to the server-side histograms; with
+        include_metrics a trailing {"type": "metrics"} event is emitted.
+        Synthesis tokens are emitted as individual text events, after any
+        products and safety alerts. Nodes that exceeded their budget emit
+        {"type": "degraded"} events.
+        A cancelled cancel_token stops the graph before its next node (or token).
         """
         import json
         
+        turn = TurnMetrics(model=getattr(self.llm, "model_name", None) or type(self.llm).__name__)
+        config = self._invocation_config()
+        node_timings = config["configurable"]["node_timings"]
+        
         initial_state = {
             "user_query": user_query,
             "user_id": user_id,
             "user_location": user_location,
             "user_context": {},
+            "speculative_products": [],
             "candidate_products": [],
             "safety_payload": {},
             "store_results": [],
+            "degradations": [],
             "messages": [],
             "final_response": "",
             "response_chunks": []
         }
         
-        # Stream through graph
-        for event in self.graph.stream(initial_state):
-            node_name = list(event.keys())[0]
-            node_output = event[node_name]
-            
-            # Yield safety alerts immediately
-            if "safety_payload" in node_output:
-                payload = node_output["safety_payload"]
-                if payload.get("blocked"):
+        # Stream through graph: node updates, plus synthesis tokens as they arrive
+        config["configurable"]["cancel_token"] = cancel_token
+        streamed_tokens = False
+        try:
+            for mode, event in self.graph.stream(initial_state, config, stream_mode=["updates", "custom"]):
+                if cancel_token is not None and cancel_token.cancelled:
+                    stage = "synthesis_response" if mode == "custom" else next(iter(event))
+                    CANCELLED_TURNS.inc(model=turn.model, stage=stage)
+                    return
+                
+                if mode == "custom":
+                    if event.get("type") == "synthesis_started":
+                        turn.start_synthesis()
+                    elif event.get("type") == "token":
+                        chunk = event["chunk"]
+                        turn.mark_first_token()
+                        turn.record_synthesis_chunk(chunk)
+                        streamed_tokens = True
+                        yield json.dumps({
+                            "type": "text",
+                            "content": chunk.content if hasattr(chunk, "content") else str(chunk)
+                        }) + "\n"
+                    continue
+                
+                node_name = list(event.keys())[0]
+                node_output = event[node_name] or {}
+                
+                # Nodes time themselves (parallel branches finish in the same step)
+                if node_name in node_timings:
+                    turn.record_node(node_name, node_timings[node_name])
+                
+                # Tell the client when an answer was built from degraded inputs
+                if node_output.get("degradations"):
+                    turn.degradations.extend(node_output["degradations"])
                     yield json.dumps({
-                        "type": "safety_alert",
-                        "risk_level": payload["risk_level"],
-                        "conflicts": payload["conflicts"]
+                        "type": "degraded",
+                        "content": node_output["degradations"]
                     }) + "\n"
-            
-            # Yield products when found
-            if "candidate_products" in node_output:
-                products = node_output["candidate_products"]
-                if products:
+                
+                # Yield safety alerts immediately
+                if "safety_payload" in node_output:
+                    payload = node_output["safety_payload"]
+                    if payload.get("blocked") or payload.get("unverified"):
+                        yield json.dumps({
+                            "type": "safety_alert",
+                            "risk_level": payload["risk_level"],
+                            "conflicts": payload["conflicts"],
+                            "unverified": payload.get("unverified", False)
+                        }) + "\n"
+                
+                # Yield products when found
+                if "candidate_products" in node_output:
+                    products = node_output["candidate_products"]
+                    if products:
+                        yield json.dumps({
+                            "type": "products",
+                            "content": products
+                        }) + "\n"
+                
+                # Yield final response (unless it was already streamed token by token)
+                if "final_response" in node_output and not streamed_tokens:
+                    turn.mark_first_token()
                     yield json.dumps({
-                        "type": "products",
-                        "content": products
+                        "type": "text",
+                        "content": node_output["final_response"]
                     }) + "\n"
-            
-            # Yield final response
-            if "final_response" in node_output:
-                yield json.dumps({
-                    "type": "text",
-                    "content": node_output["final_response"]
-                }) + "\n"
+        except TurnCancelled:
+            CANCELLED_TURNS.inc(model=turn.model, stage="synthesis_response")
+            return
+        
+        turn.publish()
+        if include_metrics:
+            yield turn.to_event()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, JSON
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, Text, DateTime, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base, IS_SQLITE
@@ -31,6 +31,7 @@ class User(Base):
     routine_items = relationship("RoutineItem", back_populates="user")
     routine_logs = relationship("RoutineLog", back_populates="user")
     journal_entries = relationship("JournalEntry", back_populates="user")
+    routine_profile = relationship("RoutineProfile", uselist=False, cascade="all, delete-orphan")
 
 class Profile(Base):
     __tablename__ = "profiles"
@@ -85,6 +86,22 @@ class UserProduct(Base):
 
     user = relationship("User", back_populates="products")
     routine_steps = relationship("RoutineItem", back_populates="user_product")
+    ingredient_rows = relationship(
+        "UserProductIngredient", back_populates="user_product",
+        order_by="UserProductIngredient.position", cascade="all, delete-orphan")
+
+class UserProductIngredient(Base):
+    """One ingredient of a shelf product, canonical and as labelled (services/shelf_ingredients.py)."""
+    __tablename__ = "user_product_ingredients"
+    __table_args__ = (Index("ix_user_product_ingredients_name_product", "name", "user_product_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_product_id = Column(Integer, ForeignKey("user_products.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, default=0)  # Order on the label
+    name = Column(String, nullable=False)  # Canonical INCI name, e.g. "NIACINAMIDE"
+    label = Column(String, nullable=True)  # As written on the label, e.g. "Mandelic Acid (AHA)"; rules match this
+
+    user_product = relationship("UserProduct", back_populates="ingredient_rows")
 
 class RoutineItem(Base):
     __tablename__ = "routine_items"
@@ -165,6 +182,10 @@ class Product(Base):
     source_id = Column(String, nullable=True) # ID in external system
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
+    # Safety Guard: matched conflict-rule sides (hex bitmask) and the rules version it was computed for
+    rule_mask = Column(String, nullable=True)
+    rule_mask_version = Column(String, nullable=True)
+
     reviews = relationship("Review", back_populates="product")
 
 class Review(Base):
@@ -205,3 +226,46 @@ class JournalEntry(Base):
     tags = Column(JSON, nullable=True) # e.g. ["breakout", "dryness"]
     
     user = relationship("User", back_populates="journal_entries")
+
+class SafetyVerdict(Base):
+    """Cached Tier-2 (LLM) safety verdict for an ingredient-set fingerprint."""
+    __tablename__ = "safety_verdicts"
+
+    id = Column(Integer, primary_key=True, index=True)
+    fingerprint = Column(String, unique=True, index=True)  # sha256 of (candidate, shelf product) INCI sets
+    risk_level = Column(String)  # CRITICAL | WARNING | ADVICE | SAFE
+    conflicts = Column(JSON, nullable=True)
+    model = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime, index=True)  # UTC
+
+class ProductConflict(Base):
+    """A conflicting pair of catalogue products (materialized by the product conflicts job)."""
+    __tablename__ = "product_conflicts"
+    __table_args__ = (Index("ix_product_conflicts_pair", "product_id", "other_product_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    # product_id < other_product_id; ingredient_a is on product_id's side
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    other_product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
+    risk_level = Column(String, index=True)
+    ingredient_a = Column(String)
+    ingredient_b = Column(String)
+    interaction_type = Column(String)
+    reasoning = Column(Text)
+    recommended_adjustment = Column(Text)
+    source = Column(String)
+    rules_version = Column(String)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class RoutineProfile(Base):
+    """Per-user ingredient profile of the active routine (services/routine_profile.py)."""
+    __tablename__ = "routine_profiles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), unique=True, index=True)
+    # {label entry: number of active routine items whose product contains it}
+    ingredient_counts = Column(JSON, nullable=False, default=dict)
+    rule_mask = Column(String, nullable=True)  # Matched conflict-rule sides (hex), see services/rule_masks.py
+    rule_mask_version = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
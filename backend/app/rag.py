@@ -9,16 +9,16 @@ def get_mock_embedding(text):
     vec = np.random.rand(1536)
     return vec / np.linalg.norm(vec)
 
-def hybrid_search(db: Session, query_text: str, filters: dict = None, limit: int = 5):
+def hybrid_search(db: Session, query_text: str, filters: dict = None, limit: int = 5, keyword_only: bool = False):
     """
     Performs Hybrid Search:
     1. Filter by Metadata (exact match)
-    2. Vector Search (Semantic) - PostgreSQL only
+    2. Vector Search (Semantic) - PostgreSQL only, skipped if keyword_only
     3. Keyword Search (SQLite fallback)
     """
     
     # 1. VECTOR SEARCH (PostgreSQL only)
-    if not IS_SQLITE:
+    if not IS_SQLITE and not keyword_only:
         try:
             # Generate embedding for the query
             from langchain_openai import OpenAIEmbeddings
@@ -88,5 +88,16 @@ def hybrid_search(db: Session, query_text: str, filters: dict = None, limit: int
         
     return []
 
+def metadata_matches(metadata: dict, filters: dict) -> bool:
+    """
+    In-memory form of hybrid_search's metadata filter: every filtered key holds
+    exactly that string (a missing key, null, number or list does not match).
+    """
+    metadata = metadata or {}
+    return all(
+        isinstance(metadata.get(key), str) and metadata[key] == str(value)
+        for key, value in filters.items()
+    )
+
 def get_product_by_name(db: Session, name: str):
     return db.query(Product).filter(Product.name.ilike(f"%{name}%")).first()
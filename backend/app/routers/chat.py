@@ -5,6 +5,17 @@ from pydantic import BaseModel
 from typing import List, Optional
 from .. import database
 from ..agent import SkincareAgent
+from ..tools.memo import conversation_memos
+from ..services.llm_limiter import get_limiter, LimiterOverloaded, LimitedChatModel
+from ..services.llm_router import HedgedChatModel, ProviderRoute
+from ..services.cancellation import CancellationToken, stream_until_disconnect
+from ..services.idempotency import (
+    idempotency_keys,
+    IdempotencyConflict,
+    RecordedStream,
+    request_fingerprint,
+    IDEMPOTENT_DUPLICATES,
+)
 import os
 
 router = APIRouter(prefix="/chat", tags=["chat"])
@@ -18,14 +29,41 @@ class ChatRequest(BaseModel):
     history: Optional[List[ChatMessage]] = []
     user_location: Optional[str] = None
     image_base64: Optional[str] = None  # Base64 encoded image for vision analysis
+    conversation_id: Optional[str] = None  # Scopes tool-result memoization across turns
+    include_metrics: bool = False  # Append a trailing {"type": "metrics"} event
 
 from ..dependencies import get_current_user
 from .. import models
 
+def _google_llm(api_key: str):
+    """Google Generative AI (BYOK) chat model."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model="gemini-pro",
+        google_api_key=api_key,
+        temperature=0, 
+        convert_system_message_to_human=True 
+    )
+
+def _follow_response(turn: RecordedStream, replayed: bool = False) -> StreamingResponse:
+    """Stream a (possibly shared) recorded chat turn to one client."""
+    stop = CancellationToken()
+    return StreamingResponse(
+        stream_until_disconnect(turn.follow(stop), stop),
+        media_type="application/x-ndjson",
+        headers={"Idempotent-Replayed": "true"} if replayed else None
+    )
+
+def _abandon_turn(scope: tuple, turn: RecordedStream, error: BaseException):
+    """Forget a keyed turn that failed before it started, so a retry can run it."""
+    idempotency_keys.discard(scope, turn)
+    turn.abort(error)
+
 @router.post("/")
 def chat_endpoint(
     request: ChatRequest, 
     x_goog_api_key: str = Header(None, alias="X-Goog-Api-Key"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(database.get_db)
 ):
@@ -34,9 +72,25 @@ def chat_endpoint(
     Supports:
     - Google Generative AI (X-Goog-Api-Key header)
     - OpenAI-compatible APIs (OPENAI_API_KEY + OPENAI_BASE_URL env vars)
+    - Hedged failover to OPENAI_SECONDARY_BASE_URL and/or the Google key when
+      more than one provider is configured
     - Mock for testing (key starting with 'mock_')
+    - Idempotency-Key header: retries attach to the running turn or replay it
     """
+    turn = None
+    idempotency_scope = ("chat", current_user.id, idempotency_key)
     try:
+        if idempotency_key:
+            try:
+                turn, created = idempotency_keys.get_or_create(
+                    idempotency_scope, request_fingerprint(request.dict()), RecordedStream
+                )
+            except IdempotencyConflict as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            if not created:
+                IDEMPOTENT_DUPLICATES.inc(scope="chat", outcome="replayed" if turn.completed else "attached")
+                return _follow_response(turn, replayed=True)
+
         # Check for OpenAI-compatible API first (env vars)
         openai_api_key = os.getenv("OPENAI_API_KEY")
         openai_base_url = os.getenv("OPENAI_BASE_URL")
@@ -44,6 +98,7 @@ def chat_endpoint(
         
         if openai_api_key and openai_base_url:
             # Use OpenAI-compatible endpoint (e.g., novo-genai marketplace)
+            provider, provider_key = "openai", openai_api_key
             from langchain_openai import ChatOpenAI
             llm = ChatOpenAI(
                 model=openai_model,
@@ -51,8 +106,28 @@ def chat_endpoint(
                 base_url=openai_base_url,
                 temperature=0,
             )
+            
+            # Secondary providers for hedged requests / failover
+            routes = [ProviderRoute("openai", llm)]
+            # (each takes a slot from its own limiter; the primary's is taken below)
+            secondary_base_url = os.getenv("OPENAI_SECONDARY_BASE_URL")
+            if secondary_base_url:
+                secondary_key = os.getenv("OPENAI_SECONDARY_API_KEY", openai_api_key)
+                routes.append(ProviderRoute("openai_secondary", ChatOpenAI(
+                    model=os.getenv("OPENAI_SECONDARY_MODEL", openai_model),
+                    api_key=secondary_key,
+                    base_url=secondary_base_url,
+                    temperature=0,
+                ), limiter=get_limiter("openai_secondary", secondary_key)))
+            if x_goog_api_key and not x_goog_api_key.startswith("mock_"):
+                routes.append(ProviderRoute("google", _google_llm(x_goog_api_key),
+                                            limiter=get_limiter("google", x_goog_api_key)))
+            if len(routes) > 1:
+                llm = HedgedChatModel(routes)
         elif x_goog_api_key:
+            provider, provider_key = "google", x_goog_api_key
             if x_goog_api_key.startswith("mock_"):
+                provider = "mock"
                 # Local Mock LLM for Integration Tests
                 class MockLLM:
                     def __init__(self, key):
@@ -116,32 +191,73 @@ def chat_endpoint(
                                 
                 llm = MockLLM(x_goog_api_key)
             else:
-                from langchain_google_genai import ChatGoogleGenerativeAI
-                llm = ChatGoogleGenerativeAI(
-                    model="gemini-pro",
-                    google_api_key=x_goog_api_key,
-                    temperature=0, 
-                    convert_system_message_to_human=True 
-                )
+                llm = _google_llm(x_goog_api_key)
         else:
             raise HTTPException(status_code=400, detail="Missing API key. Provide X-Goog-Api-Key header or set OPENAI_API_KEY env var.")
 
+        # Backpressure: admit the turn once an LLM slot for this provider key is
+        # free, waiting briefly in the bounded queue; 503 if the queue is full or
+        # the short admission wait runs out
+        limiter = get_limiter(provider, provider_key)
+        try:
+            admission = limiter.admit()
+        except LimiterOverloaded as e:
+            raise HTTPException(
+                status_code=503,
+                detail=str(e),
+                headers={"Retry-After": str(e.retry_after)}
+            )
+        # Slots are held per LLM call; the admission slot serves the first one
+        llm = LimitedChatModel(llm, limiter, admission)
+        
+        # A shared turn outlives the request that started it (and its session):
+        # it runs on its own session, closed when the turn ends
+        agent_db = database.SessionLocal() if turn is not None else db
+        
         # Initialize Agent with Injected LLM
-        agent = SkincareAgent(llm=llm, db_session=db)
+        agent = SkincareAgent(
+            llm=llm,
+            db_session=agent_db,
+            tool_memo=conversation_memos.get(current_user.id, request.conversation_id)
+        )
         
-        # Run Stream
+        # Run Stream (an admission slot no call used, e.g. on a cached answer, is
+        # given back when it ends). If the client disconnects, the token stops
+        # the LLM and pending tools.
+        cancel_token = turn.token if turn is not None else CancellationToken()
+        chunks = admission.wrap(agent.run_stream(
+            request.message, 
+            [h.dict() for h in request.history], 
+            user_location=request.user_location,
+            image_base64=request.image_base64,
+            user_id=current_user.id,
+            include_metrics=request.include_metrics,
+            cancel_token=cancel_token
+        ))
+        if turn is not None:
+            # Shared turn: keeps running while any request with this key is listening
+            turn.start(chunks, on_abandon=lambda: idempotency_keys.discard(idempotency_scope, turn),
+                       on_done=agent_db.close)
+            return _follow_response(turn)
         return StreamingResponse(
-            agent.run_stream(
-                request.message, 
-                [h.dict() for h in request.history], 
-                user_location=request.user_location,
-                image_base64=request.image_base64,
-                user_id=current_user.id
-            ),
+            stream_until_disconnect(chunks, cancel_token),
             media_type="application/x-ndjson"
         )
         
-    except HTTPException:
+    except HTTPException as e:
+        if turn is not None:
+            _abandon_turn(idempotency_scope, turn, e)
         raise
     except Exception as e:
+        if turn is not None:
+            _abandon_turn(idempotency_scope, turn, e)
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/cache/stats")
+def chat_cache_stats(current_user: models.User = Depends(get_current_user)):
+    """
+    Hit rate and size of the semantic response cache (generic questions only).
+    """
+    from ..services.semantic_cache import response_cache
+    return response_cache.stats()
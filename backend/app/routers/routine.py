@@ -8,6 +8,7 @@ import json
 
 from .. import database, models, auth
 from ..dependencies import get_current_user
+from ..services import routine_profile
 
 router = APIRouter(prefix="/routine", tags=["routine"])
 
@@ -171,8 +172,10 @@ def update_routine_item(
     if not db_item:
         raise HTTPException(status_code=404, detail="Item not found")
         
+    old_product_id, was_active = db_item.user_product_id, db_item.is_active
     for key, value in item_update.model_dump(exclude_unset=True).items():
         setattr(db_item, key, value)
+    routine_profile.routine_item_changed(db, db_item, old_product_id, was_active)
         
     db.commit()
     db.refresh(db_item)
@@ -1,10 +1,14 @@
 # Safety Guard Router - Active Conflict Engine API
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
 from ..database import get_db
-from ..services.conflict_rules import check_routine_conflicts, RiskLevel
+from ..services.conflict_rules import check_routine_conflicts, check_batch_conflicts, get_alias_index, RiskLevel
+from ..services.product_conflicts import product_pair_conflicts
+from ..services.routine_audit import active_routine_items, audit_routine
+from ..dependencies import get_current_user
+from .. import models
 
 router = APIRouter(prefix="/safety", tags=["Safety Guard"])
 
@@ -40,6 +44,63 @@ class CheckConflictsResponse(BaseModel):
     message: str
 
 
+class BatchCandidate(BaseModel):
+    """One candidate product in a batch check."""
+    id: Optional[str] = None  # Echoed back (product id, barcode...)
+    ingredients: List[str]
+
+
+class BatchRoutineCheckRequest(BaseModel):
+    """Request body for checking many candidate products against one routine."""
+    candidates: List[BatchCandidate]
+    routine_ingredients: List[str]
+    routine_slot: Optional[str] = None  # "morning" or "evening"
+
+
+class BatchCandidateResult(CheckConflictsResponse):
+    """Conflict check result for one candidate."""
+    id: Optional[str] = None
+
+
+class BatchCheckResponse(BaseModel):
+    """Response for a batch conflict check, one result per candidate (in order)."""
+    has_critical: bool
+    results: List[BatchCandidateResult]
+
+
+class RoutineItemRef(BaseModel):
+    id: int
+    name: Optional[str] = None
+    period: Optional[str] = None
+    frequency_type: str
+
+
+class RoutineConflictResponse(ConflictResponse):
+    """A conflict between two routine items applied in the same period on the same day(s)."""
+    item_a: RoutineItemRef
+    item_b: RoutineItemRef
+    periods: List[str]  # "am" / "pm"
+    days: List[str]  # "mon" ... "sun"
+    certain: bool  # False when an interval schedule makes the overlap possible, not certain
+
+
+class RoutineAuditResponse(BaseModel):
+    has_conflicts: bool
+    has_critical: bool
+    checked_items: int
+    unchecked_items: List[int]  # Routine items with no known ingredients
+    conflicts: List[RoutineConflictResponse]
+    message: str
+
+
+def _routine_message(conflicts: List[dict], has_critical: bool) -> str:
+    if not conflicts:
+        return "No conflicts detected. Safe to add to routine."
+    if has_critical:
+        return "⚠️ CRITICAL: Dangerous ingredient combination detected. Review before proceeding."
+    return "⚡ Warning: Some ingredient interactions detected. Review recommendations."
+
+
 @router.post("/check-routine", response_model=CheckConflictsResponse)
 def check_routine_for_conflicts(request: RoutineCheckRequest):
     """
@@ -55,18 +116,41 @@ def check_routine_for_conflicts(request: RoutineCheckRequest):
     
     has_critical = any(c["risk_level"] == "CRITICAL" for c in conflicts)
     
-    if not conflicts:
-        message = "No conflicts detected. Safe to add to routine."
-    elif has_critical:
-        message = "⚠️ CRITICAL: Dangerous ingredient combination detected. Review before proceeding."
-    else:
-        message = "⚡ Warning: Some ingredient interactions detected. Review recommendations."
-    
     return CheckConflictsResponse(
         has_conflicts=len(conflicts) > 0,
         has_critical=has_critical,
         conflicts=[ConflictResponse(**c) for c in conflicts],
-        message=message
+        message=_routine_message(conflicts, has_critical)
+    )
+
+
+@router.post("/check-routine-batch", response_model=BatchCheckResponse)
+def check_routine_batch(request: BatchRoutineCheckRequest):
+    """
+    Check several candidate products against the same routine in one call.
+    
+    The routine is matched against the rules once, so the cost grows with the
+    number of candidates rather than candidates x routine size.
+    """
+    batch = check_batch_conflicts(
+        [candidate.ingredients for candidate in request.candidates],
+        request.routine_ingredients
+    )
+    
+    results = []
+    for candidate, conflicts in zip(request.candidates, batch):
+        has_critical = any(c["risk_level"] == "CRITICAL" for c in conflicts)
+        results.append(BatchCandidateResult(
+            id=candidate.id,
+            has_conflicts=len(conflicts) > 0,
+            has_critical=has_critical,
+            conflicts=[ConflictResponse(**c) for c in conflicts],
+            message=_routine_message(conflicts, has_critical)
+        ))
+    
+    return BatchCheckResponse(
+        has_critical=any(r.has_critical for r in results),
+        results=results
     )
 
 
@@ -101,28 +185,72 @@ def check_ingredients_compatibility(
     )
 
 
+@router.get("/audit-routine", response_model=RoutineAuditResponse)
+def audit_active_routine(
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Audit the user's whole active routine in one pass.
+    
+    Only items applied in the same period (AM/PM) on a common day are checked
+    against each other, so an AM acid and a PM retinoid do not conflict.
+    """
+    audit = audit_routine(active_routine_items(db, current_user.id))
+    conflicts = audit["conflicts"]
+    has_critical = any(c["risk_level"] == "CRITICAL" for c in conflicts)
+    
+    if not conflicts:
+        message = "No conflicts detected in your routine."
+    elif has_critical:
+        message = "⚠️ CRITICAL: Dangerous ingredient combination detected in your routine."
+    else:
+        message = "⚡ Warning: Some ingredient interactions detected in your routine."
+    
+    return RoutineAuditResponse(
+        has_conflicts=len(conflicts) > 0,
+        has_critical=has_critical,
+        checked_items=audit["checked_items"],
+        unchecked_items=audit["unchecked_items"],
+        conflicts=[RoutineConflictResponse(**c) for c in conflicts],
+        message=message
+    )
+
+
+@router.get("/product-conflicts", response_model=CheckConflictsResponse)
+def get_product_conflicts(product_id: int, other_product_id: int, db: Session = Depends(get_db)):
+    """
+    Conflicts between two catalogue products, read from the materialized
+    product_conflicts table (see compute_product_conflicts.py).
+    """
+    conflicts = product_pair_conflicts(db, product_id, other_product_id)
+    has_critical = any(c["risk_level"] == "CRITICAL" for c in conflicts)
+    
+    if not conflicts:
+        message = "These products are compatible."
+    elif has_critical:
+        message = "⚠️ CRITICAL: These products should not be used together."
+    else:
+        message = "⚡ Caution: Some interactions detected."
+    
+    return CheckConflictsResponse(
+        has_conflicts=len(conflicts) > 0,
+        has_critical=has_critical,
+        conflicts=[ConflictResponse(**c) for c in conflicts],
+        message=message
+    )
+
+
 @router.get("/known-conflicts")
-def get_known_conflicts():
+def get_known_conflicts(request: Request):
     """
     Return the list of all known ingredient conflicts in the database.
     Useful for frontend display and education.
+    Served from the compiled rule snapshot, with an ETag: clients sending
+    If-None-Match get 304 until the rules change.
     """
-    from ..services.conflict_rules import CONFLICT_RULES
-    
-    return {
-        "total_rules": len(CONFLICT_RULES),
-        "conflicts": [
-            {
-                "ingredient_a": rule.ingredient_a,
-                "ingredient_a_aliases": rule.ingredient_a_aliases,
-                "ingredient_b": rule.ingredient_b,
-                "ingredient_b_aliases": rule.ingredient_b_aliases,
-                "risk_level": rule.risk_level.value,
-                "interaction_type": rule.interaction_type,
-                "reasoning": rule.reasoning,
-                "recommended_adjustment": rule.recommended_adjustment,
-                "source": rule.source
-            }
-            for rule in CONFLICT_RULES
-        ]
-    }
+    index = get_alias_index()
+    headers = {"ETag": index.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") in (index.etag, "*"):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=index.known_conflicts_body(), media_type="application/json", headers=headers)
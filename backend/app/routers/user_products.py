@@ -1,19 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 
 from .. import database, models, schemas
 from ..dependencies import get_current_user
+from ..services import routine_profile, shelf_ingredients
 
 router = APIRouter(prefix="/products", tags=["user_products"])
 
 @router.get("/", response_model=List[schemas.UserProductResponse])
 def get_products(
+    ingredient: Optional[str] = None,
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(database.get_db)
 ):
-    """Get all products in user's inventory (Shelf)."""
+    """Get all products in user's inventory (Shelf), optionally only those containing an ingredient."""
+    if ingredient:
+        return shelf_ingredients.products_containing(db, current_user.id, ingredient)
     return current_user.products
 
 @router.post("/", response_model=schemas.UserProductResponse)
@@ -29,39 +33,22 @@ def add_product(
     Returns 200 with safety_warning if conflicts detected (but still adds product).
     Set skip_safety_check=True to bypass conflict detection.
     """
-    from ..services.conflict_rules import check_routine_conflicts
+    from ..services.conflict_rules import check_mask_conflicts, get_alias_index
     
     safety_warning = None
     conflicts = []
+    # Parsed once, here; stored in user_product_ingredients below
+    new_product_ingredients = shelf_ingredients.ingredients_from_notes(product.notes)
     
     if not skip_safety_check:
-        # Get user's routine products
-        routine_items = db.query(models.RoutineItem).filter(
-            models.RoutineItem.user_id == current_user.id,
-            models.RoutineItem.is_active == True
-        ).all()
-        
-        # Collect ingredients from routine products (from product notes/ingredients)
-        routine_ingredients = []
-        for item in routine_items:
-            if item.user_product and item.user_product.notes:
-                # Parse ingredients from notes (format: "Ingredients: A, B, C")
-                notes = item.user_product.notes
-                if notes.startswith("Ingredients:"):
-                    ing_text = notes.replace("Ingredients:", "").strip()
-                    routine_ingredients.extend([i.strip() for i in ing_text.split(",")])
-        
-        # Get new product's ingredients from notes
-        new_product_ingredients = []
-        if product.notes and product.notes.startswith("Ingredients:"):
-            ing_text = product.notes.replace("Ingredients:", "").strip()
-            new_product_ingredients = [i.strip() for i in ing_text.split(",")]
+        # The routine's ingredients and matched rule sides, maintained incrementally (one lookup)
+        profile = routine_profile.get_routine_profile(db, current_user.id)
         
         # Check for conflicts
-        if new_product_ingredients and routine_ingredients:
-            conflicts = check_routine_conflicts(
-                product_ingredients=new_product_ingredients,
-                routine_ingredients=routine_ingredients
+        if new_product_ingredients and profile.ingredient_counts:
+            conflicts = check_mask_conflicts(
+                get_alias_index().mask(new_product_ingredients),
+                routine_profile.routine_mask(profile)
             )
             
             if conflicts:
@@ -89,6 +76,7 @@ def add_product(
         **product.model_dump(),
         user_id=current_user.id
     )
+    shelf_ingredients.set_product_ingredients(db_product, new_product_ingredients)
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
@@ -119,8 +107,15 @@ def update_product(
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
         
-    for key, value in product_update.model_dump(exclude_unset=True).items():
+    update = product_update.model_dump(exclude_unset=True)
+    for key, value in update.items():
         setattr(db_product, key, value)
+    if "notes" in update:
+        # Notes without an "Ingredients:" list clear the stored ingredients
+        old_ingredients = shelf_ingredients.product_match_names(db_product)
+        shelf_ingredients.set_product_ingredients(
+            db_product, shelf_ingredients.ingredients_from_notes(db_product.notes))
+        routine_profile.product_ingredients_changed(db, db_product, old_ingredients)
         
     db.commit()
     db.refresh(db_product)
@@ -141,6 +136,7 @@ def delete_product(
     if not db_product:
         raise HTTPException(status_code=404, detail="Product not found")
         
+    routine_profile.product_removed(db, db_product)
     db.delete(db_product)
     db.commit()
     return {"status": "success"}
@@ -16,7 +16,7 @@ import json
 import re
 from datetime import datetime
 from typing import Optional, List, Dict
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, BackgroundTasks, Header
 from sqlalchemy.orm import Session
 from pydantic import BaseModel, Field
 from enum import Enum
@@ -24,6 +24,14 @@ from enum import Enum
 from app.database import get_db
 from app.models import UserProduct
 from app.dependencies import get_current_user
+from app.services.routine_profile import product_ingredients_changed
+from app.services.shelf_ingredients import ingredients_from_notes, product_match_names, set_product_ingredients
+from app.services.idempotency import (
+    idempotency_keys,
+    IdempotencyConflict,
+    request_fingerprint,
+    IDEMPOTENT_DUPLICATES,
+)
 
 router = APIRouter(
     prefix="/vision",
@@ -231,9 +239,12 @@ async def process_scan_job(
                     user_product.is_analyzing = False
                     user_product.verification_status = status.value
                     user_product.notes = extraction.extraction_notes
-                    # Store ingredients in notes for now (could add dedicated column)
                     if extraction.ingredients_parsed:
-                        user_product.notes = f"Ingredients: {', '.join(extraction.ingredients_parsed[:10])}"
+                        # Full list in user_product_ingredients; notes keeps a readable copy
+                        old_ingredients = product_match_names(user_product)
+                        set_product_ingredients(user_product, extraction.ingredients_parsed)
+                        product_ingredients_changed(db, user_product, old_ingredients)
+                        user_product.notes = f"Ingredients: {', '.join(extraction.ingredients_parsed)}"
                     
                     db.commit()
             
@@ -264,6 +275,7 @@ async def process_scan_job(
 async def start_scan_job(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
     db: Session = Depends(get_db),
     current_user = Depends(get_current_user)
 ):
@@ -273,31 +285,44 @@ async def start_scan_job(
     1. Creates a placeholder UserProduct immediately (optimistic UI)
     2. Returns job_id for polling
     3. Processes image in background
-    """
-    # Generate job ID
-    job_id = str(uuid.uuid4())
-    
-    # Create placeholder product immediately
-    user_product = UserProduct(
-        user_id=current_user.id,
-        product_name="Scanning...",
-        status="active",
-        is_analyzing=True,
-        verification_status="pending",
-        category="Analyzing...",
-        notes="AI is reading the product label..."
-    )
-    db.add(user_product)
-    db.commit()
-    db.refresh(user_product)
     
+    A retry with the same Idempotency-Key (and image) returns the original job
+    instead of creating a second placeholder and extraction.
+    """
     # Read image bytes
     image_bytes = await file.read()
     
+    # Generate job ID (or reuse the job of an earlier request with this key)
+    idempotency_scope = ("scan", current_user.id, idempotency_key)
+    if idempotency_key:
+        try:
+            job_id, created = idempotency_keys.get_or_create(
+                idempotency_scope,
+                request_fingerprint(image_bytes),
+                lambda: str(uuid.uuid4())
+            )
+        except IdempotencyConflict as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        if not created:
+            job = get_job(job_id) or {}
+            status = JobStatus(job.get("status", JobStatus.PENDING.value))
+            IDEMPOTENT_DUPLICATES.inc(
+                scope="scan",
+                outcome="attached" if status in (JobStatus.PENDING, JobStatus.PROCESSING) else "replayed"
+            )
+            return ScanJobResponse(
+                job_id=job_id,
+                status=status,
+                message="Duplicate request. Poll /vision/scan/{job_id} for results.",
+                user_product_id=job.get("user_product_id")
+            )
+    else:
+        job_id = str(uuid.uuid4())
+    
     # Store job info
     _job_store[job_id] = {
         "status": JobStatus.PENDING.value,
-        "user_product_id": user_product.id,
+        "user_product_id": None,
         "user_id": current_user.id,
         "created_at": datetime.utcnow().isoformat(),
         "extraction": None,
@@ -305,6 +330,28 @@ async def start_scan_job(
         "needs_manual_review": False
     }
     
+    # Create placeholder product immediately
+    try:
+        user_product = UserProduct(
+            user_id=current_user.id,
+            product_name="Scanning...",
+            status="active",
+            is_analyzing=True,
+            verification_status="pending",
+            category="Analyzing...",
+            notes="AI is reading the product label..."
+        )
+        db.add(user_product)
+        db.commit()
+        db.refresh(user_product)
+    except Exception:
+        _job_store.pop(job_id, None)
+        if idempotency_key:
+            idempotency_keys.discard(idempotency_scope, job_id)
+        raise
+    
+    update_job(job_id, user_product_id=user_product.id)
+    
     # Schedule background processing
     from app.database import SessionLocal
     background_tasks.add_task(
@@ -387,6 +434,9 @@ async def complete_scan_manually(
         user_product.category = category
     if ingredients:
         user_product.notes = f"Ingredients: {ingredients}"
+        old_ingredients = product_match_names(user_product)
+        set_product_ingredients(user_product, ingredients_from_notes(user_product.notes))
+        product_ingredients_changed(db, user_product, old_ingredients)
     
     user_product.is_analyzing = False
     user_product.verification_status = "completed"
@@ -0,0 +1,112 @@
+# Turn Cancellation - Stop LLM and tool work when the chat client disconnects.
+#
+# The agent's run_stream is a sync generator. `stream_until_disconnect` pumps it
+# from a worker thread into the async StreamingResponse. When the client goes
+# away, Starlette cancels the response; we flip the turn's CancellationToken so
+# the agent skips pending tool calls and stops pulling from the LLM, and the
+# worker closes the generator (closing the provider stream and releasing slots).
+# The response waits for the worker to finish: the generator uses the request's
+# DB session, which is only released after the response ends.
+#
+# Workers come from a bounded pool (CHAT_STREAM_WORKERS, default 32); turns
+# beyond it wait for a free worker.
+
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, Optional
+
+from .metrics import REGISTRY
+
+
+CANCELLED_TURNS = REGISTRY.counter(
+    "chat_cancelled_turns_total", "Chat turns stopped because the client disconnected", ["model", "stage"])
+
+
+class TurnCancelled(Exception):
+    """Raised inside the agent when its turn has been cancelled."""
+
+
+class CancellationToken:
+    """Thread-safe flag shared between the HTTP layer and the agent loop."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.reason: Optional[str] = None
+
+    def cancel(self, reason: str = "client_disconnected"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TurnCancelled(self.reason)
+
+
+_DONE = object()
+
+_stream_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CHAT_STREAM_WORKERS", "32")), thread_name_prefix="chat-stream")
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def stream_until_disconnect(chunks: Iterator[str], token: CancellationToken) -> AsyncIterator[str]:
+    """
+    Async view of a sync chunk generator that cancels `token` if the consumer
+    stops early (client disconnect). The generator is always closed by the
+    worker thread that owns it, so its finally blocks run promptly, and this
+    stream only ends once the worker is done with it.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            pass  # Event loop already gone; nobody is listening
+
+    def produce():
+        try:
+            # Cancelled while waiting for a worker: close without starting the turn
+            if not token.cancelled:
+                for chunk in chunks:
+                    if token.cancelled:
+                        break
+                    put(chunk)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(chunks, "close", None)
+            if close:
+                close()
+            put(_DONE)
+
+    worker = asyncio.wrap_future(_stream_pool.submit(produce))
+
+    finished = False
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                finished = True
+                return
+            if isinstance(item, _Failure):
+                finished = True
+                raise item.error
+            yield item
+    finally:
+        if not finished:
+            token.cancel()
+        # Never hand the generator's session back while the worker still uses it
+        await asyncio.shield(worker)
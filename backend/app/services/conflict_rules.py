@@ -1,10 +1,23 @@
 # Safety Guard: Conflict Rules Engine (Tier 1 - Rule-Based)
 # This module contains the deterministic conflict detection logic.
+#
+# Tunables (env):
+#   CONFLICT_RULES_PATH=app/data/conflict_rules.json
+#   CONFLICT_RULES_RELOAD_SECONDS=30     (0 disables hot reload)
 
-from typing import List, Dict, Optional
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import deque
+from functools import lru_cache
+from typing import List, Dict, FrozenSet, Iterable, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
+from .ingredients import ingredient_match_names, CANONICALIZER_VERSION, SYNONYMS
+
 
 class RiskLevel(str, Enum):
     CRITICAL = "CRITICAL"  # High risk of barrier damage or chemical burn
@@ -25,174 +38,54 @@ class ConflictRule:
     source: str
 
 
-# Top 20 Known Ingredient Conflict Pairings
-CONFLICT_RULES: List[ConflictRule] = [
-    ConflictRule(
-        ingredient_a="RETINOL",
-        ingredient_a_aliases=["Retinyl Palmitate", "Tretinoin", "Adapalene", "Retinaldehyde", "Retin-A", "Differin"],
-        ingredient_b="GLYCOLIC ACID",
-        ingredient_b_aliases=["AHA", "Alpha Hydroxy Acid", "Lactic Acid", "Mandelic Acid"],
-        risk_level=RiskLevel.CRITICAL,
-        interaction_type="irritation",
-        reasoning="Combining retinoids with AHAs causes severe barrier damage and irritation.",
-        recommended_adjustment="Use Retinol PM only; move AHA to morning or alternate days.",
-        source="AAD Guidelines"
-    ),
-    ConflictRule(
-        ingredient_a="RETINOL",
-        ingredient_a_aliases=["Retinyl Palmitate", "Tretinoin", "Adapalene"],
-        ingredient_b="BENZOYL PEROXIDE",
-        ingredient_b_aliases=["BPO", "Benzoyl"],
-        risk_level=RiskLevel.CRITICAL,
-        interaction_type="deactivation",
-        reasoning="Benzoyl Peroxide oxidizes and deactivates retinoids, making them ineffective.",
-        recommended_adjustment="Apply BPO in AM and Retinol in PM, or use on alternate days.",
-        source="Paula's Choice"
-    ),
-    ConflictRule(
-        ingredient_a="L-ASCORBIC ACID",
-        ingredient_a_aliases=["Vitamin C", "Ascorbyl Glucoside", "Ascorbic Acid", "Sodium Ascorbyl Phosphate"],
-        ingredient_b="NIACINAMIDE",
-        ingredient_b_aliases=["Nicotinamide", "Vitamin B3"],
-        risk_level=RiskLevel.WARNING,
-        interaction_type="reduced_efficacy",
-        reasoning="May reduce efficacy of Vitamin C at high concentrations (debated, but worth noting).",
-        recommended_adjustment="Layer with a wait time of 15 minutes, or use at different times of day.",
-        source="Cosmetic Chemist"
-    ),
-    ConflictRule(
-        ingredient_a="L-ASCORBIC ACID",
-        ingredient_a_aliases=["Vitamin C", "Ascorbic Acid"],
-        ingredient_b="COPPER PEPTIDES",
-        ingredient_b_aliases=["GHK-Cu", "Copper Tripeptide"],
-        risk_level=RiskLevel.WARNING,
-        interaction_type="oxidation",
-        reasoning="Copper can oxidize Vitamin C, reducing its effectiveness.",
-        recommended_adjustment="Use Vitamin C in AM and Copper Peptides in PM.",
-        source="The Ordinary"
-    ),
-    ConflictRule(
-        ingredient_a="BENZOYL PEROXIDE",
-        ingredient_a_aliases=["BPO"],
-        ingredient_b="L-ASCORBIC ACID",
-        ingredient_b_aliases=["Vitamin C", "Ascorbic Acid"],
-        risk_level=RiskLevel.CRITICAL,
-        interaction_type="deactivation",
-        reasoning="Benzoyl Peroxide oxidizes and completely neutralizes Vitamin C.",
-        recommended_adjustment="Never layer. Use BP in AM and Vitamin C in PM.",
-        source="Dermatology Research"
-    ),
-    ConflictRule(
-        ingredient_a="GLYCOLIC ACID",
-        ingredient_a_aliases=["AHA", "Alpha Hydroxy Acid"],
-        ingredient_b="SALICYLIC ACID",
-        ingredient_b_aliases=["BHA", "Beta Hydroxy Acid"],
-        risk_level=RiskLevel.WARNING,
-        interaction_type="over-exfoliation",
-        reasoning="Layering multiple acids increases risk of over-exfoliation and barrier damage.",
-        recommended_adjustment="Use one acid per day, or on alternate days.",
-        source="Skincare by Hyram"
-    ),
-    ConflictRule(
-        ingredient_a="HYDROQUINONE",
-        ingredient_a_aliases=[],
-        ingredient_b="BENZOYL PEROXIDE",
-        ingredient_b_aliases=["BPO"],
-        risk_level=RiskLevel.CRITICAL,
-        interaction_type="staining",
-        reasoning="Causes dark staining on skin and severe irritation.",
-        recommended_adjustment="Never combine. Use on completely different days.",
-        source="FDA Warning"
-    ),
-    ConflictRule(
-        ingredient_a="PEPTIDES",
-        ingredient_a_aliases=["Matrixyl", "Argireline", "Copper Peptides", "Palmitoyl"],
-        ingredient_b="GLYCOLIC ACID",
-        ingredient_b_aliases=["AHA", "Direct Acids", "Lactic Acid"],
-        risk_level=RiskLevel.WARNING,
-        interaction_type="breakdown",
-        reasoning="Acids can break down peptide bonds, reducing efficacy.",
-        recommended_adjustment="Apply peptides before acids, or use at different times.",
-        source="Cosmetic Formulator"
-    ),
-    ConflictRule(
-        ingredient_a="RETINOL",
-        ingredient_a_aliases=["Tretinoin", "Retinyl Palmitate"],
-        ingredient_b="SALICYLIC ACID",
-        ingredient_b_aliases=["BHA", "Beta Hydroxy Acid"],
-        risk_level=RiskLevel.ADVICE,
-        interaction_type="sensitivity",
-        reasoning="May increase skin sensitivity when layered together.",
-        recommended_adjustment="Use Retinol PM and BHA AM, or alternate days.",
-        source="Dermatologist Advice"
-    ),
-    ConflictRule(
-        ingredient_a="RETINOL",
-        ingredient_a_aliases=["Tretinoin", "Adapalene", "Retinyl Palmitate"],
-        ingredient_b="VITAMIN C",
-        ingredient_b_aliases=["L-Ascorbic Acid", "Ascorbic Acid"],
-        risk_level=RiskLevel.ADVICE,
-        interaction_type="timing",
-        reasoning="Both are powerful actives that work best at different pH levels.",
-        recommended_adjustment="Vitamin C in AM, Retinol in PM for optimal results.",
-        source="Dermatologist Consensus"
-    ),
-    ConflictRule(
-        ingredient_a="NIACINAMIDE",
-        ingredient_a_aliases=["Vitamin B3", "Nicotinamide"],
-        ingredient_b="GLYCOLIC ACID",
-        ingredient_b_aliases=["AHA", "Alpha Hydroxy Acid"],
-        risk_level=RiskLevel.ADVICE,
-        interaction_type="flushing",
-        reasoning="May cause temporary flushing at high concentrations.",
-        recommended_adjustment="Apply AHA first, wait 15 minutes, then apply Niacinamide.",
-        source="Paula's Choice"
-    ),
-    ConflictRule(
-        ingredient_a="EUK-134",
-        ingredient_a_aliases=["EUK"],
-        ingredient_b="VITAMIN C",
-        ingredient_b_aliases=["L-Ascorbic Acid", "Ascorbic Acid"],
-        risk_level=RiskLevel.WARNING,
-        interaction_type="instability",
-        reasoning="EUK can reduce Vitamin C stability.",
-        recommended_adjustment="Use at different times of day.",
-        source="The Ordinary"
-    ),
-    ConflictRule(
-        ingredient_a="AZELAIC ACID",
-        ingredient_a_aliases=["Azelaic"],
-        ingredient_b="RETINOL",
-        ingredient_b_aliases=["Tretinoin", "Retinyl Palmitate"],
-        risk_level=RiskLevel.ADVICE,
-        interaction_type="sensitivity",
-        reasoning="May increase sensitivity when used together.",
-        recommended_adjustment="Introduce slowly; consider alternate day use.",
-        source="Dermatologist Advice"
-    ),
-    ConflictRule(
-        ingredient_a="PHYSICAL SCRUB",
-        ingredient_a_aliases=["Scrub", "Exfoliant Beads", "Walnut Shell"],
-        ingredient_b="GLYCOLIC ACID",
-        ingredient_b_aliases=["AHA", "Chemical Exfoliant"],
-        risk_level=RiskLevel.WARNING,
-        interaction_type="over-exfoliation",
-        reasoning="Physical + chemical exfoliation risks micro-tears and barrier damage.",
-        recommended_adjustment="Never use on the same day. Choose one method per session.",
-        source="AAD Guidelines"
-    ),
-    ConflictRule(
-        ingredient_a="RETINOL",
-        ingredient_a_aliases=["Tretinoin", "Adapalene"],
-        ingredient_b="WAXING",
-        ingredient_b_aliases=["Wax", "Hair Removal Wax"],
-        risk_level=RiskLevel.WARNING,
-        interaction_type="skin_lifting",
-        reasoning="Retinoids thin the skin barrier; waxing can cause skin lifting.",
-        recommended_adjustment="Stop retinoid use 5-7 days before waxing.",
-        source="Esthetician Guidelines"
-    ),
-]
+# ============================================================================
+# RULE STORE
+# ============================================================================
+
+# Rules live in a versioned data file (CONFLICT_RULES_PATH, default
+# app/data/conflict_rules.json: {"version": ..., "rules": [...]}), so adding a
+# rule is a data change, not a deploy. Workers check the file at most every
+# CONFLICT_RULES_RELOAD_SECONDS and, when its version changes, compile the new
+# rules and swap the compiled index in one assignment. Readers take one index
+# per call, so a check never mixes two rule sets. An invalid file is logged and
+# the current rules stay in place.
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "conflict_rules.json")
+
+
+def rules_path() -> str:
+    return os.getenv("CONFLICT_RULES_PATH", DEFAULT_RULES_PATH)
+
+
+def parse_rules(data: Dict) -> Tuple[str, List[ConflictRule]]:
+    """Rule file contents -> (version, rules). Raises ValueError on invalid data."""
+    if not isinstance(data, dict) or not isinstance(data.get("rules"), list):
+        raise ValueError("rule file must be an object with a 'rules' list")
+    rules = []
+    for position, item in enumerate(data["rules"]):
+        try:
+            rules.append(ConflictRule(
+                ingredient_a=item["ingredient_a"].upper(),
+                ingredient_a_aliases=list(item.get("ingredient_a_aliases", [])),
+                ingredient_b=item["ingredient_b"].upper(),
+                ingredient_b_aliases=list(item.get("ingredient_b_aliases", [])),
+                risk_level=RiskLevel(item["risk_level"]),
+                interaction_type=item["interaction_type"],
+                reasoning=item["reasoning"],
+                recommended_adjustment=item["recommended_adjustment"],
+                source=item.get("source", ""),
+            ))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise ValueError(f"invalid rule #{position}: {e!r}")
+    return str(data.get("version", "")), rules
+
+
+def load_rules(path: Optional[str] = None) -> Tuple[str, List[ConflictRule]]:
+    with open(path or rules_path(), encoding="utf-8") as f:
+        return parse_rules(json.load(f))
+
+
+RULES_FILE_VERSION, CONFLICT_RULES = load_rules()
 
 
 def normalize_ingredient(ingredient: str) -> str:
@@ -211,6 +104,273 @@ def check_ingredient_match(ingredient: str, rule_ingredient: str, aliases: List[
     return False
 
 
+# ============================================================================
+# COMPILED ALIAS INDEX
+# ============================================================================
+
+# A rule side is (rule index, "a" | "b"). check_ingredient_match semantics are
+# compiled once per rule set:
+#   - exact:       normalized == rule ingredient
+#   - contains:    an alias occurs in the ingredient -> Aho-Corasick automaton
+#   - contained:   the ingredient occurs in an alias -> every alias substring
+#                  is a key of the `exact` map
+# Each distinct ingredient name is resolved once (memoized), so scanning a
+# routine is one dict lookup per ingredient and conflicts fall out of a set
+# intersection over rule indexes. Ingredients are matched as given, by each
+# parenthesized / synonymous alternative and in canonical INCI form
+# (services/ingredients.ingredient_match_names), so "Niacinamide 10%" or
+# "Aqua (Water)" match like their canonical names and "Mandelic Acid (AHA)"
+# still matches the AHA rules.
+
+RuleSide = Tuple[int, str]
+
+
+class AliasIndex:
+    """Ingredient name -> matched rule sides, for a fixed list of rules."""
+
+    def __init__(self, rules: List[ConflictRule], file_version: str = ""):
+        self.rules = rules
+        self.file_version = file_version
+        self.exact: Dict[str, set] = {}
+        # Aho-Corasick automaton over the uppercased aliases
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[FrozenSet[RuleSide]] = [frozenset()]
+        outputs: List[set] = [set()]
+
+        for index, rule in enumerate(rules):
+            for side, name, aliases in (("a", rule.ingredient_a, rule.ingredient_a_aliases),
+                                        ("b", rule.ingredient_b, rule.ingredient_b_aliases)):
+                self.exact.setdefault(name.upper(), set()).add((index, side))
+                for alias in aliases:
+                    alias = alias.upper()
+                    for i in range(len(alias)):
+                        for j in range(i + 1, len(alias) + 1):
+                            self.exact.setdefault(alias[i:j], set()).add((index, side))
+                    node = 0
+                    for char in alias:
+                        if char not in self._goto[node]:
+                            self._goto.append({})
+                            self._fail.append(0)
+                            outputs.append(set())
+                            self._goto[node][char] = len(self._goto) - 1
+                        node = self._goto[node][char]
+                    outputs[node].add((index, side))
+
+        # Breadth-first failure links; outputs inherit their suffix's outputs
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                outputs[child] |= outputs[self._fail[child]]
+                queue.append(child)
+        self._out = [frozenset(o) for o in outputs]
+        self.sides_for = lru_cache(maxsize=8192)(self._sides_for)
+        self.key = _rules_key(rules)
+        self._version = self._compute_version()
+        self._known_conflicts: Optional[Dict] = None
+        self._known_conflicts_body: Optional[bytes] = None
+        self._etag: Optional[str] = None
+        # Bits of all "a" sides / all "b" sides
+        self.a_bits = sum(1 << (2 * i) for i in range(len(rules)))
+        self.b_bits = self.a_bits << 1
+
+    def _sides_for(self, normalized: str) -> FrozenSet[RuleSide]:
+        sides = set(self.exact.get(normalized, ()))
+        node = 0
+        for char in normalized:
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            sides |= self._out[node]
+        return frozenset(sides)
+
+    def match(self, ingredients: List[str]) -> set:
+        """All rule sides matched by any ingredient of the list."""
+        matched = set()
+        for ingredient in ingredients:
+            if ingredient:
+                for name in ingredient_match_names(ingredient):
+                    matched |= self.sides_for(name)
+        return matched
+
+    # --- bitmasks ----------------------------------------------------------
+    # Side (i, "a") is bit 2i and (i, "b") bit 2i + 1. Catalogue products and
+    # shelves store their mask together with `version`; a mask is only valid
+    # for the rule set (and canonicalizer) it was computed with.
+
+    @staticmethod
+    def side_bit(side: RuleSide) -> int:
+        return 1 << (2 * side[0] + (side[1] == "b"))
+
+    def mask(self, ingredients: List[str]) -> int:
+        """Bitmask of the rule sides matched by an ingredient list."""
+        mask = 0
+        for side in self.match(ingredients):
+            mask |= self.side_bit(side)
+        return mask
+
+    def sides_of(self, mask: int) -> set:
+        return {(bit >> 1, "b" if bit & 1 else "a") for bit in range(mask.bit_length()) if mask >> bit & 1}
+
+    @property
+    def version(self) -> str:
+        return self._version
+
+    def known_conflicts(self) -> Dict:
+        """The rule set as served by /safety/known-conflicts (built once per index)."""
+        if self._known_conflicts is None:
+            self._known_conflicts = {
+                "version": self.file_version,
+                "total_rules": len(self.rules),
+                "conflicts": [
+                    {
+                        "ingredient_a": rule.ingredient_a,
+                        "ingredient_a_aliases": rule.ingredient_a_aliases,
+                        "ingredient_b": rule.ingredient_b,
+                        "ingredient_b_aliases": rule.ingredient_b_aliases,
+                        "risk_level": rule.risk_level.value,
+                        "interaction_type": rule.interaction_type,
+                        "reasoning": rule.reasoning,
+                        "recommended_adjustment": rule.recommended_adjustment,
+                        "source": rule.source
+                    }
+                    for rule in self.rules
+                ]
+            }
+        return self._known_conflicts
+
+    def known_conflicts_body(self) -> bytes:
+        """known_conflicts() serialized once, for the endpoint to send as is."""
+        if self._known_conflicts_body is None:
+            self._known_conflicts_body = json.dumps(self.known_conflicts(), ensure_ascii=False).encode("utf-8")
+        return self._known_conflicts_body
+
+    @property
+    def etag(self) -> str:
+        """Strong ETag for the whole rule set (all fields, not just matching ones)."""
+        if self._etag is None:
+            self._etag = '"' + hashlib.sha256(self.known_conflicts_body()).hexdigest()[:32] + '"'
+        return self._etag
+
+    def _compute_version(self) -> str:
+        payload = json.dumps([
+            [[r.ingredient_a, r.ingredient_a_aliases, r.ingredient_b, r.ingredient_b_aliases] for r in self.rules],
+            sorted(SYNONYMS.items()),
+            CANONICALIZER_VERSION,
+        ])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def _rules_key(rules: List[ConflictRule]) -> Tuple:
+    return (id(rules), tuple(id(rule) for rule in rules))
+
+
+_alias_index: Optional[AliasIndex] = None
+_index_lock = threading.Lock()
+
+RELOAD_SECONDS = float(os.getenv("CONFLICT_RULES_RELOAD_SECONDS", "30"))
+_last_reload_check = time.monotonic()
+
+
+def _file_stat(path: str) -> Optional[Tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+_rules_file_stat = _file_stat(rules_path())
+
+
+def reload_rules(force: bool = False) -> bool:
+    """
+    Load the rule file and, if its version changed (or force), compile it and
+    swap it in. Returns True when a new rule set is live.
+    """
+    global CONFLICT_RULES, RULES_FILE_VERSION, _alias_index, _rules_file_stat
+    path = rules_path()
+    with _index_lock:
+        _rules_file_stat = _file_stat(path)
+        try:
+            version, rules = load_rules(path)
+        except (OSError, ValueError) as e:
+            print(f"[ConflictRules] keeping rules {RULES_FILE_VERSION}: cannot load {path}: {e}")
+            return False
+        if version == RULES_FILE_VERSION and not force:
+            return False
+        index = AliasIndex(rules, file_version=version)
+        _alias_index, CONFLICT_RULES, RULES_FILE_VERSION = index, rules, version
+    print(f"[ConflictRules] loaded {len(rules)} rules, version {version} ({index.version})")
+    return True
+
+
+def _maybe_reload():
+    global _last_reload_check
+    now = time.monotonic()
+    if RELOAD_SECONDS <= 0 or now - _last_reload_check < RELOAD_SECONDS:
+        return
+    _last_reload_check = now
+    if _file_stat(rules_path()) != _rules_file_stat:
+        reload_rules()
+
+
+def get_alias_index() -> AliasIndex:
+    """
+    The compiled index for the live rule set. Hot-reloads the rule file when it
+    changed, and recompiles if CONFLICT_RULES was replaced or rules were added
+    or removed in-process.
+    """
+    global _alias_index
+    _maybe_reload()
+    index = _alias_index
+    if index is None or index.key != _rules_key(CONFLICT_RULES):
+        with _index_lock:
+            if _alias_index is None or _alias_index.key != _rules_key(CONFLICT_RULES):
+                _alias_index = AliasIndex(CONFLICT_RULES, file_version=RULES_FILE_VERSION)
+            index = _alias_index
+    return index
+
+
+def rules_version() -> str:
+    """Version of the compiled rule set; stored next to precomputed masks."""
+    return get_alias_index().version
+
+
+def _conflict(rule: ConflictRule, reverse: bool) -> Dict:
+    return {
+        "risk_level": rule.risk_level.value,
+        "ingredient_a": rule.ingredient_b if reverse else rule.ingredient_a,  # Swap for clarity
+        "ingredient_b": rule.ingredient_a if reverse else rule.ingredient_b,
+        "interaction_type": rule.interaction_type,
+        "reasoning": rule.reasoning,
+        "recommended_adjustment": rule.recommended_adjustment,
+        "source": rule.source
+    }
+
+
+def _conflicts_for(index: AliasIndex, product_sides: set, routine_sides: set) -> List[Dict]:
+    conflicts = []
+    candidates = {i for i, _ in product_sides} & {i for i, _ in routine_sides}
+    for i in sorted(candidates):
+        # Product has ingredient A and routine has ingredient B, or the reverse
+        if (i, "a") in product_sides and (i, "b") in routine_sides:
+            conflicts.append(_conflict(index.rules[i], reverse=False))
+        elif (i, "b") in product_sides and (i, "a") in routine_sides:
+            conflicts.append(_conflict(index.rules[i], reverse=True))
+    
+    # Sort by risk level (CRITICAL first)
+    risk_order = {"CRITICAL": 0, "WARNING": 1, "ADVICE": 2}
+    conflicts.sort(key=lambda x: risk_order.get(x["risk_level"], 3))
+    
+    return conflicts
+
+
 def check_routine_conflicts(
     product_ingredients: List[str],
     routine_ingredients: List[str]
@@ -225,54 +385,90 @@ def check_routine_conflicts(
     Returns:
         List of conflict dictionaries with risk level, reasoning, and recommendations
     """
+    index = get_alias_index()
+    product_sides = index.match(product_ingredients)
+    if not product_sides:
+        return []
+    return _conflicts_for(index, product_sides, index.match(routine_ingredients))
+
+
+def check_mask_conflicts(product_mask: int, routine_mask: int) -> List[Dict]:
+    """
+    Conflicts between two precomputed rule-side masks (see AliasIndex.mask).
+    Masks must come from the current rules_version().
+    """
+    index = get_alias_index()
+    # Bits at "a" positions: rule matched forward (product A, routine B) or in reverse
+    forward = product_mask & (routine_mask >> 1) & index.a_bits
+    reverse = (product_mask >> 1) & routine_mask & index.a_bits & ~forward
     conflicts = []
+    for bit in range(0, (forward | reverse).bit_length(), 2):
+        if forward >> bit & 1:
+            conflicts.append(_conflict(index.rules[bit >> 1], reverse=False))
+        elif reverse >> bit & 1:
+            conflicts.append(_conflict(index.rules[bit >> 1], reverse=True))
     
-    for rule in CONFLICT_RULES:
-        # Check if product has ingredient A and routine has ingredient B
-        product_has_a = any(
-            check_ingredient_match(ing, rule.ingredient_a, rule.ingredient_a_aliases)
-            for ing in product_ingredients
-        )
-        routine_has_b = any(
-            check_ingredient_match(ing, rule.ingredient_b, rule.ingredient_b_aliases)
-            for ing in routine_ingredients
-        )
-        
-        if product_has_a and routine_has_b:
-            conflicts.append({
-                "risk_level": rule.risk_level.value,
-                "ingredient_a": rule.ingredient_a,
-                "ingredient_b": rule.ingredient_b,
-                "interaction_type": rule.interaction_type,
-                "reasoning": rule.reasoning,
-                "recommended_adjustment": rule.recommended_adjustment,
-                "source": rule.source
-            })
-            continue
-        
-        # Also check the reverse (product has B, routine has A)
-        product_has_b = any(
-            check_ingredient_match(ing, rule.ingredient_b, rule.ingredient_b_aliases)
-            for ing in product_ingredients
-        )
-        routine_has_a = any(
-            check_ingredient_match(ing, rule.ingredient_a, rule.ingredient_a_aliases)
-            for ing in routine_ingredients
-        )
-        
-        if product_has_b and routine_has_a:
-            conflicts.append({
-                "risk_level": rule.risk_level.value,
-                "ingredient_a": rule.ingredient_b,  # Swap for clarity
-                "ingredient_b": rule.ingredient_a,
-                "interaction_type": rule.interaction_type,
-                "reasoning": rule.reasoning,
-                "recommended_adjustment": rule.recommended_adjustment,
-                "source": rule.source
-            })
-    
-    # Sort by risk level (CRITICAL first)
     risk_order = {"CRITICAL": 0, "WARNING": 1, "ADVICE": 2}
     conflicts.sort(key=lambda x: risk_order.get(x["risk_level"], 3))
-    
     return conflicts
+
+
+def conflicting_pairs(masks: Dict, targets: Optional[Iterable] = None) -> Dict[Tuple, List[Tuple[int, bool]]]:
+    """
+    All conflicting pairs among items with precomputed masks ({key: mask}, keys
+    orderable), through an inverted index from rule side to items: each item
+    only meets the items on the opposite side of the rules it matches.
+    With targets, only pairs involving those keys are returned.
+    
+    Returns:
+        {(low_key, high_key): [(rule_index, reverse)]}; reverse means the low
+        item holds the rule's B side (same precedence as check_mask_conflicts)
+    """
+    index = get_alias_index()
+    inverted: Dict[int, List] = {}
+    for key, mask in masks.items():
+        for bit in range(mask.bit_length()):
+            if mask >> bit & 1:
+                inverted.setdefault(bit, []).append(key)
+    
+    pairs: Dict[Tuple, List[Tuple[int, bool]]] = {}
+    for key in (masks if targets is None else targets):
+        mask = masks[key]
+        for bit in range(mask.bit_length()):
+            if not mask >> bit & 1:
+                continue
+            rule_index = bit >> 1
+            if rule_index >= len(index.rules):
+                continue
+            for other in inverted.get(bit ^ 1, ()):  # The rule's other side
+                if other == key:
+                    continue
+                low, high = (key, other) if key < other else (other, key)
+                forward = masks[low] >> (2 * rule_index) & 1 and masks[high] >> (2 * rule_index + 1) & 1
+                entry = (rule_index, not forward)
+                found = pairs.setdefault((low, high), [])
+                if entry not in found:
+                    found.append(entry)
+    return pairs
+
+
+def check_batch_conflicts(
+    candidates: List[List[str]],
+    routine_ingredients: List[str]
+) -> List[List[Dict]]:
+    """
+    Check many candidate products against one routine.
+    
+    The routine is matched against the rules once; each candidate then costs
+    one scan of its own ingredients.
+    
+    Returns:
+        One conflict list per candidate, in order (same format as check_routine_conflicts)
+    """
+    index = get_alias_index()
+    routine_sides = index.match(routine_ingredients)
+    results = []
+    for product_ingredients in candidates:
+        product_sides = index.match(product_ingredients) if routine_sides else set()
+        results.append(_conflicts_for(index, product_sides, routine_sides) if product_sides else [])
+    return results
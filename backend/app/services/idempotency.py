@@ -0,0 +1,192 @@
+# Idempotency Keys - Absorb client retries of expensive POSTs.
+#
+# Mobile clients on flaky networks retry requests whose response they never saw.
+# With an `Idempotency-Key` header, a duplicate of an in-flight request attaches
+# to the running work (the same chat stream, the same scan job) and a duplicate
+# of a completed request replays its result, for IDEMPOTENCY_TTL_SECONDS.
+# Reusing a key with a different request body is rejected (422).
+#
+# Keys are scoped by (endpoint, user id, key) so users can never see each other's
+# results. Chat turns that are cancelled or fail are forgotten, so a retry after
+# that reruns the turn instead of replaying a truncated answer.
+#
+# Tunables (env):
+#   IDEMPOTENCY_TTL_SECONDS=600     IDEMPOTENCY_MAX_ENTRIES=5000
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .cancellation import CancellationToken
+from .metrics import REGISTRY
+
+
+IDEMPOTENT_DUPLICATES = REGISTRY.counter(
+    "idempotent_duplicates_total", "Duplicate requests absorbed by an Idempotency-Key", ["scope", "outcome"])
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used for a request with a different body."""
+
+
+def request_fingerprint(payload: Any) -> str:
+    """Stable hash of a request body (dict/list/str/bytes)."""
+    if isinstance(payload, bytes):
+        data = payload
+    elif isinstance(payload, str):
+        data = payload.encode("utf-8")
+    else:
+        data = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+# ============================================================================
+# RECORDED STREAM
+# ============================================================================
+
+class RecordedStream:
+    """
+    One chat turn that any number of requests can follow.
+
+    A worker thread drives the agent stream and records every chunk; followers
+    replay what has been recorded and then wait for more. The turn is cancelled
+    only when the last follower goes away, so a retry that attaches before the
+    original connection drops keeps the generation alive.
+    """
+
+    def __init__(self):
+        self.token = CancellationToken()
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self._cond = threading.Condition()
+
+    @property
+    def completed(self) -> bool:
+        """Finished normally (not cancelled, no error): safe to replay."""
+        return self.done and self.error is None and not self.token.cancelled
+
+    def start(self, chunks: Iterator[str], on_abandon: Optional[Callable[[], None]] = None,
+              on_done: Optional[Callable[[], None]] = None):
+        """
+        Drive `chunks` in a daemon thread. `on_abandon` runs if the turn does not
+        complete; `on_done` runs once the turn has ended either way (e.g. to close
+        the DB session the turn owns).
+        """
+
+        def produce():
+            try:
+                for chunk in chunks:
+                    if self.token.cancelled:
+                        break
+                    with self._cond:
+                        self.chunks.append(chunk)
+                        self._cond.notify_all()
+            except BaseException as e:
+                self.error = e
+            finally:
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+                with self._cond:
+                    self.done = True
+                    self._cond.notify_all()
+                if not self.completed and on_abandon:
+                    on_abandon()
+                if on_done:
+                    on_done()
+
+        threading.Thread(target=produce, name="chat-idempotent", daemon=True).start()
+
+    def abort(self, error: BaseException):
+        """Fail a turn that never started (e.g. no LLM slot was available)."""
+        with self._cond:
+            self.error = error
+            self.done = True
+            self.token.cancel("aborted")
+            self._cond.notify_all()
+
+    def follow(self, stop: Optional[CancellationToken] = None, poll_seconds: float = 0.25) -> Iterator[str]:
+        """Yield every chunk from the start; returns when the turn ends or `stop` is set."""
+        with self._cond:
+            self.followers += 1
+        position = 0
+        try:
+            while True:
+                with self._cond:
+                    while position >= len(self.chunks) and not self.done:
+                        if stop is not None and stop.cancelled:
+                            return
+                        self._cond.wait(poll_seconds)
+                    batch = self.chunks[position:]
+                    position = len(self.chunks)
+                    finished = self.done
+                yield from batch
+                if finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+        finally:
+            with self._cond:
+                self.followers -= 1
+                if self.followers == 0 and not self.done:
+                    self.token.cancel()
+
+
+# ============================================================================
+# KEY STORE
+# ============================================================================
+
+class IdempotencyStore:
+    """Bounded, TTL-expiring map of (scope, user id, key) -> (fingerprint, value)."""
+
+    def __init__(self, ttl_seconds: float = 600, max_entries: int = 5000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[Tuple, Tuple[str, Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key: Tuple, fingerprint: str, factory: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Return (value, created). The first request for a key stores `factory()`;
+        later requests with the same fingerprint get the same value back.
+        Raises IdempotencyConflict if the fingerprint differs.
+        """
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] > now:
+                if entry[0] != fingerprint:
+                    raise IdempotencyConflict(
+                        "Idempotency-Key was already used with a different request")
+                return entry[1], False
+
+            value = factory()
+            self._entries.pop(key, None)
+            self._entries[key] = (fingerprint, value, now + self.ttl_seconds)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value, True
+
+    def discard(self, key: Tuple, value: Any = None):
+        """Forget a key (only if it still maps to `value`, when given)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (value is None or entry[1] is value):
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+idempotency_keys = IdempotencyStore(
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600")),
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "5000")),
+)
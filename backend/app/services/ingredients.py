@@ -0,0 +1,190 @@
+# Ingredient Canonicalizer - One canonical INCI form per ingredient string.
+#
+# Ingredient names reach the backend from label scans (vision extraction),
+# user product notes and catalogue `ingredients_text`, in many spellings:
+# "Aqua/Water/Eau", "AQUA (WATER)", "Niacinamide 10%", "*Organic Aloe".
+# Everything that compares ingredients (conflict engine, ingredient_checker,
+# guardian safety gate, Tier-2 verdict fingerprints) goes through this module.
+# Results are memoized in bounded LRUs, so each distinct string is
+# canonicalized once per process, not once per check.
+#
+# Canonical form: uppercase INCI name, e.g. "WATER", "NIACINAMIDE", "TOCOPHEROL".
+# "/" only separates alternatives when they are synonyms of each other
+# ("Aqua/Water/Eau"); otherwise it is part of the name ("Caprylic/Capric
+# Triglyceride"). A canonical name drops parenthesized qualifiers, which can
+# carry rule-relevant markers ("Mandelic Acid (AHA)"), so rule matching uses
+# ingredient_match_names (label, alternatives and canonical name), never the
+# canonical name alone.
+#
+# Tunables (env):
+#   INGREDIENT_CACHE_SIZE=16384
+
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+
+# Common names / regional spellings -> canonical INCI name
+SYNONYMS = {
+    "AQUA": "WATER",
+    "EAU": "WATER",
+    "PURIFIED WATER": "WATER",
+    "DEIONIZED WATER": "WATER",
+    "PARFUM": "FRAGRANCE",
+    "PERFUME": "FRAGRANCE",
+    "VITAMIN A": "RETINOL",
+    "VITAMIN B3": "NIACINAMIDE",
+    "NICOTINAMIDE": "NIACINAMIDE",
+    "VITAMIN B5": "PANTHENOL",
+    "PROVITAMIN B5": "PANTHENOL",
+    "VITAMIN C": "ASCORBIC ACID",
+    "L-ASCORBIC ACID": "ASCORBIC ACID",
+    "VITAMIN E": "TOCOPHEROL",
+    "SHEA BUTTER": "BUTYROSPERMUM PARKII BUTTER",
+    "ALOE VERA": "ALOE BARBADENSIS LEAF JUICE",
+    "BHA": "SALICYLIC ACID",
+}
+
+_PERCENT_RE = re.compile(r"\d+(?:[.,]\d+)?\s*%")
+_PARENS_RE = re.compile(r"\(([^)]*)\)|\[([^\]]*)\]")
+_MARKERS_RE = re.compile(r"[*†‡•]")
+_EDGE_PUNCT_RE = re.compile(r"^[\s.,;:\-]+|[\s.,;:\-]+$")
+_LIST_PREFIX_RE = re.compile(r"^\s*(ingredients|inci|composition)\s*:\s*", re.IGNORECASE)
+
+CACHE_SIZE = int(os.getenv("INGREDIENT_CACHE_SIZE", "16384"))
+
+# Bump when canonicalization or match_names change: part of the rules version,
+# so stored rule masks are recomputed
+CANONICALIZER_VERSION = 2
+
+
+def _clean(text: str) -> str:
+    return " ".join(_EDGE_PUNCT_RE.sub("", text).upper().split())
+
+
+def _slash_alternatives(text: str) -> List[str]:
+    """Parts of "A/B/C" if they all name the same ingredient, else the whole name."""
+    whole = _clean(text)
+    parts = [p for p in (_clean(part) for part in text.split("/")) if p]
+    if len(parts) > 1 and len({SYNONYMS.get(p, p) for p in parts}) == 1:
+        return parts
+    return [whole] if whole else []
+
+
+def _alternatives(name: str) -> List[str]:
+    """Cleaned names a label entry stands for: the name outside parentheses first."""
+    text = _MARKERS_RE.sub("", _PERCENT_RE.sub("", str(name)))
+    alternatives = _slash_alternatives(_PARENS_RE.sub(" ", text))
+    for a, b in _PARENS_RE.findall(text):
+        alternatives += _slash_alternatives(a or b)
+    return alternatives
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_ingredient(name: str) -> str:
+    """
+    Canonical INCI name for one ingredient string ("" if nothing is left).
+    Percentages and markers are dropped; of the synonymous slash alternatives
+    and parenthesized alternatives ("AQUA (WATER)", "Aqua/Water/Eau") the first
+    one with a known synonym wins, otherwise the leading name.
+    """
+    if not name:
+        return ""
+    alternatives = _alternatives(name)
+    if not alternatives:
+        return ""
+
+    for alternative in alternatives:
+        if alternative in SYNONYMS:
+            return SYNONYMS[alternative]
+    return alternatives[0]
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def ingredient_match_names(name: str) -> Tuple[str, ...]:
+    """
+    Every form of one ingredient string that conflict rules are matched
+    against: the label as written (uppercased), each alternative and the
+    canonical name. "Mandelic Acid (AHA)" -> ("MANDELIC ACID (AHA)",
+    "MANDELIC ACID", "AHA").
+    """
+    if not name:
+        return ()
+    names = {" ".join(str(name).upper().split()): None}
+    for alternative in _alternatives(name):
+        names.setdefault(alternative, None)
+    canonical = canonical_ingredient(name)
+    if canonical:
+        names.setdefault(canonical, None)
+    return tuple(n for n in names if n)
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split an INCI list on commas/semicolons outside parentheses."""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth = max(depth - 1, 0)
+        if char in ",;" and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+@lru_cache(maxsize=CACHE_SIZE // 4)
+def _parse_list(text: str) -> Tuple[str, ...]:
+    seen = {}
+    for part in _split_top_level(_LIST_PREFIX_RE.sub("", text)):
+        canonical = canonical_ingredient(part)
+        if canonical:
+            seen.setdefault(canonical, None)
+    return tuple(seen)
+
+
+@lru_cache(maxsize=CACHE_SIZE // 4)
+def _parse_labels(text: str) -> Tuple[str, ...]:
+    seen = {}
+    for part in _split_top_level(_LIST_PREFIX_RE.sub("", text)):
+        canonical = canonical_ingredient(part)
+        if canonical:
+            seen.setdefault(canonical, " ".join(_EDGE_PUNCT_RE.sub("", part).split()))
+    return tuple(seen.values())
+
+
+def parse_label_list(text: Optional[str]) -> List[str]:
+    """
+    Comma-separated INCI text -> the entries as written on the label (trimmed),
+    in order, one per canonical name. Use these, not canonical names, wherever
+    conflict rules are matched.
+    """
+    if not text:
+        return []
+    return list(_parse_labels(text))
+
+
+def parse_ingredient_list(text: Optional[str]) -> List[str]:
+    """Comma-separated INCI text (optionally "Ingredients: ...") -> canonical names, in order, de-duplicated."""
+    if not text:
+        return []
+    return list(_parse_list(text))
+
+
+def canonical_ingredients(ingredients: List[str]) -> List[str]:
+    """Canonical names of a list of ingredient strings, in order, de-duplicated."""
+    seen = {}
+    for ingredient in ingredients or []:
+        canonical = canonical_ingredient(ingredient)
+        if canonical:
+            seen.setdefault(canonical, None)
+    return list(seen)
+
+
+def cache_info() -> dict:
+    info = canonical_ingredient.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
@@ -0,0 +1,299 @@
+# Intent Router - Local pre-routing that skips the tool-decision LLM call.
+#
+# Every chat turn used to pay for `llm_with_tools.invoke` just to learn whether
+# tools are needed. Most turns are easy to classify locally:
+#   - small talk / acknowledgements and conversational follow-ups -> answer
+#     directly (stream, no tools bound)
+#   - dangerous "can I put X on my skin" questions -> answer directly (refusal)
+#   - where-to-buy, and recommendations that name a product type -> call the
+#     tool deterministically (the retriever gets the product type as its
+#     query, e.g. "moisturizer", not the whole sentence: its keyword path
+#     matches the query as one substring)
+#   - allergy / ingredient safety, vague recommendations, images, anything
+#     unclear -> the LLM decides
+#
+# Keyword rules run first. An optional nearest-centroid classifier over the
+# semantic cache's hashed embeddings handles messages no rule matched.
+# `evaluate_router` scores the router against a labelled set
+# (tests/intent_golden_set.json); a route that skips the LLM with the wrong
+# intent counts as a wrong skip.
+#
+# The router is off by default: turn it on once evaluate_router on labelled
+# traffic meets the bar (see tests/test_intent_router.py).
+#
+# Tunables (env):
+#   INTENT_ROUTER_ENABLED=0
+#   INTENT_EMBEDDING_ROUTER=0        INTENT_EMBEDDING_THRESHOLD=0.6
+
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .metrics import REGISTRY
+from .semantic_cache import hashed_embedding, normalize_question
+
+
+INTENT_ROUTES = REGISTRY.counter(
+    "chat_intent_routes_total", "Chat turns by locally routed intent and action", ["intent", "action"])
+
+# Intents use the golden dataset's vocabulary: a tool name, or "chat" for no tool.
+CHAT = "chat"
+PRODUCT_RETRIEVER = "product_retriever"
+INGREDIENT_CHECKER = "ingredient_checker"
+STORE_LOCATOR = "store_locator"
+
+# Actions
+ANSWER = "answer"            # Stream a reply with no tools bound
+CALL_TOOL = "call_tool"      # Run `tool_name(tool_args)` up front, then synthesize
+LLM_DECIDES = "llm_decides"  # Fall back to the tool-decision LLM call
+
+
+@dataclass
+class IntentDecision:
+    intent: Optional[str]  # None when nothing matched
+    action: str
+    reason: str
+    tool_name: Optional[str] = None
+    tool_args: Dict = field(default_factory=dict)
+
+    @property
+    def skips_llm_decision(self) -> bool:
+        return self.action != LLM_DECIDES
+
+
+# ============================================================================
+# RULES
+# ============================================================================
+
+SMALL_TALK_WORDS = {
+    "hi", "hello", "hey", "hiya", "there", "good", "morning", "afternoon", "evening", "night",
+    "thanks", "thank", "you", "so", "much", "a", "lot", "again", "ok", "okay", "cool", "great",
+    "got", "it", "awesome", "perfect", "nice", "bye", "goodbye", "see", "ya", "later",
+    "appreciate", "that", "was", "helpful", "wow", "lol",
+}
+
+DANGEROUS_RE = re.compile(
+    r"\b(bleach|mercury|lye|drain cleaner|kerosene|gasoline|turpentine|toothpaste|"
+    r"lemon juice|baking soda|hair dye|nail polish remover)\b", re.IGNORECASE)
+
+INGREDIENT_RE = re.compile(
+    r"\b(allerg\w*|safe|sensitive to|reaction|react\w*|irritat\w*|ingredients?|contains?|"
+    r"pregnan\w*|breastfeed\w*|conflict\w*|mix\w*|combine|together with)\b", re.IGNORECASE)
+
+STORE_RE = re.compile(
+    r"\b(where (can|do|should|could) i (buy|get|find)|where to (buy|get|find)|near me|"
+    r"in stock|nearby|stores?|pharmacy|pharmacies|shops?)\b", re.IGNORECASE)
+
+RETRIEVAL_RE = re.compile(
+    r"\b(recommend\w*|suggest\w*|what (\w+ )?should i (use|buy|get|try)|looking for|"
+    r"need (a|an|some|something)|find me|show me|want (a|an|some|something)|"
+    r"best \w+|products? for|any good|alternatives?|dupes?|routine for)\b", re.IGNORECASE)
+
+SKIN_TYPE_RE = re.compile(r"\b(dry|oily|combination|sensitive|normal)\s+skin\b", re.IGNORECASE)
+
+FOLLOW_UP_RE = re.compile(
+    r"^(why|how (often|long|much|many|do i|should i)|what do you mean|can you (explain|elaborate|clarify)|"
+    r"tell me more|explain|really|is that|does that|should i (apply|use) (it|that|this|them)|"
+    r"when should i|in what order|which (step|order))\b", re.IGNORECASE)
+
+# Product types the retriever can search for, most specific first
+PRODUCT_TYPES = [
+    (r"eye creams?", "eye cream"),
+    (r"night creams?", "night cream"),
+    (r"face ?wash(es)?|cleansers?", "cleanser"),
+    (r"moisturi[sz]ers?", "moisturizer"),
+    (r"sunscreens?|sun ?blocks?|spf", "sunscreen"),
+    (r"serums?", "serum"),
+    (r"toners?", "toner"),
+    (r"exfoliants?|exfoliators?", "exfoliant"),
+    (r"masks?", "mask"),
+    (r"lotions?", "lotion"),
+    (r"creams?", "cream"),
+]
+PRODUCT_TYPE_RE = re.compile(
+    r"\b(?:" + "|".join(f"(?P<t{i}>{pattern})" for i, (pattern, _) in enumerate(PRODUCT_TYPES)) + r")\b",
+    re.IGNORECASE)
+
+# A follow-up that mentions products may need a new search; leave it to the LLM
+PRODUCT_TERMS_RE = re.compile(
+    r"\b(cleanser|moisturi[sz]er|serum|sunscreen|spf|toner|cream|lotion|mask|exfoliant|"
+    r"product|brand|skin)s?\b", re.IGNORECASE)
+
+
+def retrieval_query(message: str) -> Optional[str]:
+    """The product type a recommendation asks for ("moisturizer"), or None."""
+    match = PRODUCT_TYPE_RE.search(message)
+    if match is None:
+        return None
+    return PRODUCT_TYPES[int(match.lastgroup[1:])][1]
+
+
+def _retrieval_decision(message: str, reason: str, skin_type: str = "all") -> IntentDecision:
+    query = retrieval_query(message)
+    if query is None:
+        # Nothing to search for by keyword; the LLM writes the query
+        return IntentDecision(PRODUCT_RETRIEVER, LLM_DECIDES, f"{reason}_without_product_type")
+    return IntentDecision(PRODUCT_RETRIEVER, CALL_TOOL, reason,
+                          tool_name=PRODUCT_RETRIEVER, tool_args={"query": query, "skin_type": skin_type})
+
+
+def route_intent(
+    message: str,
+    chat_history: Optional[List[Dict]] = None,
+    image_base64: Optional[str] = None,
+    user_location: Optional[str] = None,
+    use_embeddings: Optional[bool] = None,
+) -> IntentDecision:
+    """
+    Classify a chat message locally. Returns the intent and what the agent
+    should do with it; LLM_DECIDES whenever the rules are not confident.
+    """
+    if image_base64:
+        return IntentDecision(None, LLM_DECIDES, "image")
+    if not message or not message.strip():
+        return IntentDecision(None, LLM_DECIDES, "empty")
+
+    words = normalize_question(message).split()
+
+    if words and len(words) <= 6 and set(words) <= SMALL_TALK_WORDS:
+        return IntentDecision(CHAT, ANSWER, "small_talk")
+
+    if DANGEROUS_RE.search(message):
+        return IntentDecision(CHAT, ANSWER, "dangerous_substance")
+
+    # Needs arguments (ingredient list, allergy) only the LLM can fill in
+    if INGREDIENT_RE.search(message):
+        return IntentDecision(INGREDIENT_CHECKER, LLM_DECIDES, "ingredient_safety")
+
+    if STORE_RE.search(message):
+        query = f"{message} in {user_location}" if user_location else message
+        return IntentDecision(STORE_LOCATOR, CALL_TOOL, "store",
+                              tool_name=STORE_LOCATOR, tool_args={"query": query})
+
+    if RETRIEVAL_RE.search(message):
+        skin_type = SKIN_TYPE_RE.search(message)
+        return _retrieval_decision(message, "retrieval", skin_type.group(1).lower() if skin_type else "all")
+
+    if chat_history and len(words) <= 12 and FOLLOW_UP_RE.search(message.strip()) \
+            and not PRODUCT_TERMS_RE.search(message):
+        return IntentDecision(CHAT, ANSWER, "follow_up")
+
+    if use_embeddings is None:
+        use_embeddings = os.getenv("INTENT_EMBEDDING_ROUTER", "0") == "1"
+    if use_embeddings:
+        return _embedding_route(message)
+
+    return IntentDecision(None, LLM_DECIDES, "no_rule")
+
+
+def intent_router_enabled() -> bool:
+    return os.getenv("INTENT_ROUTER_ENABLED", "0") == "1"
+
+
+# ============================================================================
+# EMBEDDING FALLBACK
+# ============================================================================
+
+# A handful of exemplars per intent; the centroids are computed once.
+INTENT_EXAMPLES: Dict[str, List[str]] = {
+    CHAT: [
+        "hello how are you",
+        "thanks for the help",
+        "what is the difference between chemical and physical exfoliation",
+        "how long does it take to see results",
+        "why is my skin purging",
+    ],
+    PRODUCT_RETRIEVER: [
+        "what moisturizer should I use for dry skin",
+        "I need a gentle cleanser for acne",
+        "recommend a sunscreen that does not leave a white cast",
+        "good serum for dark spots",
+        "best products for oily skin",
+    ],
+    INGREDIENT_CHECKER: [
+        "is this safe if I am allergic to fragrance",
+        "does this product contain alcohol",
+        "can I use retinol while pregnant",
+        "will this irritate sensitive skin",
+    ],
+    STORE_LOCATOR: [
+        "where can I buy cerave",
+        "which pharmacy near me has la roche posay",
+        "is this in stock at a store nearby",
+    ],
+}
+
+
+@lru_cache(maxsize=1)
+def _intent_centroids() -> Dict[str, np.ndarray]:
+    centroids = {}
+    for intent, examples in INTENT_EXAMPLES.items():
+        centroid = np.mean([hashed_embedding(normalize_question(e)) for e in examples], axis=0)
+        centroids[intent] = centroid / (np.linalg.norm(centroid) or 1.0)
+    return centroids
+
+
+def _embedding_route(message: str) -> IntentDecision:
+    threshold = float(os.getenv("INTENT_EMBEDDING_THRESHOLD", "0.6"))
+    vector = hashed_embedding(normalize_question(message))
+    intent, score = max(((name, float(vector @ c)) for name, c in _intent_centroids().items()),
+                        key=lambda item: item[1])
+    if score < threshold:
+        return IntentDecision(None, LLM_DECIDES, "embedding_low_confidence")
+    if intent == CHAT:
+        return IntentDecision(CHAT, ANSWER, "embedding")
+    if intent == PRODUCT_RETRIEVER:
+        return _retrieval_decision(message, "embedding")
+    return IntentDecision(intent, LLM_DECIDES, "embedding")
+
+
+# ============================================================================
+# EVALUATION
+# ============================================================================
+
+def evaluate_router(cases: List[Dict], use_embeddings: Optional[bool] = None) -> Dict:
+    """
+    Score the router on labelled cases ({"query", "expected_intent"}, and
+    optionally the retriever "expected_query").
+    `accuracy` counts a case correct when the routed intent matches;
+    `llm_decisions_skipped` is the share of cases that avoid the decision call;
+    `wrong_skips` is the share that skip it with the wrong intent or query.
+    """
+    scored = [c for c in cases if c.get("expected_intent")]
+    correct = 0
+    skipped = 0
+    wrong_skips = 0
+    mismatches = []
+    for case in scored:
+        decision = route_intent(case["query"], use_embeddings=use_embeddings)
+        right = decision.intent == case["expected_intent"]
+        if decision.tool_name == PRODUCT_RETRIEVER and case.get("expected_query"):
+            right = right and decision.tool_args["query"] == case["expected_query"]
+        if decision.skips_llm_decision:
+            skipped += 1
+            wrong_skips += not right
+        if right:
+            correct += 1
+        else:
+            mismatches.append({
+                "id": case.get("id"),
+                "query": case["query"],
+                "expected": case["expected_intent"],
+                "routed": decision.intent,
+                "action": decision.action,
+                "tool_args": decision.tool_args,
+                "reason": decision.reason,
+            })
+    total = len(scored)
+    return {
+        "total": total,
+        "correct": correct,
+        "accuracy": correct / total if total else 0.0,
+        "llm_decisions_skipped": skipped / total if total else 0.0,
+        "wrong_skips": wrong_skips / total if total else 0.0,
+        "mismatches": mismatches,
+    }
@@ -0,0 +1,250 @@
+# LLM Concurrency Limiter - Backpressure per provider + API key.
+#
+# Each (provider, key) pair gets a token bucket (request rate), a concurrency cap
+# and a bounded wait queue with a deadline. When the queue is full, or a waiter
+# runs out of time, callers get LimiterOverloaded with a Retry-After hint so the
+# API can answer 503 quickly instead of letting provider 429s cascade into 500s.
+#
+# Slots are held per LLM call, not per chat turn (LimitedChatModel): tool calls
+# and streaming to a slow client do not occupy provider capacity. The chat
+# endpoint admits a turn (admit) by waiting in the same bounded queue, but only
+# for LLM_ADMISSION_WAIT_SECONDS: a momentarily busy provider still admits the
+# turn, a full queue or a longer wait is a 503. Later calls in the same turn
+# wait at most LLM_QUEUE_TIMEOUT_SECONDS.
+#
+# Tunables (env):
+#   LLM_RATE_PER_SECOND=5   LLM_BURST=10   LLM_MAX_CONCURRENCY=8
+#   LLM_MAX_QUEUE=32        LLM_QUEUE_TIMEOUT_SECONDS=2
+#   LLM_ADMISSION_WAIT_SECONDS=0.5
+
+import os
+import math
+import time
+import hashlib
+import weakref
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .metrics import REGISTRY
+
+
+LIMITER_QUEUE_DEPTH = REGISTRY.gauge(
+    "llm_limiter_queue_depth", "LLM calls (and chat turn admissions) waiting for a slot", ["provider"])
+LIMITER_IN_FLIGHT = REGISTRY.gauge(
+    "llm_limiter_in_flight", "LLM calls holding a slot", ["provider"])
+LIMITER_REJECTED = REGISTRY.counter(
+    "llm_limiter_rejected_total", "LLM slot requests refused (chat admissions are answered with 503)",
+    ["provider", "reason"])
+
+
+class LimiterOverloaded(Exception):
+    """Raised when no LLM slot can be granted in time."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"LLM capacity exhausted ({reason}); retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ProviderLimiter:
+    """Token bucket + concurrency cap + bounded FIFO-ish wait queue for one provider key."""
+
+    def __init__(
+        self,
+        provider: str,
+        rate_per_second: float = 5.0,
+        burst: int = 10,
+        max_concurrency: int = 8,
+        max_queue: int = 32,
+        max_wait_seconds: float = 10.0,
+        admission_wait_seconds: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.provider = provider
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.admission_wait_seconds = admission_wait_seconds
+        self.clock = clock
+
+        self._tokens = float(burst)
+        self._refilled_at = clock()
+        self.in_flight = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _can_start(self) -> bool:
+        self._refill()
+        return self.in_flight < self.max_concurrency and self._tokens >= 1
+
+    def _take(self):
+        self._tokens -= 1
+        self.in_flight += 1
+        LIMITER_IN_FLIGHT.inc(provider=self.provider)
+
+    def _retry_after(self) -> int:
+        """Rough time until the current queue drains at the refill rate."""
+        return max(1, math.ceil((self.waiting + 1) / self.rate)) if self.rate else int(self.max_wait_seconds)
+
+    def _reject(self, reason: str):
+        LIMITER_REJECTED.inc(provider=self.provider, reason=reason)
+        raise LimiterOverloaded(reason, self._retry_after())
+
+    def acquire(self, timeout: Optional[float] = None) -> "LimiterLease":
+        """
+        Block until a slot is granted (returned as a lease) or the deadline passes.
+        Raises LimiterOverloaded immediately if the wait queue is full.
+        """
+        deadline = self.clock() + (self.max_wait_seconds if timeout is None else timeout)
+        with self._cond:
+            if self.waiting == 0 and self._can_start():
+                self._take()
+                return LimiterLease(self)
+            if self.waiting >= self.max_queue:
+                self._reject("queue_full")
+
+            self.waiting += 1
+            LIMITER_QUEUE_DEPTH.inc(provider=self.provider)
+            try:
+                while not self._can_start():
+                    remaining = deadline - self.clock()
+                    if remaining <= 0:
+                        self._reject("queue_timeout")
+                    # Wake up for releases, or when the next token is due
+                    next_token = (1 - self._tokens) / self.rate if self.rate and self._tokens < 1 else remaining
+                    self._cond.wait(timeout=max(0.001, min(remaining, next_token)))
+                self._take()
+            finally:
+                self.waiting -= 1
+                LIMITER_QUEUE_DEPTH.dec(provider=self.provider)
+        return LimiterLease(self)
+
+    def admit(self) -> "LimiterLease":
+        """
+        Slot for a new chat turn's first call: waits in the bounded queue for at
+        most admission_wait_seconds. Raises LimiterOverloaded if the queue is full
+        or no slot frees up in that time.
+        """
+        return self.acquire(timeout=min(self.admission_wait_seconds, self.max_wait_seconds))
+
+    def try_acquire(self) -> "LimiterLease":
+        """Take a slot only if one is free now (nobody queued); never waits."""
+        with self._cond:
+            if self.waiting == 0 and self._can_start():
+                self._take()
+                return LimiterLease(self)
+            self._reject("busy")
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            LIMITER_IN_FLIGHT.dec(provider=self.provider)
+            self._cond.notify()
+
+
+class LimiterLease:
+    """A granted slot. Releasing is idempotent."""
+
+    def __init__(self, limiter: ProviderLimiter):
+        self._limiter = limiter
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limiter.release()
+
+    def wrap(self, chunks: Iterator[str]) -> Iterator[str]:
+        """
+        Hold the slot for the lifetime of a stream. It is released when the
+        stream finishes, fails or is closed on client disconnect, and (as a
+        fallback) when a stream that never started is garbage collected.
+        """
+        def generate():
+            try:
+                yield from chunks
+            finally:
+                self.release()
+
+        stream = generate()
+        weakref.finalize(stream, self.release)
+        return stream
+
+
+class LimitedChatModel:
+    """
+    Chat model facade (bind_tools / invoke / stream) that holds a limiter slot
+    for each LLM call only. `admission` is a slot already taken for the turn's
+    first call (the endpoint's admission check); later calls acquire their own.
+    """
+
+    def __init__(self, llm, limiter: ProviderLimiter, admission: Optional[LimiterLease] = None,
+                 _pending: Optional[List[LimiterLease]] = None):
+        self.llm = llm
+        self.limiter = limiter
+        # Shared with bound copies, so whichever call comes first uses the admission slot
+        self._pending = _pending if _pending is not None else ([admission] if admission else [])
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.llm, name)
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.llm, "model_name", None) or getattr(self.llm, "model", None) or type(self.llm).__name__
+
+    def _lease(self) -> LimiterLease:
+        try:
+            return self._pending.pop()
+        except IndexError:
+            return self.limiter.acquire()
+
+    def bind_tools(self, tools):
+        return LimitedChatModel(self.llm.bind_tools(tools), self.limiter, _pending=self._pending)
+
+    def invoke(self, messages):
+        lease = self._lease()
+        try:
+            return self.llm.invoke(messages)
+        finally:
+            lease.release()
+
+    def stream(self, messages):
+        return self._lease().wrap(self.llm.stream(messages))
+
+
+_limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _key_fingerprint(api_key: Optional[str]) -> str:
+    """Never keep raw BYOK keys in memory longer than the request; hash them."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def get_limiter(provider: str, api_key: Optional[str]) -> ProviderLimiter:
+    """Shared limiter for a (provider, API key) pair, configured from env on first use."""
+    key = (provider, _key_fingerprint(api_key))
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = ProviderLimiter(
+                provider=provider,
+                rate_per_second=float(os.getenv("LLM_RATE_PER_SECOND", "5")),
+                burst=int(os.getenv("LLM_BURST", "10")),
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+                max_queue=int(os.getenv("LLM_MAX_QUEUE", "32")),
+                max_wait_seconds=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "2")),
+                admission_wait_seconds=float(os.getenv("LLM_ADMISSION_WAIT_SECONDS", "0.5")),
+            )
+            _limiters[key] = limiter
+        return limiter
@@ -0,0 +1,233 @@
+# LLM Provider Router - Hedged requests with deadline-based failover.
+#
+# Wraps several configured chat models (primary first) behind the small interface
+# SkincareAgent uses (bind_tools / invoke / stream). The primary is called first;
+# if it has not produced its first token within the hedge budget, the next
+# provider is raced against it. The first to answer wins and the loser's request
+# is cancelled. Failures fail over immediately; an overall deadline bounds the wait.
+#
+# The hedge budget is a percentile of the primary provider's own first-response
+# latency (LLM_PROVIDER_FIRST_RESPONSE: request to first chunk, or to the full
+# response for invoke), so only the slow tail triggers extra requests. It is not
+# the turn-level time to first token, which also counts context loading, tools
+# and hedging itself. Cancelled legs are not observed.
+#
+# Hedge and failover legs take their own slot from the secondary provider's
+# limiter (ProviderRoute.limiter), without waiting: a leg whose provider is
+# saturated is skipped. The primary's slot is held by the caller
+# (llm_limiter.LimitedChatModel).
+#
+# Tunables (env):
+#   LLM_HEDGE_PERCENTILE=95         LLM_HEDGE_DEFAULT_SECONDS=2.0
+#   LLM_HEDGE_MIN_SAMPLES=20        LLM_DEADLINE_SECONDS=60
+
+import os
+import asyncio
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+
+from .llm_limiter import LimiterLease, LimiterOverloaded, ProviderLimiter
+from .metrics import REGISTRY, Histogram
+
+
+HEDGED_REQUESTS = REGISTRY.counter(
+    "llm_hedged_requests_total", "Hedged requests sent to a secondary provider", ["primary"])
+HEDGE_WINS = REGISTRY.counter(
+    "llm_hedge_wins_total", "Requests answered first by each provider", ["provider"])
+HEDGES_SKIPPED = REGISTRY.counter(
+    "llm_hedges_skipped_total", "Hedge / failover legs not sent because the provider had no free slot",
+    ["provider"])
+LLM_PROVIDER_FIRST_RESPONSE = REGISTRY.histogram(
+    "llm_provider_first_response_seconds",
+    "Time from a provider request to its first chunk (stream) or response (invoke)", ["provider", "call"])
+
+STREAM = "stream"
+INVOKE = "invoke"
+
+
+class ProviderDeadlineExceeded(TimeoutError):
+    """No provider produced a first token before the request deadline."""
+
+
+@dataclass
+class ProviderRoute:
+    name: str
+    llm: Any
+    limiter: Optional[ProviderLimiter] = None  # Slots for hedge / failover legs to this provider
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.llm, "model_name", None) or getattr(self.llm, "model", None) or self.name
+
+
+def hedge_budget(provider: str, call: str, histogram: Histogram = LLM_PROVIDER_FIRST_RESPONSE) -> float:
+    """
+    Seconds to wait for the primary before hedging: the configured percentile of
+    this provider's first-response latency for the call type, or a default until
+    enough samples exist.
+    """
+    default = float(os.getenv("LLM_HEDGE_DEFAULT_SECONDS", "2.0"))
+    if histogram.count(provider=provider, call=call) < int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")):
+        return default
+    estimate = histogram.percentile(float(os.getenv("LLM_HEDGE_PERCENTILE", "95")), provider=provider, call=call)
+    return estimate if estimate is not None else default
+
+
+async def _race(
+    routes: List[ProviderRoute],
+    start: Callable[[ProviderRoute], Tuple[Any, Optional[AsyncIterator]]],
+    hedge_after: float,
+    deadline_seconds: float,
+    call: str = STREAM,
+):
+    """
+    Launch routes in order, one more every `hedge_after` seconds (or at once when
+    everything in flight has failed). Returns (route, first_result, iterator,
+    exhausted, lease) for the first success and cancels the rest; `exhausted` is
+    True when the winning stream ended without producing anything, `lease` is the
+    winner's limiter slot (None for the primary), released by the caller.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + deadline_seconds
+    pending = {}  # task -> (route, async iterator or None, launch time, lease or None)
+    next_index = 0
+    next_launch_at = loop.time()
+    last_error: Optional[BaseException] = None
+
+    async def cancel(task, iterator, lease):
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        if iterator is not None:
+            await iterator.aclose()
+        if lease is not None:
+            lease.release()
+
+    try:
+        while True:
+            now = loop.time()
+            if next_index < len(routes) and (not pending or now >= next_launch_at):
+                route = routes[next_index]
+                next_index += 1
+                next_launch_at = now + hedge_after
+                lease = None
+                if route.limiter is not None:
+                    try:
+                        lease = route.limiter.try_acquire()
+                    except LimiterOverloaded:
+                        HEDGES_SKIPPED.inc(provider=route.name)
+                        continue
+                if route is not routes[0]:
+                    HEDGED_REQUESTS.inc(primary=routes[0].name)
+                awaitable, iterator = start(route)
+                pending[asyncio.ensure_future(awaitable)] = (route, iterator, now, lease)
+
+            if not pending:
+                raise last_error or ProviderDeadlineExceeded("No providers configured")
+            if now >= deadline:
+                raise ProviderDeadlineExceeded(f"No provider answered within {deadline_seconds}s")
+
+            timeout = deadline - now
+            if next_index < len(routes):
+                timeout = min(timeout, max(0.0, next_launch_at - now))
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                route, iterator, launched_at, lease = pending.pop(task)
+                error = task.exception()
+                if error is None or isinstance(error, StopAsyncIteration):
+                    LLM_PROVIDER_FIRST_RESPONSE.observe(loop.time() - launched_at, provider=route.name, call=call)
+                    HEDGE_WINS.inc(provider=route.name)
+                    for other, (_, other_iterator, _, other_lease) in list(pending.items()):
+                        await cancel(other, other_iterator, other_lease)
+                    pending.clear()
+                    result = None if error is not None else task.result()
+                    return route, result, iterator, error is not None, lease
+                last_error = error
+                if iterator is not None:
+                    await iterator.aclose()
+                if lease is not None:
+                    lease.release()
+    finally:
+        for task, (_, iterator, _, lease) in pending.items():
+            await cancel(task, iterator, lease)
+
+
+class HedgedChatModel:
+    """Chat model facade that hedges across ProviderRoutes (primary first)."""
+
+    def __init__(self, routes: List[ProviderRoute], deadline_seconds: Optional[float] = None,
+                 hedge_after: Optional[float] = None):
+        if not routes:
+            raise ValueError("HedgedChatModel needs at least one provider")
+        self.routes = routes
+        self.deadline_seconds = deadline_seconds or float(os.getenv("LLM_DEADLINE_SECONDS", "60"))
+        self.hedge_after = hedge_after
+        self.last_winner: Optional[str] = None
+
+    @property
+    def model_name(self) -> str:
+        return self.routes[0].model_name
+
+    def bind_tools(self, tools):
+        return HedgedChatModel(
+            [ProviderRoute(r.name, r.llm.bind_tools(tools), r.limiter) for r in self.routes],
+            deadline_seconds=self.deadline_seconds,
+            hedge_after=self.hedge_after,
+        )
+
+    def _budget(self, call: str) -> float:
+        return self.hedge_after if self.hedge_after is not None else hedge_budget(self.routes[0].name, call)
+
+    def invoke(self, messages):
+        """Non-streaming call: the first complete response wins."""
+        async def run():
+            route, result, _, _, lease = await _race(
+                self.routes,
+                lambda r: (r.llm.ainvoke(messages), None),
+                self._budget(INVOKE),
+                self.deadline_seconds,
+                call=INVOKE,
+            )
+            if lease is not None:
+                lease.release()
+            self.last_winner = route.name
+            return result
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+    def stream(self, messages):
+        """Streaming call: the first provider to emit a chunk wins the whole stream."""
+        loop = asyncio.new_event_loop()
+        iterator = None
+        lease: Optional[LimiterLease] = None
+        try:
+            def start(route):
+                chunks = route.llm.astream(messages)
+                return chunks.__anext__(), chunks
+
+            route, first, iterator, exhausted, lease = loop.run_until_complete(
+                _race(self.routes, start, self._budget(STREAM), self.deadline_seconds, call=STREAM)
+            )
+            self.last_winner = route.name
+            if exhausted:
+                return
+            yield first
+            while True:
+                try:
+                    yield loop.run_until_complete(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            # Closing early (client gone) also closes the winning provider stream
+            if iterator is not None:
+                loop.run_until_complete(iterator.aclose())
+            if lease is not None:
+                lease.release()
+            loop.close()
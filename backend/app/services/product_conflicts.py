@@ -0,0 +1,128 @@
+# Product Conflict Graph - Materialized conflicting pairs across the catalogue.
+#
+# Catalogue ingredient lists rarely change, so "does product X conflict with
+# product Y" is answered from the product_conflicts table instead of re-running
+# the rule engine. The offline job builds an inverted index from conflict-rule
+# side to the products matching it (from Product.rule_mask). For each product it
+# only visits the products on the opposite side of the rules it matches, never
+# all pairs.
+#
+# Runs (see backend/compute_product_conflicts.py):
+#   - full:        recompute every pair (also forced when the rules version changed)
+#   - incremental: products with a missing / stale mask, updated since a given
+#                  time, or listed explicitly; only their rows are replaced
+#
+# A pair is stored once, with product_id < other_product_id and ingredient_a on
+# product_id's side; lookups normalize the order.
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from .. import models
+from .conflict_rules import conflicting_pairs, get_alias_index
+from .rule_masks import decode_mask, refresh_rule_mask
+from .metrics import REGISTRY
+
+
+PRODUCT_CONFLICT_JOB_PAIRS = REGISTRY.counter(
+    "product_conflict_job_pairs_total", "Conflicting product pairs written by the product conflicts job", ["mode"])
+
+
+def _load_masks(db: Session, force_ids: Set[int] = frozenset(), since: Optional[datetime] = None):
+    """All product masks, refreshing stale ones. Returns (masks, changed product ids)."""
+    masks: Dict[int, int] = {}
+    changed: Set[int] = set()
+    for product in db.query(models.Product).yield_per(1000):
+        updated_recently = since is not None and product.last_updated is not None \
+            and product.last_updated.replace(tzinfo=None) >= since.replace(tzinfo=None)
+        force = product.id in force_ids or updated_recently
+        if refresh_rule_mask(product, force=force) or force:
+            changed.add(product.id)
+        masks[product.id] = decode_mask(product.rule_mask)
+    db.commit()
+    return masks, changed
+
+
+def _rows(pairs: Dict[tuple, List[tuple]], version: str) -> List[models.ProductConflict]:
+    index = get_alias_index()
+    rows = []
+    for (low, high), entries in pairs.items():
+        for rule_index, reverse in entries:
+            rule = index.rules[rule_index]
+            rows.append(models.ProductConflict(
+                product_id=low,
+                other_product_id=high,
+                risk_level=rule.risk_level.value,
+                ingredient_a=rule.ingredient_b if reverse else rule.ingredient_a,
+                ingredient_b=rule.ingredient_a if reverse else rule.ingredient_b,
+                interaction_type=rule.interaction_type,
+                reasoning=rule.reasoning,
+                recommended_adjustment=rule.recommended_adjustment,
+                source=rule.source,
+                rules_version=version,
+            ))
+    return rows
+
+
+def refresh_product_conflicts(
+    db: Session,
+    product_ids: Iterable[int] = (),
+    since: Optional[datetime] = None,
+    full: bool = False,
+) -> Dict:
+    """
+    Recompute materialized conflicts. Incremental by default: only products with
+    a stale mask, updated since `since`, or listed in product_ids. A full rebuild
+    runs when asked for or when stored rows predate the current rules.
+    """
+    index = get_alias_index()
+    outdated = db.query(models.ProductConflict.id).filter(
+        models.ProductConflict.rules_version != index.version).first() is not None
+    full = full or outdated
+
+    masks, changed = _load_masks(db, set(product_ids), since)
+    targets = set(masks) if full else changed & set(masks)
+    pairs = conflicting_pairs(masks, targets) if targets else {}
+
+    if full:
+        db.query(models.ProductConflict).delete(synchronize_session=False)
+    elif targets:
+        db.query(models.ProductConflict).filter(or_(
+            models.ProductConflict.product_id.in_(targets),
+            models.ProductConflict.other_product_id.in_(targets),
+        )).delete(synchronize_session=False)
+    rows = _rows(pairs, index.version)
+    db.add_all(rows)
+    db.commit()
+
+    mode = "full" if full else "incremental"
+    PRODUCT_CONFLICT_JOB_PAIRS.inc(len(rows), mode=mode)
+    return {"mode": mode, "products": len(masks), "recomputed": len(targets), "conflicts": len(rows),
+            "rules_version": index.version}
+
+
+def product_pair_conflicts(db: Session, product_id: int, other_product_id: int) -> List[Dict]:
+    """Materialized conflicts between two catalogue products (one indexed lookup)."""
+    low, high = min(product_id, other_product_id), max(product_id, other_product_id)
+    rows = db.query(models.ProductConflict).filter(
+        models.ProductConflict.product_id == low,
+        models.ProductConflict.other_product_id == high,
+    ).all()
+    conflicts = []
+    for row in rows:
+        swap = product_id != low  # Report ingredient_a on the asked product's side
+        conflicts.append({
+            "risk_level": row.risk_level,
+            "ingredient_a": row.ingredient_b if swap else row.ingredient_a,
+            "ingredient_b": row.ingredient_a if swap else row.ingredient_b,
+            "interaction_type": row.interaction_type,
+            "reasoning": row.reasoning,
+            "recommended_adjustment": row.recommended_adjustment,
+            "source": row.source,
+        })
+    risk_order = {"CRITICAL": 0, "WARNING": 1, "ADVICE": 2}
+    conflicts.sort(key=lambda c: risk_order.get(c["risk_level"], 3))
+    return conflicts
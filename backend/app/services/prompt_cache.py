@@ -0,0 +1,42 @@
+# Prompt Prefix Tracking - Confirm that providers can reuse a cached prompt prefix.
+#
+# OpenAI-compatible and Gemini endpoints cache the longest byte-identical prompt
+# prefix (tool specs + leading messages). The agent keeps the static part of its
+# system prompt first and the per-user / per-turn sections after it. This module
+# fingerprints that stable prefix so every turn can report which prefix it used;
+# a new hash means the cache was invalidated (prompt or tool change). Reuse is
+# confirmed by the provider's cached-token counts (see services/telemetry.py).
+
+import json
+import hashlib
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from .metrics import REGISTRY
+
+
+PROMPT_PREFIX_TURNS = REGISTRY.counter(
+    "chat_prompt_prefix_turns_total", "Chat turns by stable prompt prefix hash", ["prefix"])
+
+
+def prefix_hash(system_prefix: str, tool_specs: Optional[List[Dict]] = None) -> str:
+    """Short sha256 of the stable prompt prefix (tool specs, then system prefix)."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(tool_specs or [], sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(system_prefix.encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+@lru_cache(maxsize=32)
+def _announce(prefix: str, system_chars: int):
+    # Logged once per process and prefix; a new line after a deploy means a cold cache
+    print(f"[PromptCache] stable prefix {prefix} ({system_chars} chars of system prompt)")
+
+
+def record_prompt_prefix(system_prefix: str, tool_specs: Optional[List[Dict]] = None) -> str:
+    """Hash the prefix used by this turn, count it and log it the first time it is seen."""
+    prefix = prefix_hash(system_prefix, tool_specs)
+    _announce(prefix, len(system_prefix))
+    PROMPT_PREFIX_TURNS.inc(prefix=prefix)
+    return prefix
@@ -0,0 +1,111 @@
+# Routine Audit - Schedule-aware conflict check of a user's whole active routine.
+#
+# Adding a product only checks "new product vs everything". The audit looks at
+# every pair of active routine items at once: each item's ingredients are
+# matched against the compiled rule index once (a rule-side mask), candidate
+# pairs come from the inverted index (conflict_rules.conflicting_pairs), and a
+# pair is only reported if the two items are applied in the same period on at
+# least one common day. Retinol PM with an AHA in the AM is not a conflict;
+# both in the PM is.
+#
+# Schedules (RoutineItem):
+#   period:          "am" | "pm" (anything else counts as both)
+#   frequency_type:  "daily" | "days_of_week" (frequency_details = [0..6], Monday = 0)
+#                    | "interval" (frequency_details = {"every_n_days": n})
+# Interval items have no anchor date, so they may fall on any weekday; their
+# overlaps are reported as possible rather than certain.
+
+from typing import Dict, List
+
+from sqlalchemy.orm import joinedload, selectinload
+
+from .. import models
+from .conflict_rules import conflicting_pairs, get_alias_index
+from .shelf_ingredients import product_match_names
+
+ALL_DAYS = frozenset(range(7))
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def item_periods(item) -> frozenset:
+    period = (item.period or "").lower()
+    return frozenset([period]) if period in ("am", "pm") else frozenset(["am", "pm"])
+
+
+def item_days(item) -> frozenset:
+    """Weekdays the item is applied on (all of them for daily and interval items)."""
+    if (item.frequency_type or "daily") == "days_of_week":
+        details = item.frequency_details or []
+        return frozenset(d for d in details if isinstance(d, int) and 0 <= d <= 6)
+    return ALL_DAYS
+
+
+def item_ingredients(item) -> List[str]:
+    return product_match_names(item.user_product)
+
+
+def _item_summary(item) -> Dict:
+    return {
+        "id": item.id,
+        "name": item.user_product.product_name if item.user_product else item.name,
+        "period": item.period,
+        "frequency_type": item.frequency_type or "daily",
+    }
+
+
+def audit_routine(items: List) -> Dict:
+    """
+    Conflicts between routine items that share a period and a day.
+    Items without known ingredients are listed as unchecked.
+    """
+    index = get_alias_index()
+    by_id = {item.id: item for item in items}
+    masks = {}
+    unchecked = []
+    for item in items:
+        ingredients = item_ingredients(item)
+        if ingredients:
+            masks[item.id] = index.mask(ingredients)
+        else:
+            unchecked.append(item.id)
+
+    conflicts = []
+    for (low, high), entries in conflicting_pairs(masks).items():
+        a, b = by_id[low], by_id[high]
+        periods = item_periods(a) & item_periods(b)
+        days = item_days(a) & item_days(b)
+        if not periods or not days:
+            continue
+        possible = "interval" in ((a.frequency_type or "daily"), (b.frequency_type or "daily"))
+        for rule_index, reverse in entries:
+            rule = index.rules[rule_index]
+            conflicts.append({
+                "risk_level": rule.risk_level.value,
+                "ingredient_a": rule.ingredient_b if reverse else rule.ingredient_a,
+                "ingredient_b": rule.ingredient_a if reverse else rule.ingredient_b,
+                "interaction_type": rule.interaction_type,
+                "reasoning": rule.reasoning,
+                "recommended_adjustment": rule.recommended_adjustment,
+                "source": rule.source,
+                "item_a": _item_summary(a),
+                "item_b": _item_summary(b),
+                "periods": sorted(periods),
+                "days": [DAY_NAMES[d] for d in sorted(days)],
+                "certain": not possible,
+            })
+
+    risk_order = {"CRITICAL": 0, "WARNING": 1, "ADVICE": 2}
+    conflicts.sort(key=lambda c: (risk_order.get(c["risk_level"], 3), c["item_a"]["id"], c["item_b"]["id"]))
+    return {
+        "checked_items": len(masks),
+        "unchecked_items": unchecked,
+        "conflicts": conflicts,
+    }
+
+
+def active_routine_items(db, user_id: int) -> List:
+    return db.query(models.RoutineItem).options(
+        joinedload(models.RoutineItem.user_product).selectinload(models.UserProduct.ingredient_rows)).filter(
+        models.RoutineItem.user_id == user_id,
+        models.RoutineItem.is_active == True
+    ).all()
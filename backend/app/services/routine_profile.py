@@ -0,0 +1,133 @@
+# Routine Profile - Incrementally maintained ingredient profile of a user's active routine.
+#
+# The add-product safety check compares one new product against everything the
+# user's active routine contains. Instead of collecting that per request, each
+# user has one routine_profiles row: how many active routine items contain each
+# ingredient (keyed by label entry, see shelf_ingredients.product_match_names:
+# canonical names alone lose rule-relevant qualifiers), plus the conflict-rule
+# sides those ingredients match
+# (a rule-side mask, see services/rule_masks.py). The check is then one row
+# lookup and a mask comparison (conflict_rules.check_mask_conflicts).
+#
+# The profile is updated by deltas where the routine changes:
+#   - a routine item is linked to another product / activated / deactivated
+#     (routine_item_changed)
+#   - a linked product's ingredients change: add / update product, vision scan,
+#     manual scan completion (product_ingredients_changed)
+#   - a linked product is deleted (product_removed)
+# Counts (not a set) make removals exact when two items share an ingredient.
+# A profile is built from the tables on first read (so there is nothing to
+# update before that); a mask computed for other rules is recomputed when read.
+
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from .. import models
+from .metrics import REGISTRY
+from .rule_masks import current_mask, ingredients_mask, mask_version
+
+
+ROUTINE_PROFILE_UPDATES = REGISTRY.counter(
+    "routine_profile_updates_total", "Routine ingredient profile updates by kind", ["kind"])
+
+
+def _linked_items(db: Session, product_id: int) -> int:
+    """Number of active routine items using a shelf product."""
+    return db.query(func.count(models.RoutineItem.id)).filter(
+        models.RoutineItem.user_product_id == product_id,
+        models.RoutineItem.is_active == True
+    ).scalar() or 0
+
+
+# Same as shelf_ingredients.row_match_name, in SQL
+_MATCH_NAME = func.coalesce(models.UserProductIngredient.label, models.UserProductIngredient.name)
+
+
+def _stored_ingredients(db: Session, product_id: Optional[int]) -> List[str]:
+    if product_id is None:
+        return []
+    rows = db.query(_MATCH_NAME).filter(
+        models.UserProductIngredient.user_product_id == product_id).all()
+    return [name for (name,) in rows]
+
+
+def _set_counts(profile: models.RoutineProfile, counts: Dict[str, int]):
+    counts = {name: n for name, n in sorted(counts.items()) if n > 0}
+    profile.ingredient_counts = counts  # Reassigned, JSON columns do not track in-place changes
+    profile.rule_mask, profile.rule_mask_version = ingredients_mask(list(counts))
+
+
+def rebuild_routine_profile(db: Session, user_id: int) -> models.RoutineProfile:
+    """Recompute a user's profile from the routine and shelf tables (the caller commits)."""
+    rows = db.query(_MATCH_NAME, func.count(models.RoutineItem.id)).join(
+        models.RoutineItem,
+        models.RoutineItem.user_product_id == models.UserProductIngredient.user_product_id,
+    ).filter(
+        models.RoutineItem.user_id == user_id,
+        models.RoutineItem.is_active == True
+    ).group_by(_MATCH_NAME).all()
+
+    profile = db.query(models.RoutineProfile).filter(models.RoutineProfile.user_id == user_id).first()
+    if profile is None:
+        profile = models.RoutineProfile(user_id=user_id)
+        db.add(profile)
+    _set_counts(profile, dict(rows))
+    ROUTINE_PROFILE_UPDATES.inc(kind="rebuild")
+    return profile
+
+
+def get_routine_profile(db: Session, user_id: int) -> models.RoutineProfile:
+    """A user's routine profile, built on first use (the caller commits)."""
+    profile = db.query(models.RoutineProfile).filter(models.RoutineProfile.user_id == user_id).first()
+    if profile is None:
+        return rebuild_routine_profile(db, user_id)
+    ingredients = list(profile.ingredient_counts or {})
+    if profile.rule_mask_version != mask_version(ingredients):
+        profile.rule_mask, profile.rule_mask_version = ingredients_mask(ingredients)
+    return profile
+
+
+def routine_mask(profile: models.RoutineProfile) -> int:
+    return current_mask(profile.rule_mask, profile.rule_mask_version, list(profile.ingredient_counts or {}))
+
+
+def apply_ingredient_delta(db: Session, user_id: int, added: Iterable[str] = (), removed: Iterable[str] = ()):
+    """Add / remove ingredient occurrences (no-op until the profile is first built)."""
+    profile = db.query(models.RoutineProfile).filter(models.RoutineProfile.user_id == user_id).first()
+    if profile is None:
+        return
+    counts = Counter(profile.ingredient_counts or {})
+    counts.update(added)
+    counts.subtract(removed)
+    _set_counts(profile, counts)
+    ROUTINE_PROFILE_UPDATES.inc(kind="delta")
+
+
+def routine_item_changed(db: Session, item: models.RoutineItem, old_product_id: Optional[int], was_active: bool):
+    """A routine item's product link or active flag changed."""
+    old = _stored_ingredients(db, old_product_id) if was_active else []
+    new = _stored_ingredients(db, item.user_product_id) if item.is_active else []
+    if old != new:
+        apply_ingredient_delta(db, item.user_id, added=new, removed=old)
+
+
+def product_ingredients_changed(db: Session, product: models.UserProduct, old_ingredients: List[str]):
+    """A shelf product's stored ingredients changed (old_ingredients: its previous match names)."""
+    new_ingredients = [row.label or row.name for row in product.ingredient_rows]
+    if product.id is None or new_ingredients == old_ingredients:
+        return
+    linked = _linked_items(db, product.id)
+    if linked:
+        apply_ingredient_delta(db, product.user_id,
+                               added=new_ingredients * linked, removed=old_ingredients * linked)
+
+
+def product_removed(db: Session, product: models.UserProduct):
+    """A shelf product is about to be deleted; drop what its routine items contributed."""
+    linked = _linked_items(db, product.id)
+    if linked:
+        apply_ingredient_delta(db, product.user_id,
+                               removed=[row.label or row.name for row in product.ingredient_rows] * linked)
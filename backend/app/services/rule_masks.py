@@ -0,0 +1,67 @@
+# Rule-Side Masks - Precomputed conflict-rule matches for catalogue products and shelves.
+#
+# A catalogue product's ingredients only change on ingest, so its matched
+# conflict-rule sides are computed once and stored on the row (Product.rule_mask,
+# hex) with the rule-set version they belong to. Shelves get the same kind of
+# mask. The safety gate then reduces Tier-1 detection to bitwise ANDs
+# (conflict_rules.check_mask_conflicts).
+#
+# Masks are built from the label entries (parse_label_list), not the canonical
+# names: the rules match the raw name, its parenthesized alternatives and the
+# canonical name, and qualifiers such as "Mandelic Acid (AHA)" only survive
+# on the label.
+#
+# A mask's version is "<rules version>:<hash of the matched names>", so
+# a stored mask goes stale both when CONFLICT_RULES (or the canonicalizer)
+# changes and when the ingredients are rewritten by a writer that did not
+# refresh it (e.g. ingest_v2.py / ingest_kaggle.py). Stale masks are recomputed
+# the next time they are read.
+
+import hashlib
+from typing import List, Optional, Tuple
+
+from .conflict_rules import get_alias_index
+from .ingredients import ingredient_match_names, parse_label_list
+
+
+def encode_mask(mask: int) -> str:
+    return format(mask, "x")
+
+
+def decode_mask(value: Optional[str]) -> int:
+    return int(value, 16) if value else 0
+
+
+def mask_version(ingredients: List[str], index=None) -> str:
+    """Version of a mask: the rule set plus a hash of the names the rules match."""
+    index = index or get_alias_index()
+    names = dict.fromkeys(name for ingredient in ingredients or [] for name in ingredient_match_names(ingredient))
+    digest = hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()[:12]
+    return f"{index.version}:{digest}"
+
+
+def ingredients_mask(ingredients: List[str]) -> Tuple[str, str]:
+    """(hex mask, mask version) for an ingredient list."""
+    index = get_alias_index()
+    return encode_mask(index.mask(ingredients)), mask_version(ingredients, index)
+
+
+def refresh_rule_mask(product, force: bool = False) -> bool:
+    """
+    Recompute product.rule_mask if it is missing, was computed for another rule
+    set or for other ingredients (or always, with force). Returns True when the
+    row was updated (the caller commits).
+    """
+    ingredients = parse_label_list(getattr(product, "ingredients_text", None))
+    if not force and getattr(product, "rule_mask", None) is not None \
+            and getattr(product, "rule_mask_version", None) == mask_version(ingredients):
+        return False
+    product.rule_mask, product.rule_mask_version = ingredients_mask(ingredients)
+    return True
+
+
+def current_mask(mask: Optional[str], version: Optional[str], ingredients: List[str]) -> int:
+    """A stored mask if it matches the current rules and these ingredients, else a fresh one."""
+    if mask is not None and version == mask_version(ingredients):
+        return decode_mask(mask)
+    return get_alias_index().mask(ingredients)
@@ -0,0 +1,274 @@
+# Tier-2 Safety Verdicts - LLM analysis of ingredient pairs the rule engine does not know.
+#
+# Tier 1 (services/conflict_rules.py) only knows the curated pairings. Tier 2 asks
+# the LLM to review a candidate product's INCI list against each product on the
+# user's shelf. A verdict depends only on the pair being judged, so it is cached
+# under a canonical fingerprint of (candidate ingredients, shelf product
+# ingredients): names are canonicalized (services/ingredients.py), order and
+# duplicates do not matter. Adding a product to the shelf therefore only costs
+# the pairs it is part of, and common pairs are shared between users.
+# Lookups go to an in-process LRU first, then to the safety_verdicts table, so
+# verdicts survive restarts and are shared between workers. The LLM is only called on a miss, and only for products
+# Tier 1 did not already flag; a failed or unparseable analysis is not cached.
+# Analyses are bounded by the caller's timeout (the guardian's remaining
+# deadline): late ones are dropped from this check, and their verdicts still
+# reach the in-process cache when they complete.
+#
+# Tunables (env):
+#   SAFETY_TIER2_ENABLED=0               (off by default: up to one LLM call per
+#                                         pair, within the guardian's deadline)
+#   SAFETY_VERDICT_TTL_SECONDS=2592000   (30 days)
+#   SAFETY_VERDICT_MAX_ENTRIES=4096      (in-process LRU)
+
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import SystemMessage, HumanMessage
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from .. import models
+from .ingredients import canonical_ingredients
+from .metrics import REGISTRY
+
+
+# Bump when the prompt or the verdict format changes: old verdicts stop matching
+TIER2_VERSION = "tier2-v2"
+
+RISK_LEVELS = ("SAFE", "ADVICE", "WARNING", "CRITICAL")
+
+SAFETY_TIER2_LOOKUPS = REGISTRY.counter(
+    "safety_tier2_lookups_total", "Tier-2 safety verdict lookups by outcome", ["outcome"])
+
+TIER2_PROMPT = """You are a cosmetic chemist reviewing ingredient interactions.
+A product is being considered for a routine that already contains a shelf product.
+Report interactions between the product's ingredients and the shelf product's ingredients that can
+irritate, damage the skin barrier or cancel each other out. Only report well-established
+interactions; if there are none, return an empty list.
+
+Answer with JSON only, no prose:
+{"risk_level": "SAFE" | "ADVICE" | "WARNING" | "CRITICAL",
+ "conflicts": [{"ingredient_a": "<product ingredient>", "ingredient_b": "<shelf product ingredient>",
+                "risk_level": "ADVICE" | "WARNING" | "CRITICAL", "interaction_type": "<short label>",
+                "reasoning": "<one sentence>", "recommended_adjustment": "<one sentence>"}]}"""
+
+
+def sorted_ingredients(ingredients: List[str]) -> List[str]:
+    """Canonical INCI names (services/ingredients.py), de-duplicated and sorted."""
+    return sorted(canonical_ingredients(ingredients))
+
+
+def ingredient_fingerprint(product_ingredients: List[str], shelf_product_ingredients: List[str]) -> str:
+    """Canonical fingerprint of a (candidate, shelf product) ingredient-set pair."""
+    payload = json.dumps([
+        TIER2_VERSION,
+        sorted_ingredients(product_ingredients),
+        sorted_ingredients(shelf_product_ingredients),
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def parse_verdict(text: str) -> Optional[Dict]:
+    """Parse the LLM's JSON verdict; None if it is not a usable verdict."""
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if not match:
+        return None
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or data.get("risk_level") not in RISK_LEVELS:
+        return None
+
+    conflicts = []
+    for conflict in data.get("conflicts") or []:
+        if not isinstance(conflict, dict) or conflict.get("risk_level") not in RISK_LEVELS[1:]:
+            continue
+        conflicts.append({
+            "risk_level": conflict["risk_level"],
+            "ingredient_a": str(conflict.get("ingredient_a", "")),
+            "ingredient_b": str(conflict.get("ingredient_b", "")),
+            "interaction_type": str(conflict.get("interaction_type", "")),
+            "reasoning": str(conflict.get("reasoning", "")),
+            "recommended_adjustment": str(conflict.get("recommended_adjustment", "")),
+            "source": "Tier 2 LLM analysis",
+        })
+    return {"risk_level": data["risk_level"], "conflicts": conflicts}
+
+
+def _utc(value: datetime) -> datetime:
+    """Stored expiries are naive UTC."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class SafetyVerdictCache:
+    """In-process LRU in front of the persistent safety_verdicts table."""
+
+    def __init__(self, ttl_seconds: float = 2592000, max_entries: int = 4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Dict, datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, fingerprint: str, verdict: Dict, expires_at: datetime):
+        with self._lock:
+            self._entries.pop(fingerprint, None)
+            self._entries[fingerprint] = (verdict, expires_at)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, fingerprint: str, db: Optional[Session] = None) -> Optional[Dict]:
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            entry = self._entries.get(fingerprint)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(fingerprint)
+                    return entry[0]
+                del self._entries[fingerprint]
+
+        if db is None:
+            return None
+        try:
+            row = db.query(models.SafetyVerdict).filter(
+                models.SafetyVerdict.fingerprint == fingerprint).first()
+        except SQLAlchemyError as e:
+            print(f"[SafetyVerdicts] lookup failed: {e}")
+            return None
+        if row is None or _utc(row.expires_at) <= now:
+            return None
+        verdict = {"risk_level": row.risk_level, "conflicts": row.conflicts or []}
+        self._remember(fingerprint, verdict, row.expires_at)
+        return verdict
+
+    def set(self, fingerprint: str, verdict: Dict, db: Optional[Session] = None, model: Optional[str] = None):
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        self._remember(fingerprint, verdict, expires_at)
+        if db is None:
+            return
+        try:
+            row = db.query(models.SafetyVerdict).filter(
+                models.SafetyVerdict.fingerprint == fingerprint).first()
+            if row is None:
+                row = models.SafetyVerdict(fingerprint=fingerprint)
+                db.add(row)
+            row.risk_level = verdict["risk_level"]
+            row.conflicts = verdict["conflicts"]
+            row.model = model
+            row.expires_at = expires_at.replace(tzinfo=None)
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"[SafetyVerdicts] store failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _cache_from_env() -> SafetyVerdictCache:
+    return SafetyVerdictCache(
+        ttl_seconds=float(os.getenv("SAFETY_VERDICT_TTL_SECONDS", "2592000")),
+        max_entries=int(os.getenv("SAFETY_VERDICT_MAX_ENTRIES", "4096")),
+    )
+
+
+# Process-wide singleton
+verdict_cache = _cache_from_env()
+
+# Misses for several candidates are analyzed concurrently
+_tier2_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="safety-tier2")
+
+
+class Tier2TimedOut(TimeoutError):
+    """Some analyses did not finish in time; .verdicts holds the ones that did."""
+
+    def __init__(self, verdicts: List[Tuple[Dict, Dict]]):
+        super().__init__("Tier 2 analysis timed out")
+        self.verdicts = verdicts
+
+
+def tier2_enabled() -> bool:
+    return os.getenv("SAFETY_TIER2_ENABLED", "0") == "1"
+
+
+def analyze_ingredients(llm, product_ingredients: List[str], shelf_product_ingredients: List[str]) -> Optional[Dict]:
+    """One Tier-2 LLM call; None when the call fails or the answer is unusable."""
+    messages = [
+        SystemMessage(content=TIER2_PROMPT),
+        HumanMessage(content=(
+            f"Product ingredients: {', '.join(sorted_ingredients(product_ingredients))}\n"
+            f"Shelf product ingredients: {', '.join(sorted_ingredients(shelf_product_ingredients))}"
+        )),
+    ]
+    try:
+        response = llm.invoke(messages)
+    except Exception as e:
+        print(f"[SafetyVerdicts] Tier 2 analysis failed: {e}")
+        return None
+    return parse_verdict(getattr(response, "content", response))
+
+
+def tier2_verdicts(
+    llm,
+    products: List[Dict],
+    shelf_products: List[Dict],
+    db: Optional[Session] = None,
+    cache: Optional[SafetyVerdictCache] = None,
+    timeout: Optional[float] = None,
+) -> List[Tuple[Dict, Dict]]:
+    """
+    Tier-2 verdicts for every (candidate, shelf product) pair, as (product,
+    verdict) pairs. Cached verdicts are reused; the LLM only sees the misses.
+    Raises Tier2TimedOut (with the verdicts that are ready) if analyses are
+    still running after timeout seconds.
+    """
+    cache = cache or verdict_cache
+    results = []
+    misses = []
+    for product in products:
+        for shelf_product in shelf_products:
+            shelf_product_ingredients = shelf_product.get("ingredients", [])
+            fingerprint = ingredient_fingerprint(product.get("ingredients", []), shelf_product_ingredients)
+            verdict = cache.get(fingerprint, db)
+            if verdict is not None:
+                SAFETY_TIER2_LOOKUPS.inc(outcome="hit")
+                results.append((product, verdict))
+            else:
+                misses.append((product, shelf_product_ingredients, fingerprint))
+
+    futures = [_tier2_pool.submit(analyze_ingredients, llm, product.get("ingredients", []), shelf_product_ingredients)
+               for product, shelf_product_ingredients, _ in misses]
+    done, _ = wait(futures, timeout=timeout)
+    model = getattr(llm, "model_name", None) or type(llm).__name__
+    timed_out = False
+    for (product, _, fingerprint), future in zip(misses, futures):
+        if future not in done:
+            SAFETY_TIER2_LOOKUPS.inc(outcome="timeout")
+            future.add_done_callback(lambda f, fingerprint=fingerprint: _cache_late_verdict(cache, fingerprint, f, model))
+            timed_out = True
+            continue
+        verdict = future.result()
+        if verdict is None:
+            SAFETY_TIER2_LOOKUPS.inc(outcome="error")
+            continue
+        SAFETY_TIER2_LOOKUPS.inc(outcome="miss")
+        cache.set(fingerprint, verdict, db, model=model)
+        results.append((product, verdict))
+    if timed_out:
+        raise Tier2TimedOut(results)
+    return results
+
+
+def _cache_late_verdict(cache: SafetyVerdictCache, fingerprint: str, future, model: str):
+    # The request's session is gone by now: in-process cache only
+    verdict = future.result()
+    if verdict is not None:
+        cache.set(fingerprint, verdict, model=model)
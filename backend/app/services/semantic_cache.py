@@ -0,0 +1,219 @@
+# Semantic Response Cache - Replays answers to generic (non-personalized) chat questions.
+#
+# Questions like "what does niacinamide do" produce near-identical answers for every
+# user. When enabled, the agent embeds such questions, looks up a near-duplicate above
+# a cosine-similarity threshold and replays the stored NDJSON stream instead of
+# paying for two LLM calls.
+#
+# Similarity alone cannot tell "retinol with vitamin C" from "retinol with vitamin A"
+# (one word apart), so a cached answer is only replayed for a question that names
+# exactly the same ingredients (canonicalized: "vitamin A" is retinol).
+#
+# Opt-in via env vars:
+#   SEMANTIC_CACHE_ENABLED=1
+#   SEMANTIC_CACHE_THRESHOLD=0.92     (cosine similarity)
+#   SEMANTIC_CACHE_TTL_SECONDS=86400
+#   SEMANTIC_CACHE_MAX_ENTRIES=1024
+
+import os
+import re
+import time
+import zlib
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from .conflict_rules import get_alias_index
+from .ingredients import SYNONYMS, canonical_ingredient
+
+
+# Markers that tie a question to the asker (their skin, shelf, history...).
+# Any match means the answer may depend on user context and must not be shared.
+PERSONAL_PATTERNS = [
+    r"\b(my|me|mine|myself|i|i'm|im|i've|i'd|i'll|our|us)\b",
+    r"\b(shelf|routine|journal|inventory|allerg\w*)\b",
+    r"\b(yesterday|today|tonight|this morning|last night|near me)\b",
+]
+_PERSONAL_RE = re.compile("|".join(PERSONAL_PATTERNS), re.IGNORECASE)
+
+
+def is_generic_question(
+    message: str,
+    chat_history: Optional[List[Dict]] = None,
+    image_base64: Optional[str] = None,
+    user_location: Optional[str] = None,
+) -> bool:
+    """
+    True if the question can be answered without any user context.
+    Follow-ups (non-empty history), images and location-aware turns never qualify.
+    """
+    if not message or chat_history or image_base64 or user_location:
+        return False
+    return _PERSONAL_RE.search(message) is None
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, strip punctuation and collapse whitespace."""
+    text = re.sub(r"[^a-z0-9\s]", " ", text.lower())
+    return " ".join(text.split())
+
+
+# Connectives that change nothing about what is asked ("AM vs PM" == "AM or PM")
+STOPWORDS = frozenset({"a", "an", "the", "vs", "versus", "or", "and", "is", "are", "be",
+                       "do", "does", "to", "of", "should", "can", "you"})
+
+
+def hashed_embedding(text: str, dim: int = 1024) -> np.ndarray:
+    """
+    Deterministic local embedding: hashed word unigrams, word bigrams and
+    character trigrams of the non-stopwords, L2-normalized. Cheap enough to run
+    on every message and robust to punctuation, casing and small rewordings.
+    """
+    vec = np.zeros(dim, dtype=np.float32)
+    words = [w for w in normalize_question(text).split() if w not in STOPWORDS]
+    features = list(words)
+    features += [f"{a}_{b}" for a, b in zip(words, words[1:])]
+    for w in words:
+        padded = f"#{w}#"
+        features += [padded[i:i + 3] for i in range(len(padded) - 2)]
+    for feature in features:
+        vec[zlib.crc32(feature.encode("utf-8")) % dim] += 1.0
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+_entity_matcher: Optional[Tuple[str, re.Pattern, Dict[str, str]]] = None
+
+
+def _entity_terms() -> Tuple[re.Pattern, Dict[str, str]]:
+    """Word-boundary pattern over known ingredient names, rebuilt when the rules change."""
+    global _entity_matcher
+    index = get_alias_index()
+    if _entity_matcher is None or _entity_matcher[0] != index.version:
+        names = set(SYNONYMS) | set(SYNONYMS.values())
+        for rule in index.rules:
+            names.update((rule.ingredient_a, rule.ingredient_b, *rule.ingredient_a_aliases, *rule.ingredient_b_aliases))
+        terms = {normalize_question(name): canonical_ingredient(name) for name in names}
+        terms.pop("", None)
+        alternation = "|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True))
+        _entity_matcher = (index.version, re.compile(rf"\b(?:{alternation})\b"), terms)
+    return _entity_matcher[1], _entity_matcher[2]
+
+
+def ingredient_entities(text: str) -> FrozenSet[str]:
+    """Canonical names of the known ingredients a question mentions."""
+    pattern, terms = _entity_terms()
+    return frozenset(terms[match] for match in pattern.findall(normalize_question(text)))
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    namespace: str
+    entities: FrozenSet[str]
+    vector: np.ndarray
+    chunks: List[str]
+    expires_at: float
+
+
+class SemanticResponseCache:
+    """
+    In-process cache of NDJSON chat streams keyed by question embedding.
+    Entries are scoped by namespace (the model identity) so one model's answers
+    are never replayed for another.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        threshold: float = 0.92,
+        ttl_seconds: float = 86400,
+        max_entries: int = 1024,
+        embed_fn: Callable[[str], np.ndarray] = hashed_embedding,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.embed_fn = embed_fn
+        self.clock = clock
+        self._entries: List[CacheEntry] = []
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _evict_expired(self, now: float):
+        self._entries = [e for e in self._entries if e.expires_at > now]
+
+    def lookup(self, question: str, namespace: str = "default") -> Optional[List[str]]:
+        """
+        Return the cached NDJSON chunks of the closest match naming the same
+        ingredients, or None on a miss.
+        """
+        entities = ingredient_entities(question)
+        vector = self.embed_fn(question)
+        with self._lock:
+            self._evict_expired(self.clock())
+            best, best_score = None, self.threshold
+            for entry in self._entries:
+                if entry.namespace != namespace or entry.entities != entities:
+                    continue
+                score = float(np.dot(vector, entry.vector))
+                if score >= best_score:
+                    best, best_score = entry, score
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(best.chunks)
+
+    def store(self, question: str, chunks: List[str], namespace: str = "default"):
+        """Store a completed NDJSON stream. Oldest entries are evicted past max_entries."""
+        if not chunks:
+            return
+        entry = CacheEntry(
+            question=question,
+            namespace=namespace,
+            entities=ingredient_entities(question),
+            vector=self.embed_fn(question),
+            chunks=list(chunks),
+            expires_at=self.clock() + self.ttl_seconds,
+        )
+        with self._lock:
+            self._evict_expired(self.clock())
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                self._entries = self._entries[-self.max_entries:]
+
+    def clear(self):
+        with self._lock:
+            self._entries = []
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def _cache_from_env() -> SemanticResponseCache:
+    return SemanticResponseCache(
+        enabled=os.getenv("SEMANTIC_CACHE_ENABLED", "0") == "1",
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400")),
+        max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1024")),
+    )
+
+
+# Process-wide singleton (replace with Redis in production, like the vision job store)
+response_cache = _cache_from_env()
@@ -0,0 +1,100 @@
+# Shelf Ingredients - Parsed, canonical ingredients of the user's shelf products.
+#
+# Shelf ingredients used to live only in UserProduct.notes ("Ingredients: A, B, C")
+# and every consumer (add-product safety check, guardian shelf context, routine
+# audit) re-parsed that string per request. They are now stored once, at write
+# time, in the user_product_ingredients table (one row per canonical INCI name,
+# in label order), filled in by the vision scan, manual scan completion and
+# add / update product. Consumers read the rows, and "which of my products
+# contain X" is one indexed query (name, user_product_id).
+#
+# Each row also keeps the entry as written on the label: canonical names drop
+# qualifiers that conflict rules match ("Mandelic Acid (AHA)" -> "MANDELIC
+# ACID"), so rule matching (shelf safety gate, routine profile, routine audit)
+# reads product_match_names, never the canonical names alone.
+#
+# notes keeps the human-readable "Ingredients: ..." copy; it is no longer read.
+# Products written before the table existed, or before rows had labels, are
+# backfilled from their notes on startup (backfill_from_notes).
+
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from .ingredients import canonical_ingredient, parse_label_list
+
+
+def ingredients_from_notes(notes: Optional[str]) -> List[str]:
+    """Label entries of an "Ingredients: ..." notes string ([] for other notes)."""
+    if not notes or not notes.startswith("Ingredients:"):
+        return []
+    return parse_label_list(notes)
+
+
+def set_product_ingredients(product: models.UserProduct, ingredients: Iterable[str]) -> List[str]:
+    """
+    Replace a product's ingredient rows with `ingredients` (label entries): one
+    row per canonical name, keeping the first label spelling. Returns the
+    canonical names.
+    """
+    rows = {}
+    for ingredient in ingredients:
+        name = canonical_ingredient(ingredient)
+        if name and name not in rows:
+            rows[name] = " ".join(str(ingredient).split())
+    product.ingredient_rows = [
+        models.UserProductIngredient(position=position, name=name, label=label)
+        for position, (name, label) in enumerate(rows.items())
+    ]
+    return list(rows)
+
+
+def product_ingredients(product) -> List[str]:
+    """Stored canonical ingredients of a shelf product, in label order."""
+    if product is None:
+        return []
+    return [row.name for row in product.ingredient_rows]
+
+
+def row_match_name(row) -> str:
+    """What conflict rules are matched against for one ingredient row."""
+    return row.label or row.name
+
+
+def product_match_names(product) -> List[str]:
+    """Label entries of a shelf product (canonical names for rows without one), in label order."""
+    if product is None:
+        return []
+    return [row_match_name(row) for row in product.ingredient_rows]
+
+
+def products_containing(db: Session, user_id: int, ingredient: str, status: Optional[str] = None) -> List[models.UserProduct]:
+    """The user's shelf products that contain `ingredient` (any spelling)."""
+    query = db.query(models.UserProduct).join(models.UserProduct.ingredient_rows).filter(
+        models.UserProductIngredient.name == canonical_ingredient(ingredient),
+        models.UserProduct.user_id == user_id,
+    )
+    if status:
+        query = query.filter(models.UserProduct.status == status)
+    return query.order_by(models.UserProduct.id).all()
+
+
+def backfill_from_notes(db: Session) -> Dict:
+    """
+    Fill the table for products that only have "Ingredients: ..." notes, or
+    whose rows were stored without labels.
+    """
+    products = db.query(models.UserProduct).filter(
+        models.UserProduct.notes.like("Ingredients:%"),
+        ~models.UserProduct.ingredient_rows.any(models.UserProductIngredient.label.isnot(None)),
+    ).all()
+    for product in products:
+        set_product_ingredients(product, ingredients_from_notes(product.notes))
+    # Routine profiles count the old rows; they are rebuilt on next read
+    user_ids = {product.user_id for product in products}
+    if user_ids:
+        db.query(models.RoutineProfile).filter(
+            models.RoutineProfile.user_id.in_(user_ids)).delete(synchronize_session=False)
+    db.commit()
+    return {"products": len(products)}
@@ -0,0 +1,186 @@
+# Chat Latency Telemetry - Per-turn timings for the chat agents.
+#
+# Each turn records time to first token, the tool-decision LLM call, every tool
+# call, synthesis throughput and token usage. Results are published to the
+# server-side histograms (labelled by model) and can be returned to the client
+# as a trailing {"type": "metrics"} NDJSON event.
+
+import json
+import time
+from typing import Dict, List, Optional
+
+from .metrics import REGISTRY
+
+
+CHAT_TTFT = REGISTRY.histogram(
+    "chat_time_to_first_token_seconds", "Time from request to first text token", ["model"])
+CHAT_TURN_DURATION = REGISTRY.histogram(
+    "chat_turn_duration_seconds", "Total chat turn duration", ["model"])
+CHAT_TOOL_DECISION = REGISTRY.histogram(
+    "chat_tool_decision_seconds", "Duration of the tool-decision LLM call", ["model"])
+CHAT_TOOL_DURATION = REGISTRY.histogram(
+    "chat_tool_duration_seconds", "Duration of a single tool call", ["tool"])
+CHAT_SYNTHESIS_TPS = REGISTRY.histogram(
+    "chat_synthesis_tokens_per_second", "Synthesis streaming throughput", ["model"],
+    buckets=(1, 5, 10, 20, 40, 80, 160, 320))
+CHAT_TOKENS = REGISTRY.counter(
+    "chat_tokens_total", "LLM tokens consumed by chat turns", ["model"])
+CHAT_CACHED_TOKENS = REGISTRY.counter(
+    "chat_prompt_cached_tokens_total", "Input tokens the provider served from its prompt cache", ["model"])
+CHAT_TTFT_BY_PROMPT_CACHE = REGISTRY.histogram(
+    "chat_time_to_first_token_by_prompt_cache_seconds",
+    "Time to first token, split by whether the provider reported a prompt cache hit",
+    ["model", "prompt_cache"])
+GUARDIAN_NODE_DURATION = REGISTRY.histogram(
+    "guardian_node_duration_seconds", "Duration of a guardian graph node", ["node"])
+
+
+def usage_tokens(message) -> Dict[str, int]:
+    """Token usage reported by a LangChain message/chunk (empty if the provider sent none)."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    tokens = {k: int(usage.get(k) or 0) for k in ("input_tokens", "output_tokens", "total_tokens") if k in usage}
+    cache_read = (usage.get("input_token_details") or {}).get("cache_read")
+    if cache_read:
+        tokens["cache_read_tokens"] = int(cache_read)
+    return tokens
+
+
+class TurnMetrics:
+    """Timings for one chat turn. Durations are in seconds, measured with perf_counter."""
+
+    def __init__(self, model: str, clock=time.perf_counter):
+        self.model = model
+        self.clock = clock
+        self.started_at = clock()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.tool_decision: Optional[float] = None
+        self.tools: List[Dict] = []
+        self.nodes: List[Dict] = []
+        self.synthesis_started_at: Optional[float] = None
+        self.synthesis_tokens = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cached_input_tokens = 0  # Served from the provider's prompt cache
+        self.prompt_prefix: Optional[str] = None  # Hash of the stable prompt prefix
+        self.cache_hit = False
+        self.route: Optional[Dict] = None  # Local intent routing decision, if any
+        self.degradations: List[Dict] = []  # Guardian nodes that ran out of budget
+
+    # --- recording ---------------------------------------------------------
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = self.clock()
+
+    def record_tool_decision(self, seconds: float, message=None):
+        self.tool_decision = seconds
+        self.add_usage(message)
+
+    def record_tool(self, name: str, seconds: float):
+        self.tools.append({"name": name, "seconds": round(seconds, 4)})
+
+    def record_node(self, name: str, seconds: float):
+        self.nodes.append({"name": name, "seconds": round(seconds, 4)})
+
+    def start_synthesis(self):
+        self.synthesis_started_at = self.clock()
+
+    def record_synthesis_chunk(self, chunk):
+        """
+        Count synthesis tokens. Providers that report usage on stream chunks are
+        counted exactly; otherwise each non-empty content chunk counts as one token.
+        """
+        usage = usage_tokens(chunk)
+        if usage.get("output_tokens"):
+            self.synthesis_tokens += usage["output_tokens"]
+        elif getattr(chunk, "content", None):
+            self.synthesis_tokens += 1
+        self.add_usage(chunk)
+
+    def add_usage(self, message):
+        if message is None:
+            return
+        usage = usage_tokens(message)
+        self.input_tokens += usage.get("input_tokens", 0)
+        self.output_tokens += usage.get("output_tokens", 0)
+        self.cached_input_tokens += usage.get("cache_read_tokens", 0)
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = self.clock()
+
+    # --- reporting ---------------------------------------------------------
+
+    @property
+    def ttft(self) -> Optional[float]:
+        return None if self.first_token_at is None else self.first_token_at - self.started_at
+
+    @property
+    def total(self) -> float:
+        return (self.finished_at or self.clock()) - self.started_at
+
+    @property
+    def synthesis_tokens_per_second(self) -> Optional[float]:
+        if self.synthesis_started_at is None or not self.synthesis_tokens:
+            return None
+        elapsed = (self.finished_at or self.clock()) - self.synthesis_started_at
+        return self.synthesis_tokens / elapsed if elapsed > 0 else None
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def as_dict(self) -> Dict:
+        def r(value):
+            return None if value is None else round(value, 4)
+
+        data = {
+            "model": self.model,
+            "cache_hit": self.cache_hit,
+            "ttft_seconds": r(self.ttft),
+            "total_seconds": r(self.total),
+            "tool_decision_seconds": r(self.tool_decision),
+            "tools": self.tools,
+            "synthesis_tokens": self.synthesis_tokens,
+            "synthesis_tokens_per_second": r(self.synthesis_tokens_per_second),
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_input_tokens": self.cached_input_tokens,
+            "total_tokens": self.total_tokens,
+        }
+        if self.prompt_prefix:
+            data["prompt_prefix"] = self.prompt_prefix
+        if self.route:
+            data["route"] = self.route
+        if self.nodes:
+            data["nodes"] = self.nodes
+        if self.degradations:
+            data["degradations"] = self.degradations
+        return data
+
+    def to_event(self) -> str:
+        """Trailing NDJSON event for clients that asked for metrics."""
+        return json.dumps({"type": "metrics", "content": self.as_dict()}) + "\n"
+
+    def publish(self):
+        """Push this turn into the server-side histograms."""
+        self.finish()
+        CHAT_TURN_DURATION.observe(self.total, model=self.model)
+        if self.ttft is not None:
+            CHAT_TTFT.observe(self.ttft, model=self.model)
+            if self.prompt_prefix:
+                CHAT_TTFT_BY_PROMPT_CACHE.observe(
+                    self.ttft, model=self.model, prompt_cache="hit" if self.cached_input_tokens else "miss")
+        if self.tool_decision is not None:
+            CHAT_TOOL_DECISION.observe(self.tool_decision, model=self.model)
+        for t in self.tools:
+            CHAT_TOOL_DURATION.observe(t["seconds"], tool=t["name"])
+        for n in self.nodes:
+            GUARDIAN_NODE_DURATION.observe(n["seconds"], node=n["name"])
+        if self.synthesis_tokens_per_second is not None:
+            CHAT_SYNTHESIS_TPS.observe(self.synthesis_tokens_per_second, model=self.model)
+        if self.total_tokens:
+            CHAT_TOKENS.inc(self.total_tokens, model=self.model)
+        if self.cached_input_tokens:
+            CHAT_CACHED_TOKENS.inc(self.cached_input_tokens, model=self.model)
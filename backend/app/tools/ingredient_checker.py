@@ -0,0 +1,20 @@
+from langchain_core.tools import tool
+
+from ..services.ingredients import canonical_ingredient, parse_ingredient_list
+
+@tool
+def ingredient_checker(ingredients: str, allergy: str) -> str:
+    """
+    Checks if a list of ingredients contains a specific allergen.
+    Args:
+        ingredients: Comma-separated list of ingredients.
+        allergy: The allergen to check for (e.g., "peanuts").
+    """
+    # Compare canonical INCI names ("Aqua (Water)" == "Water"), then fall back
+    # to a case-insensitive substring check for common names
+    allergen = canonical_ingredient(allergy)
+    if allergen and any(allergen in name for name in parse_ingredient_list(ingredients)):
+        return f"WARNING: Contains {allergy}!"
+    if allergy.lower() in ingredients.lower():
+        return f"WARNING: Contains {allergy}!"
+    return "Safe."
@@ -0,0 +1,151 @@
+"""
+Per-conversation memoization for agent tools.
+
+Within one conversation the model often repeats a tool call with the same (or a
+trivially different) query. Tools decorated with `@memoize_tool` normalize their
+arguments and return the cached output from the active conversation's memo.
+
+Usage:
+    @tool
+    @memoize_tool
+    def product_retriever(query: str, skin_type: str = "all") -> str: ...
+
+    with use_tool_memo(memo):
+        product_retriever.invoke({"query": "Moisturizer for acne"})
+"""
+
+import re
+import time
+import inspect
+import functools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+# Filler words that don't change what a retrieval query means
+_FILLER_WORDS = {"a", "an", "the", "for", "with", "some", "please", "any", "me", "to"}
+
+# Runtime arguments LangChain injects into tools; never part of the memo key
+_INJECTED_ARGS = {"config", "run_manager", "callbacks"}
+
+
+def normalize_arg(value: Any) -> Any:
+    """
+    Normalize a single tool argument.
+    Strings: lowercase, punctuation stripped, filler words dropped, tokens sorted
+    ("Moisturizer for acne!" == "acne moisturizer").
+    """
+    if not isinstance(value, str):
+        return value
+    tokens = re.sub(r"[^a-z0-9\s\-]", " ", value.lower()).split()
+    return " ".join(sorted(t for t in tokens if t not in _FILLER_WORDS))
+
+
+class ToolMemo:
+    """Cache of tool outputs for one conversation."""
+
+    def __init__(self):
+        self._results: Dict[Tuple, Any] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple):
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                return True, self._results[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: Tuple, value: Any):
+        with self._lock:
+            self._results[key] = value
+
+
+_active_memo: ContextVar[Optional[ToolMemo]] = ContextVar("active_tool_memo", default=None)
+
+
+@contextmanager
+def use_tool_memo(memo: Optional[ToolMemo]):
+    """Activate a conversation memo for tool calls made inside the block."""
+    token = _active_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _active_memo.reset(token)
+
+
+def memoize_tool(func: Callable) -> Callable:
+    """
+    Decorator for tool functions. Apply it underneath `@tool` so LangChain still
+    sees the original signature and docstring. Without an active memo the tool
+    runs normally.
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        memo = _active_memo.get()
+        if memo is None:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (func.__name__,) + tuple(
+            (name, normalize_arg(value))
+            for name, value in sorted(bound.arguments.items())
+            if name not in _INJECTED_ARGS
+        )
+
+        found, result = memo.get(key)
+        if found:
+            return result
+        result = func(*args, **kwargs)
+        memo.set(key, result)
+        return result
+
+    return wrapper
+
+
+# ============================================================================
+# CONVERSATION REGISTRY
+# ============================================================================
+
+class ConversationMemoStore:
+    """
+    Bounded, TTL-expiring map of conversation key -> ToolMemo.
+    Keys include the user id so memos are never shared across users.
+    """
+
+    def __init__(self, ttl_seconds: float = 1800, max_conversations: int = 1000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_conversations = max_conversations
+        self.clock = clock
+        self._memos: "OrderedDict[Tuple, Tuple[ToolMemo, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Optional[int], conversation_id: Optional[str]) -> ToolMemo:
+        """Return the memo for a conversation (a fresh one if no conversation_id)."""
+        if not conversation_id:
+            return ToolMemo()
+
+        key = (user_id, conversation_id)
+        now = self.clock()
+        with self._lock:
+            entry = self._memos.pop(key, None)
+            if entry is None or entry[1] <= now:
+                memo = ToolMemo()
+            else:
+                memo = entry[0]
+            self._memos[key] = (memo, now + self.ttl_seconds)
+            while len(self._memos) > self.max_conversations:
+                self._memos.popitem(last=False)
+            return memo
+
+
+conversation_memos = ConversationMemoStore()
@@ -0,0 +1,56 @@
+from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
+import json
+
+from .. import rag
+from .memo import memoize_tool
+from .registry import get_tool_db
+
+@tool
+@memoize_tool
+def product_retriever(query: str, config: RunnableConfig, skin_type: str = "all") -> str:
+    """
+    Search for skincare products using Hybrid Search (Vector + Keyword).
+    Returns a JSON list of products.
+    Args:
+        query: The search query (e.g., "moisturizer for acne").
+        skin_type: User's skin type to filter by (e.g., "oily", "dry", "all").
+    """
+    db = get_tool_db(config)
+
+    filters = {}
+    if skin_type and skin_type != "all":
+        filters["skin_type"] = skin_type
+        
+    results = rag.hybrid_search(db, query, filters=filters, limit=3)
+    
+    if not results:
+        return "[]"
+        
+    # Format results as JSON for the LLM and Frontend
+    product_list = []
+    for p in results:
+        # Generate Affiliate Link (Amazon Search Fallback)
+        # In a real app, this would be a specific ASIN link from a database
+        affiliate_tag = "skinairecs-20"
+        encoded_name = p.name.replace(" ", "+")
+        affiliate_url = f"https://www.amazon.com/s?k={encoded_name}&tag={affiliate_tag}"
+        
+        # Enrich metadata - parse from JSON string if needed
+        raw_meta = p.metadata_info
+        if isinstance(raw_meta, str):
+            try:
+                metadata = json.loads(raw_meta)
+            except (json.JSONDecodeError, TypeError):
+                metadata = {}
+        else:
+            metadata = raw_meta or {}
+        metadata["affiliate_url"] = affiliate_url
+        
+        product_list.append({
+            "name": p.name,
+            "brand": p.brand,
+            "description": p.description,
+            "metadata": metadata
+        })
+    return json.dumps(product_list)
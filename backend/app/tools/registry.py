@@ -0,0 +1,54 @@
+"""
+Shared Tool Registry
+
+Agent tools are built once per process. Per-request state (the DB session) is
+injected through LangChain's RunnableConfig at call time instead of being
+captured in per-request closures, so constructing an agent is free.
+
+Usage:
+    llm.bind_tools(get_tool_specs())
+    dispatch_tool("product_retriever", {"query": "CeraVe"}, db=db)
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from sqlalchemy.orm import Session
+
+
+def tool_config(db: Optional[Session]) -> RunnableConfig:
+    """Build the per-call config that carries the DB session into tools."""
+    return {"configurable": {"db": db}}
+
+
+def get_tool_db(config: Optional[RunnableConfig]) -> Optional[Session]:
+    """Read the DB session injected by `tool_config` (None outside a request)."""
+    return ((config or {}).get("configurable") or {}).get("db")
+
+
+@lru_cache(maxsize=None)
+def get_tool_registry() -> Dict[str, BaseTool]:
+    """Name -> tool. Imported lazily because tool modules import this one."""
+    from .product_retriever import product_retriever
+    from .ingredient_checker import ingredient_checker
+    from .store_locator import store_locator
+
+    tools = [product_retriever, ingredient_checker, store_locator]
+    return {t.name: t for t in tools}
+
+
+@lru_cache(maxsize=None)
+def get_tool_specs() -> List[Dict]:
+    """OpenAI-format function specs, generated once and reused by every bind_tools call."""
+    return [convert_to_openai_tool(t) for t in get_tool_registry().values()]
+
+
+def dispatch_tool(name: str, args: Dict, db: Optional[Session] = None) -> str:
+    """Invoke a registered tool by name with the request's DB session."""
+    tool = get_tool_registry().get(name)
+    if tool is None:
+        return "Error: Tool not found"
+    return tool.invoke(args, config=tool_config(db))
@@ -1,8 +1,10 @@
 from langchain.tools import tool
 import json
 import random
+from .memo import memoize_tool
 
 @tool
+@memoize_tool
 def store_locator(query: str) -> str:
     """
     Useful for finding where to buy a product in physical stores.
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Guardian Setup Benchmark
+Measures the per-request cost of constructing a GuardianAgent.
+
+Before: every GuardianAgent built and compiled its own StateGraph.
+After:  the graph is compiled once per process; each agent only builds a config.
+
+Usage:
+    python benchmarks/bench_guardian_setup.py            # 200 iterations
+    python benchmarks/bench_guardian_setup.py -n 1000
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.guardian_agent import GuardianAgent, create_guardian_graph, get_guardian_graph
+
+
+def timed(fn, iterations: int) -> list:
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label: str, samples: list):
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(f"{label:<34} mean {statistics.mean(samples):8.3f} ms   "
+          f"p50 {statistics.median(samples):8.3f} ms   p95 {p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark guardian agent setup cost")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    get_guardian_graph()  # startup compile, paid once
+
+    per_request_compile = timed(create_guardian_graph, args.iterations)
+    shared_graph = timed(lambda: GuardianAgent(llm=None, db_session=None), args.iterations)
+
+    print(f"Guardian setup per request ({args.iterations} iterations)\n")
+    report("compile per request (before)", per_request_compile)
+    report("shared compiled graph (after)", shared_graph)
+    saved = statistics.mean(per_request_compile) - statistics.mean(shared_graph)
+    print(f"\nSaved per request: {saved:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
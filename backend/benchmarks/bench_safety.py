@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Safety Engine Benchmark
+Latency percentiles and throughput of the Tier-1 conflict engine
+(check_routine_conflicts) and the stateless /safety/* endpoints, on synthetic
+routines and products with realistic INCI lists (10-80 ingredients per
+product, 1-15 products per routine; seeded, so runs are comparable).
+
+The PRD budget is <500 ms per Tier-1 check; any case whose p99 exceeds it is
+flagged. With --baseline, each case's p50 / p95 is compared with a stored
+baseline and a slowdown beyond --tolerance is flagged as a regression (exit
+status 1), so rule-engine changes can be judged on data. Baselines are
+machine-specific: record one on the machine you compare on.
+
+Usage:
+    python benchmarks/bench_safety.py                          # 300 checks per case
+    python benchmarks/bench_safety.py -n 1000 --cold           # clear ingredient caches before every check
+    python benchmarks/bench_safety.py --save-baseline benchmarks/baselines/safety.json
+    python benchmarks/bench_safety.py --baseline benchmarks/baselines/safety.json --tolerance 0.25
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from app.services.conflict_rules import check_routine_conflicts, get_alias_index
+from app.services import ingredients as ingredient_canonicalizer
+
+TIER1_BUDGET_MS = 500  # PRD: "<500ms latency for Tier 1 rule-based checks"
+
+# Typical non-active INCI names (bases, emollients, humectants, preservatives...)
+FILLERS = [
+    "Aqua", "Water", "Glycerin", "Butylene Glycol", "Propanediol", "Pentylene Glycol", "Caprylic/Capric Triglyceride",
+    "Squalane", "Dimethicone", "Cyclopentasiloxane", "Cetearyl Alcohol", "Cetyl Alcohol", "Stearyl Alcohol",
+    "Glyceryl Stearate", "PEG-100 Stearate", "Ceteareth-20", "Polysorbate 20", "Sodium Hyaluronate", "Panthenol",
+    "Allantoin", "Tocopherol", "Tocopheryl Acetate", "Bisabolol", "Ceramide NP", "Ceramide AP", "Ceramide EOP",
+    "Phytosphingosine", "Cholesterol", "Sodium Lauroyl Lactylate", "Carbomer", "Xanthan Gum", "Hydroxyethylcellulose",
+    "Sodium Polyacrylate", "Acrylates/C10-30 Alkyl Acrylate Crosspolymer", "Sodium Hydroxide", "Citric Acid",
+    "Sodium Citrate", "Disodium EDTA", "Phenoxyethanol", "Ethylhexylglycerin", "Chlorphenesin", "Sodium Benzoate",
+    "Potassium Sorbate", "Caprylyl Glycol", "1,2-Hexanediol", "Butyrospermum Parkii (Shea) Butter",
+    "Simmondsia Chinensis (Jojoba) Seed Oil", "Helianthus Annuus (Sunflower) Seed Oil", "Isopropyl Myristate",
+    "C12-15 Alkyl Benzoate", "Isononyl Isononanoate", "Hydrogenated Polyisobutene", "Behenyl Alcohol",
+    "Aloe Barbadensis Leaf Juice", "Camellia Sinensis Leaf Extract", "Centella Asiatica Extract",
+    "Glycyrrhiza Glabra (Licorice) Root Extract", "Madecassoside", "Betaine", "Urea", "Trehalose", "Sodium PCA",
+    "Silica", "Titanium Dioxide", "Zinc Oxide", "Mica", "Iron Oxides (CI 77491)", "Parfum/Fragrance", "Limonene",
+    "Linalool", "Polyglyceryl-3 Diisostearate", "Sorbitan Olivate", "Cetearyl Olivate", "Lecithin", "Sodium Chloride",
+    "Magnesium Sulfate", "Hydroxyacetophenone", "Arginine", "Tromethamine", "Adenosine", "Ectoin",
+]
+
+
+def actives_pool() -> list:
+    """Names that hit the conflict rules, in the spellings labels use."""
+    names = set()
+    for rule in get_alias_index().rules:
+        for name in [rule.ingredient_a, rule.ingredient_b] + rule.ingredient_a_aliases + rule.ingredient_b_aliases:
+            names.add(name.title())
+    return sorted(names)
+
+
+def inci_list(rng: random.Random, actives: list) -> list:
+    """One product: 10-80 ingredients, 0-3 of them actives, some with label noise."""
+    size = rng.randint(10, 80)
+    chosen = rng.sample(actives, rng.choice([0, 0, 1, 1, 1, 2, 3]))
+    fillers = [rng.choice(FILLERS) for _ in range(size - len(chosen))]
+    ingredients = fillers + chosen
+    rng.shuffle(ingredients)
+    noisy = []
+    for name in ingredients:
+        roll = rng.random()
+        if roll < 0.05:
+            name = f"{name} {rng.choice([0.5, 1, 2, 5, 10])}%"
+        elif roll < 0.1:
+            name = name.upper()
+        elif roll < 0.12:
+            name = f"*{name}"
+        noisy.append(name)
+    return noisy
+
+
+def workload(seed: int, cases: int) -> list:
+    """(candidate ingredients, routine ingredients, routine product count) per check."""
+    rng = random.Random(seed)
+    actives = actives_pool()
+    checks = []
+    for _ in range(cases):
+        products = rng.randint(1, 15)
+        routine = [name for _ in range(products) for name in inci_list(rng, actives)]
+        checks.append((inci_list(rng, actives), routine, products))
+    return checks
+
+
+def clear_caches():
+    ingredient_canonicalizer.canonical_ingredient.cache_clear()
+    ingredient_canonicalizer._parse_list.cache_clear()
+    ingredient_canonicalizer._parse_labels.cache_clear()
+    ingredient_canonicalizer.ingredient_match_names.cache_clear()
+    get_alias_index().sides_for.cache_clear()
+
+
+def measure(fn, checks: list, cold: bool, batch_size: int = 1) -> dict:
+    """Run fn once per check; latency per call and checks per second."""
+    samples = []
+    for check in checks:
+        if cold:
+            clear_caches()
+        start = time.perf_counter()
+        fn(check)
+        samples.append((time.perf_counter() - start) * 1000)
+    total_seconds = sum(samples) / 1000
+    return summarize(samples, len(checks) * batch_size / total_seconds if total_seconds else 0.0)
+
+
+def percentile(ordered: list, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(samples: list, throughput: float) -> dict:
+    ordered = sorted(samples)
+    return {
+        "p50_ms": percentile(ordered, 0.50),
+        "p95_ms": percentile(ordered, 0.95),
+        "p99_ms": percentile(ordered, 0.99),
+        "max_ms": ordered[-1],
+        "mean_ms": statistics.mean(samples),
+        "checks_per_s": throughput,
+    }
+
+
+def benchmark(checks: list, cold: bool, batch_size: int) -> dict:
+    from main import app
+    # No context manager: the lifespan (DB setup) is not needed by the stateless endpoints
+    client = TestClient(app)
+
+    def post(path, body):
+        response = client.post(path, json=body)
+        assert response.status_code == 200, f"{path} -> {response.status_code}"
+
+    def get(path):
+        response = client.get(path)
+        assert response.status_code == 200, f"{path} -> {response.status_code}"
+
+    # One batch per check (a window of the following checks), so the batch case has as many samples
+    batches = [(checks * 2)[i:i + batch_size] for i in range(len(checks))]
+    results = {
+        "engine.check_routine_conflicts": measure(
+            lambda c: check_routine_conflicts(product_ingredients=c[0], routine_ingredients=c[1]), checks, cold),
+        "POST /safety/check-routine": measure(
+            lambda c: post("/safety/check-routine", {"product_ingredients": c[0], "routine_ingredients": c[1]}),
+            checks, cold),
+        "POST /safety/check-ingredients": measure(
+            lambda c: post("/safety/check-ingredients", {
+                "ingredient_list_a": {"ingredients": c[0]}, "ingredient_list_b": {"ingredients": c[1]}}),
+            checks, cold),
+        f"POST /safety/check-routine-batch (x{batch_size})": measure(
+            lambda batch: post("/safety/check-routine-batch", {
+                "candidates": [{"id": str(i), "ingredients": c[0]} for i, c in enumerate(batch)],
+                "routine_ingredients": batch[0][1],
+            }), batches, cold, batch_size=batch_size),
+        "GET /safety/known-conflicts": measure(lambda c: get("/safety/known-conflicts"), checks, cold),
+    }
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Cases slower than the baseline by more than tolerance (p50 or p95)."""
+    regressions = []
+    for case, stats in results.items():
+        before = baseline.get("results", {}).get(case)
+        if not before:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if before[key] > 0 and stats[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{case}: {key} {before[key]:.3f} -> {stats[key]:.3f} ms "
+                                   f"(+{(stats[key] / before[key] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Tier-1 conflict engine and /safety endpoints")
+    parser.add_argument("-n", "--iterations", type=int, default=300, help="checks per case")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=20, help="candidates per /check-routine-batch call")
+    parser.add_argument("--cold", action="store_true", help="clear ingredient caches before every check")
+    parser.add_argument("--baseline", help="compare with a stored baseline (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", help="write these results as a baseline (JSON)")
+    args = parser.parse_args()
+
+    checks = workload(args.seed, args.iterations)
+    sizes = [len(c[0]) for c in checks]
+    routine_sizes = [c[2] for c in checks]
+    for check in checks[:20]:  # Warm-up (imports, first compile of the alias index)
+        check_routine_conflicts(product_ingredients=check[0], routine_ingredients=check[1])
+
+    results = benchmark(checks, args.cold, args.batch_size)
+
+    print(f"Safety engine ({args.iterations} checks per case, seed {args.seed}, "
+          f"{'cold' if args.cold else 'warm'} caches, rules {get_alias_index().version})")
+    print(f"Products: {min(sizes)}-{max(sizes)} ingredients; routines: "
+          f"{min(routine_sizes)}-{max(routine_sizes)} products\n")
+    print(f"{'case':<46} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'checks/s':>10}")
+    over_budget = []
+    for case, stats in results.items():
+        print(f"{case:<46} {stats['p50_ms']:7.3f}ms {stats['p95_ms']:7.3f}ms {stats['p99_ms']:7.3f}ms "
+              f"{stats['max_ms']:7.3f}ms {stats['checks_per_s']:10.0f}")
+        if stats["p99_ms"] > TIER1_BUDGET_MS:
+            over_budget.append(case)
+
+    failed = False
+    if over_budget:
+        failed = True
+        print(f"\nOver the {TIER1_BUDGET_MS} ms Tier-1 budget (p99): {', '.join(over_budget)}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\nBaseline {args.baseline} ({baseline.get('machine', 'unknown machine')}, "
+              f"tolerance {args.tolerance * 100:.0f}%):")
+        if regressions:
+            failed = True
+            for line in regressions:
+                print(f"  REGRESSION {line}")
+        else:
+            print("  no regressions")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump({
+                "machine": f"{platform.machine()} / Python {platform.python_version()}",
+                "iterations": args.iterations,
+                "seed": args.seed,
+                "cold": args.cold,
+                "batch_size": args.batch_size,
+                "rules_version": get_alias_index().version,
+                "results": {case: {k: round(v, 4) for k, v in stats.items()} for case, stats in results.items()},
+            }, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline written to {args.save_baseline}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
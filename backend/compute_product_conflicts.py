@@ -0,0 +1,37 @@
+"""
+Materialize conflicting catalogue product pairs into the product_conflicts table.
+
+    python compute_product_conflicts.py                 # incremental (stale masks only)
+    python compute_product_conflicts.py --since 2026-10-01T00:00:00
+    python compute_product_conflicts.py --products 12,40
+    python compute_product_conflicts.py --full
+"""
+import argparse
+from datetime import datetime
+
+from app.database import SessionLocal, add_missing_columns, engine
+from app.models import Base
+from app.services.product_conflicts import refresh_product_conflicts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--full", action="store_true", help="recompute every pair")
+    parser.add_argument("--since", type=datetime.fromisoformat, help="also recompute products updated since")
+    parser.add_argument("--products", default="", help="comma-separated product ids to recompute")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    product_ids = [int(i) for i in args.products.split(",") if i.strip()]
+    db = SessionLocal()
+    try:
+        stats = refresh_product_conflicts(db, product_ids=product_ids, since=args.since, full=args.full)
+        print(f"✅ {stats['mode']}: recomputed {stats['recomputed']} of {stats['products']} products, "
+              f"{stats['conflicts']} conflicting pairs written (rules {stats['rules_version']})")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
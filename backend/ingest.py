@@ -3,6 +3,7 @@ import json
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.models import Product, Base
+from app.services.rule_masks import refresh_rule_mask
 import numpy as np
 
 # Connection String (matches docker-compose)
@@ -232,6 +233,8 @@ def ingest_data():
             if 'sqlite' in str(engine.url):
                 product.embedding = json.dumps(embedding.tolist())
             
+            # Precompute matched conflict-rule sides for the Safety Guard
+            refresh_rule_mask(product)
             db.add(product)
         
         db.commit()
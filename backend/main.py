@@ -1,16 +1,34 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
-from app.database import engine, Base
+from app.database import engine, Base, add_missing_columns
+from app.services.metrics import REGISTRY
 from app.routers import auth, chat, users, history, routine, profile, user_products, journal, products, vision, safety
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Create tables on startup (not at import time)
     Base.metadata.create_all(bind=engine)
+    # ...and add columns that models gained since (e.g. products.rule_mask)
+    add_missing_columns(engine)
+    # Compile the guardian graph once, before the first request needs it
+    from app.guardian_agent import get_guardian_graph
+    get_guardian_graph()
+    # Same for the conflict rules' alias index (hot-reloaded from then on)
+    from app.services.conflict_rules import get_alias_index
+    get_alias_index()
+    # Shelf products saved before user_product_ingredients existed
+    from app.database import SessionLocal
+    from app.services.shelf_ingredients import backfill_from_notes
+    db = SessionLocal()
+    try:
+        backfill_from_notes(db)
+    finally:
+        db.close()
     yield
     # Cleanup on shutdown (if needed)
 
@@ -47,3 +65,8 @@ def read_root():
 @app.get("/health")
 def health_check():
     return {"status": "healthy"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Server-side metrics in Prometheus text format."""
+    return REGISTRY.render_prometheus()
@@ -1,6 +1,7 @@
 from scrapers.multi_store_scraper import MultiStoreScraper
 from app.database import SessionLocal, engine
 from app.models import Product, Base
+from app.services.rule_masks import refresh_rule_mask
 from ingest import get_mock_embedding
 
 def run_and_save():
@@ -46,6 +47,7 @@ def run_and_save():
                 metadata_info=p_data["metadata"],
                 embedding=embedding_val
             )
+            refresh_rule_mask(p)
             db.add(p)
             added_count += 1
             print(f"   + Added: {p.name} [{p.brand}]")
@@ -2,13 +2,14 @@ import pytest
 import sys 
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from app.database import Base, engine, SessionLocal
+from app.database import Base, engine, SessionLocal, add_missing_columns
 import app.models # Register models
 
 @pytest.fixture(scope="session", autouse=True)
 def setup_database():
     # Create tables
     Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
     yield
     # Drop tables after tests (optional, good for cleanup)
     # Base.metadata.drop_all(bind=engine)
@@ -9,6 +9,7 @@ sys.path.append(os.getcwd())
 
 from backend.app.agent import SkincareAgent
 from backend.app.database import engine, SessionLocal
+from backend.app.services.intent_router import evaluate_router
 
 # Mock Agent for Evaluation (Since we don't have a live key for CI/CD)
 # In a real environment, you would pass a real key or use a VCR cassette.
@@ -110,6 +111,13 @@ def evaluate():
     api_score = (score / total) * 100
     print(f"\n--- Final Score: {api_score}% ({score}/{total}) ---")
     
+    # Local intent router (runs before the tool-decision LLM call)
+    router = evaluate_router(test_cases)
+    print(f"--- Intent Router: {router['accuracy'] * 100:.0f}% ({router['correct']}/{router['total']}), "
+          f"tool-decision call skipped on {router['llm_decisions_skipped'] * 100:.0f}% ---")
+    for miss in router["mismatches"]:
+        print(f"  [ROUTER MISS] #{miss['id']}: expected {miss['expected']}, routed {miss['routed']} ({miss['reason']})")
+    
     if api_score < 90:
         print("❌ FAILED: Accuracy below 90%")
         sys.exit(1)
@@ -1,3 +1,5 @@
+import uuid
+
 import pytest
 from app.agent import SkincareAgent
 from app import models
@@ -5,7 +7,8 @@ from unittest.mock import MagicMock
 
 def test_build_system_context_structure(db_session):
     # 1. Setup User Data
-    user = models.User(email="context_test@example.com", social_provider="test", social_id="123")
+    social_id = f"context_test_{uuid.uuid4().hex[:8]}"  # Unique per run: rows outlive the test
+    user = models.User(email=f"{social_id}@test.com", social_provider="test", social_id=social_id)
     db_session.add(user)
     db_session.commit()
     
@@ -0,0 +1,117 @@
+# Tests for cancelling chat turns when the client disconnects
+import asyncio
+import threading
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.agent import SkincareAgent
+from app.services.cancellation import (
+    CancellationToken,
+    CANCELLED_TURNS,
+    stream_until_disconnect,
+)
+
+
+class DisconnectingLLM:
+    """
+    Requests a tool, and streams synthesis chunks until told otherwise.
+    `cancel_on` selects when the simulated disconnect happens.
+    """
+
+    model_name = "cancel-stub"
+
+    def __init__(self, token, cancel_on):
+        self.token = token
+        self.cancel_on = cancel_on
+        self.stream_closed = False
+        self.chunks_sent = 0
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        if self.cancel_on == "decision":
+            self.token.cancel()
+        return AIMessage(content="", tool_calls=[{
+            "name": "ingredient_checker",
+            "args": {"ingredients": "Water", "allergy": "peanut"},
+            "id": "call_1",
+        }])
+
+    def stream(self, messages):
+        try:
+            for i in range(100):
+                self.chunks_sent += 1
+                if self.cancel_on == "synthesis" and i == 2:
+                    self.token.cancel()
+                yield AIMessageChunk(content=f"word{i} ")
+        finally:
+            self.stream_closed = True
+
+
+def test_token_flag():
+    token = CancellationToken()
+    assert token.cancelled is False
+    token.cancel("test")
+    assert token.cancelled is True
+    assert token.reason == "test"
+
+
+def test_pending_tools_skipped_after_disconnect():
+    token = CancellationToken()
+    llm = DisconnectingLLM(token, cancel_on="decision")
+    before = CANCELLED_TURNS.value(model="cancel-stub", stage="tools")
+
+    agent = SkincareAgent(llm=llm, db_session=None)
+    events = list(agent.run_stream("is this safe?", [], cancel_token=token, include_metrics=True))
+
+    assert events == []  # no tool results, no synthesis, no metrics event
+    assert agent.turn_metrics.tools == []
+    assert CANCELLED_TURNS.value(model="cancel-stub", stage="tools") == before + 1
+
+
+def test_llm_stream_closed_on_disconnect():
+    token = CancellationToken()
+    llm = DisconnectingLLM(token, cancel_on="synthesis")
+
+    agent = SkincareAgent(llm=llm, db_session=None)
+    list(agent.run_stream("is this safe?", [], cancel_token=token))
+
+    assert llm.stream_closed is True
+    assert llm.chunks_sent < 100
+
+
+def test_stream_until_disconnect_cancels_and_closes():
+    token = CancellationToken()
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            for i in range(1000):
+                yield f"{i}\n"
+        finally:
+            closed.set()
+
+    async def consume_two():
+        stream = stream_until_disconnect(chunks(), token)
+        received = [await stream.__anext__(), await stream.__anext__()]
+        await stream.aclose()  # what Starlette does when the client goes away
+        # The worker is done with the generator before the response ends (and the
+        # request's DB session is released)
+        return received, closed.is_set()
+
+    received, closed_on_return = asyncio.run(consume_two())
+
+    assert received == ["0\n", "1\n"]
+    assert token.cancelled is True
+    assert closed_on_return is True
+
+
+def test_stream_until_disconnect_completes_normally():
+    token = CancellationToken()
+
+    async def consume_all():
+        return [chunk async for chunk in stream_until_disconnect(iter(["a\n", "b\n"]), token)]
+
+    assert asyncio.run(consume_all()) == ["a\n", "b\n"]
+    assert token.cancelled is False
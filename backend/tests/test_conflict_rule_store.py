@@ -0,0 +1,82 @@
+# Tests for the externalized, hot-reloaded conflict rule store
+import json
+
+import pytest
+
+from app.services import conflict_rules
+from app.services.conflict_rules import (
+    DEFAULT_RULES_PATH,
+    check_routine_conflicts,
+    get_alias_index,
+    reload_rules,
+)
+
+
+BAKUCHIOL_RULE = {
+    "ingredient_a": "RETINOL", "ingredient_a_aliases": [],
+    "ingredient_b": "BAKUCHIOL", "ingredient_b_aliases": ["Psoralea Corylifolia"],
+    "risk_level": "ADVICE", "interaction_type": "redundant",
+    "reasoning": "Two retinoid-like actives.", "recommended_adjustment": "Pick one.", "source": "Test",
+}
+
+
+@pytest.fixture
+def rules_file(tmp_path, monkeypatch):
+    with open(DEFAULT_RULES_PATH) as f:
+        data = json.load(f)
+    path = tmp_path / "conflict_rules.json"
+
+    def write(version, extra_rules=(), raw=None):
+        path.write_text(raw if raw is not None else json.dumps(
+            {"version": version, "rules": data["rules"] + list(extra_rules)}))
+
+    write(data["version"])
+    monkeypatch.setenv("CONFLICT_RULES_PATH", str(path))
+    yield write
+    monkeypatch.delenv("CONFLICT_RULES_PATH")
+    reload_rules(force=True)
+
+
+def test_new_version_is_swapped_in(rules_file):
+    before = get_alias_index()
+    assert reload_rules() is False  # Same version: nothing to do
+    assert get_alias_index() is before
+    assert check_routine_conflicts(["Retinol"], ["Bakuchiol"]) == []
+
+    rules_file("test-2", [BAKUCHIOL_RULE])
+    assert reload_rules() is True
+    after = get_alias_index()
+    assert after is not before and after.file_version == "test-2"
+    assert after.version != before.version  # Stored rule masks go stale
+    assert check_routine_conflicts(["Retinol"], ["Psoralea Corylifolia Seed Oil"])[0]["ingredient_b"] == "BAKUCHIOL"
+
+
+def test_invalid_file_keeps_current_rules(rules_file):
+    before = get_alias_index()
+    rules_file(None, raw="{not json")
+    assert reload_rules() is False
+    rules_file("test-3", [dict(BAKUCHIOL_RULE, risk_level="SEVERE")])
+    assert reload_rules() is False
+    assert get_alias_index() is before
+
+
+def test_workers_hot_reload_on_file_change(rules_file, monkeypatch):
+    monkeypatch.setattr(conflict_rules, "RELOAD_SECONDS", 0.001)
+    monkeypatch.setattr(conflict_rules, "_last_reload_check", 0.0)
+    rules_file("test-4", [BAKUCHIOL_RULE])
+    assert get_alias_index().file_version == "test-4"
+
+
+def test_known_conflicts_etag(client, rules_file):
+    first = client.get("/safety/known-conflicts")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.json()["total_rules"] == len(get_alias_index().rules)
+
+    assert client.get("/safety/known-conflicts", headers={"If-None-Match": etag}).status_code == 304
+
+    rules_file("test-5", [BAKUCHIOL_RULE])
+    reload_rules()
+    changed = client.get("/safety/known-conflicts", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert changed.json()["version"] == "test-5"
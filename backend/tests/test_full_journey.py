@@ -1,22 +1,7 @@
-import pytest
-from app import models
 import json
+import uuid
 
-@pytest.fixture
-def journey_client(module_client, db_session):
-    """
-    Fresh client for the journey.
-    """
-    # Clean DB (Truncate tables relevant to user)
-    db_session.query(models.UserProduct).delete()
-    db_session.query(models.JournalEntry).delete()
-    db_session.query(models.RoutineItem).delete()
-    db_session.query(models.Profile).delete()
-    db_session.query(models.User).delete()
-    db_session.commit()
-    return module_client
-
-def test_critical_user_journey(journey_client):
+def test_critical_user_journey(module_client):
     """
     Simulates a Real User Lifecycle:
     1. Register
@@ -28,8 +13,9 @@ def test_critical_user_journey(journey_client):
     
     # 1. Register & Login
     # Using mock id token flow from verify_google_token mock
-    mock_token = "mock_token_journey_user"
-    login_res = journey_client.post("/auth/google", json={"id_token": mock_token, "tos_agreed": True})
+    # A fresh user per run: nothing depends on rows left by earlier runs
+    mock_token = f"mock_token_journey_{uuid.uuid4().hex[:8]}"
+    login_res = module_client.post("/auth/google", json={"id_token": mock_token, "tos_agreed": True})
     assert login_res.status_code == 200
     token = login_res.json()["access_token"]
     headers = {"Authorization": f"Bearer {token}", "X-Goog-Api-Key": "mock_key"}
@@ -39,11 +25,11 @@ def test_critical_user_journey(journey_client):
         "skin_type": "Combination",
         "concerns": ["Redness", "Aging"]
     }
-    res = journey_client.put("/users/profile", json=profile_payload, headers=headers)
+    res = module_client.put("/users/profile", json=profile_payload, headers=headers)
     assert res.status_code == 200
     
     # Verify Profile
-    res = journey_client.get("/users/profile", headers=headers)
+    res = module_client.get("/users/profile", headers=headers)
     assert res.status_code == 200
     assert res.json().get("skin_type") == "Combination"
     
@@ -54,7 +40,7 @@ def test_critical_user_journey(journey_client):
         "category": "Toner",
         "status": "active"
     }
-    res = journey_client.post("/products/", json=product_payload, headers=headers)
+    res = module_client.post("/products/", json=product_payload, headers=headers)
     assert res.status_code == 200
     
     # 4. Log Journal Entry (History)
@@ -63,7 +49,7 @@ def test_critical_user_journey(journey_client):
         "notes": "Had a bad reaction to sushi.",
         "tags": ["reaction"]
     }
-    res = journey_client.post("/journal/", json=journal_payload, headers=headers)
+    res = module_client.post("/journal/", json=journal_payload, headers=headers)
     assert res.status_code == 200
     
     # 5. Chat with AI (Context Check)
@@ -79,7 +65,7 @@ def test_critical_user_journey(journey_client):
     # Since TestClient manages its own connection, standard requests work. 
     # But streaming response in TestClient can be iterated.
     
-    res = journey_client.post("/chat/", json=chat_payload, headers=headers)
+    res = module_client.post("/chat/", json=chat_payload, headers=headers)
     assert res.status_code == 200
     
     full_response = ""
@@ -0,0 +1,312 @@
+# Tests for the shared, compile-once guardian graph and its parallel branches
+import json
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app import rag
+from app import guardian_agent
+from app.guardian_agent import (
+    GuardianAgent, BudgetExceeded, UNVERIFIED_NOTICE, get_guardian_graph, node_select_products, context_cache,
+    _run_within_budget,
+)
+from app.services.cancellation import CancellationToken
+from app.services.rule_masks import ingredients_mask, refresh_rule_mask
+
+
+class NamedLLM:
+    def __init__(self, name):
+        self.name = name
+
+    def invoke(self, messages):
+        return AIMessage(content=f"answer from {self.name}")
+
+
+def test_graph_is_compiled_once(db_session):
+    first = GuardianAgent(llm=NamedLLM("a"), db_session=db_session)
+    second = GuardianAgent(llm=NamedLLM("b"), db_session=db_session)
+    assert first.graph is second.graph is get_guardian_graph()
+
+
+def test_db_and_llm_are_per_invocation(db_session):
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[]) as search:
+        a = GuardianAgent(llm=NamedLLM("a"), db_session=db_session).run("moisturizer", user_id=-1)
+        b = GuardianAgent(llm=NamedLLM("b"), db_session=db_session).run("moisturizer", user_id=-1)
+
+    assert a["final_response"] == "answer from a"
+    assert b["final_response"] == "answer from b"
+    # Parallel branches use their own sessions on the request's engine
+    assert all(call.args[0].get_bind() is db_session.get_bind() for call in search.call_args_list)
+
+
+def product_row(pid, skin_type):
+    return SimpleNamespace(id=pid, name=f"P{pid}", brand="B", description="", ingredients_text="",
+                           metadata_info={"skin_type": skin_type})
+
+
+def test_independent_nodes_run_concurrently(db_session):
+    spans = {}
+
+    def slow(name, result):
+        def node(*args, **kwargs):
+            started = time.perf_counter()
+            time.sleep(0.2)
+            spans.setdefault(name, (started, time.perf_counter()))
+            return result
+        return node
+
+    with patch("app.guardian_agent.rag.hybrid_search", side_effect=slow("retrieve_products", [])), \
+            patch("app.guardian_agent.node_get_profile", side_effect=slow("get_profile", {"user_context": {}})), \
+            patch("app.guardian_agent.node_get_shelf", side_effect=slow("get_shelf", {"user_context": {}})):
+        agent = GuardianAgent(llm=NamedLLM("a"), db_session=db_session)
+        events = list(agent.run_stream("moisturizer", user_id=-1, include_metrics=True))
+
+    # Every branch started before any other finished: they ran in one step
+    assert set(spans) == {"get_profile", "get_shelf", "retrieve_products"}
+    assert max(start for start, _ in spans.values()) < min(end for _, end in spans.values())
+    nodes = {n["name"] for n in json.loads(events[-1])["content"]["nodes"]}
+    assert {"get_profile", "get_shelf", "retrieve_products"} <= nodes
+
+
+def test_select_products_filters_speculative_results():
+    dry = [{"id": i, "name": f"Dry {i}", "metadata": {"skin_type": "dry"}} for i in range(1, 6)]
+    state = {
+        "user_query": "cream",
+        "user_context": {"skin_type": "dry"},
+        "speculative_products": [{"id": 9, "name": "Oily", "metadata": {"skin_type": "oily"}}] + dry,
+    }
+    with patch("app.guardian_agent.rag.hybrid_search") as search:
+        selected = node_select_products(state, db=None)
+    assert [p["name"] for p in selected["candidate_products"]] == [p["name"] for p in dry]
+    search.assert_not_called()
+
+    # Fewer matches than the limit: the filtered search runs, speculative matches fill up after it
+    state["speculative_products"] = [{"id": 2, "name": "Dry 2", "metadata": {"skin_type": "dry"}},
+                                     {"id": 8, "name": "Typed", "metadata": {"skin_type": ["dry"]}}]
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[product_row(7, "dry")]) as search:
+        selected = node_select_products(state, db=None)
+    assert [p["id"] for p in selected["candidate_products"]] == [7, 2]
+    assert search.call_args.kwargs["filters"] == {"skin_type": "dry"}
+
+
+def test_metadata_predicate_matches_sql_filter():
+    assert rag.metadata_matches({"skin_type": "dry"}, {"skin_type": "dry"})
+    assert not rag.metadata_matches({"skin_type": "Dry"}, {"skin_type": "dry"})
+    assert not rag.metadata_matches({"skin_type": None}, {"skin_type": "None"})
+    assert not rag.metadata_matches({"skin_type": ["dry", "oily"]}, {"skin_type": "dry"})
+    assert not rag.metadata_matches({}, {"skin_type": "dry"})
+
+
+def test_store_results_discarded_when_blocked(db_session):
+    critical = {"safety_payload": {"risk_level": "CRITICAL", "conflicts": [], "blocked": True}}
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[product_row(1, "dry")]), \
+            patch("app.guardian_agent.node_safety_gate", return_value=critical), \
+            patch("app.guardian_agent.node_store_locator",
+                  return_value={"store_results": [{"name": "Store"}]}) as stores:
+        state = GuardianAgent(llm=NamedLLM("a"), db_session=db_session).run(
+            "where can I buy a cream", user_id=-1, user_location="Paris")
+
+    stores.assert_called_once()  # ran alongside the safety gate
+    assert state["store_results"] == []
+    assert "SAFETY ALERT" in state["final_response"]
+
+
+class StreamingLLM:
+    model_name = "guardian-stream"
+
+    def __init__(self, words, delay=0.0, on_word=None):
+        self.words = words
+        self.delay = delay
+        self.on_word = on_word
+        self.closed = False
+
+    def stream(self, messages):
+        try:
+            for i, word in enumerate(self.words):
+                time.sleep(self.delay)
+                if self.on_word:
+                    self.on_word(i)
+                yield AIMessageChunk(content=word)
+        finally:
+            self.closed = True
+
+
+def test_synthesis_streams_tokens_after_products(db_session):
+    llm = StreamingLLM(["Use ", "this ", "cream."], delay=0.1)
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[product_row(1, "dry")]):
+        agent = GuardianAgent(llm=llm, db_session=db_session)
+        start = time.perf_counter()
+        arrivals = []
+        for line in agent.run_stream("moisturizer", user_id=-1):
+            arrivals.append((time.perf_counter() - start, json.loads(line)))
+
+    types = [event["type"] for _, event in arrivals]
+    assert types == ["products", "text", "text", "text"]
+    assert "".join(e["content"] for _, e in arrivals if e["type"] == "text") == "Use this cream."
+    # First token is forwarded while the LLM is still generating
+    assert arrivals[1][0] < arrivals[-1][0] - 0.15
+
+
+def test_cancel_stops_synthesis_stream(db_session):
+    token = CancellationToken()
+    llm = StreamingLLM([f"w{i} " for i in range(50)], on_word=lambda i: i == 2 and token.cancel())
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[]):
+        events = list(GuardianAgent(llm=llm, db_session=db_session).run_stream(
+            "moisturizer", user_id=-1, cancel_token=token))
+
+    assert len([e for e in events if json.loads(e)["type"] == "text"]) <= 3
+    deadline = time.time() + 2
+    while not llm.closed and time.time() < deadline:
+        time.sleep(0.01)
+    assert llm.closed
+
+
+def test_slow_nodes_degrade_within_budget(db_session):
+    release = threading.Event()
+    finished = []
+
+    def hang(name):
+        release.wait(5)
+        finished.append(name)
+
+    def search(db, query, limit=5, filters=None, keyword_only=False):
+        if not keyword_only:
+            hang("retrieve_products")  # Embedding call hangs
+        return [product_row(1, "dry")]
+
+    def slow_profile(state, db):
+        hang("get_profile")
+        return {"user_context": {"skin_type": "oily"}}
+
+    budgets = {"get_profile": 0.05, "get_shelf": 1.0, "retrieve_products": 0.05, "store_locator": 0.05}
+    context_cache.set(("get_profile", 42), {"user_context": {"skin_type": "dry", "allergies": []}})
+    with patch("app.guardian_agent.rag.hybrid_search", side_effect=search), \
+            patch("app.guardian_agent.node_get_profile", side_effect=slow_profile), \
+            patch("app.guardian_agent.node_get_shelf", return_value={"user_context": {"current_routine": []}}):
+        agent = GuardianAgent(llm=NamedLLM("a"), db_session=db_session, node_budgets=budgets)
+        try:
+            events = [json.loads(e) for e in agent.run_stream("moisturizer", user_id=42, include_metrics=True)]
+            # The turn completed while the slow calls were still hanging
+            assert finished == []
+        finally:
+            release.set()
+
+    degraded = [d for e in events if e["type"] == "degraded" for d in e["content"]]
+    assert sorted((d["node"], d["degradation"]) for d in degraded) == [
+        ("get_profile", "cached_context"), ("retrieve_products", "keyword_only")]
+    # The cached profile still drives product selection
+    assert next(e for e in events if e["type"] == "products")["content"][0]["id"] == 1
+    assert events[-1]["content"]["degradations"] == degraded
+
+
+def test_unavailable_shelf_is_not_reported_safe(db_session):
+    def slow_shelf(state, db):
+        time.sleep(0.5)
+        return {"user_context": {"current_routine": []}}
+
+    def stores(state):
+        return {"store_results": [{"name": "Store"}]}
+
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[product_row(1, "dry")]), \
+            patch("app.guardian_agent.node_get_shelf", side_effect=slow_shelf), \
+            patch("app.guardian_agent.node_store_locator", side_effect=stores):
+        agent = GuardianAgent(llm=NamedLLM("a"), db_session=db_session, node_budgets={"get_shelf": 0.05})
+        events = [json.loads(e) for e in agent.run_stream(
+            "where can I buy a cream", user_id=43, user_location="Paris", include_metrics=True)]
+
+        state = agent.run("where can I buy a cream", user_id=43, user_location="Paris")
+
+    alert = next(e for e in events if e["type"] == "safety_alert")
+    assert alert["risk_level"] == "UNKNOWN" and alert["unverified"]
+    degraded = [d for e in events if e["type"] == "degraded" for d in e["content"]]
+    assert {"node": "get_shelf", "degradation": "context_unavailable"} in degraded
+    assert {"node": "safety_gate", "degradation": "unverified"} in degraded
+    text = "".join(e["content"] for e in events if e["type"] == "text")
+    assert text.startswith(UNVERIFIED_NOTICE)
+    assert state["safety_payload"]["risk_level"] == "UNKNOWN"
+    assert state["store_results"] == []  # Not checked against the shelf, so not recommended
+
+
+def test_saturated_node_pool_degrades_immediately():
+    config = {"configurable": {"node_budgets": {"busy_node": 0.05}}}
+    release = threading.Event()
+    workers = guardian_agent.BUDGET_WORKERS_PER_NODE
+    for _ in range(workers):  # Every slot held by an abandoned task
+        try:
+            _run_within_budget(config, "busy_node", release.wait)
+        except BudgetExceeded:
+            pass
+
+    start = time.perf_counter()
+    try:
+        _run_within_budget(config, "busy_node", lambda: "never queued")
+        assert False, "expected BudgetExceeded"
+    except BudgetExceeded:
+        pass
+    assert time.perf_counter() - start < 0.04
+    # Other nodes have their own workers
+    assert _run_within_budget({"configurable": {"node_budgets": {"other_node": 0.5}}},
+                              "other_node", lambda: "ok") == "ok"
+
+    release.set()
+    deadline = time.time() + 2
+    while time.time() < deadline:
+        try:
+            assert _run_within_budget(config, "busy_node", lambda: "ok") == "ok"
+            break
+        except BudgetExceeded:
+            time.sleep(0.01)
+    else:
+        assert False, "slots were not released"
+
+
+def test_deadline_caps_node_budgets(db_session):
+    def slow_stores(state):
+        time.sleep(0.5)
+        return {"store_results": [{"name": "Store"}]}
+
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[product_row(1, "dry")]), \
+            patch("app.guardian_agent.node_store_locator", side_effect=slow_stores):
+        state = GuardianAgent(llm=NamedLLM("a"), db_session=db_session, deadline_seconds=0.1).run(
+            "where can I buy a cream", user_id=-1, user_location="Paris")
+
+    assert state["store_results"] == []
+    assert {"node": "store_locator", "degradation": "skipped"} in state["degradations"]
+    assert state["final_response"] == "answer from a"  # Synthesis is never skipped
+
+
+def test_safety_gate_uses_stored_rule_masks(db_session):
+    retinol = SimpleNamespace(id=3, name="Night Serum", brand="B", description="", ingredients_text="Retinol",
+                              metadata_info={}, rule_mask=None, rule_mask_version=None)
+    shelf = {"user_context": {"shelf_ingredients": ["GLYCOLIC ACID"], "shelf_products": []}}
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[retinol]), \
+            patch("app.guardian_agent.node_get_shelf", return_value=shelf):
+        # Without a stored mask the gate computes one in memory and leaves the row alone
+        first = GuardianAgent(llm=NamedLLM("a"), db_session=db_session).run("serum", user_id=-1)
+        assert retinol.rule_mask is None
+
+        refresh_rule_mask(retinol)  # As the offline jobs do
+        stored = retinol.rule_mask
+        shelf["user_context"].update(zip(("shelf_rule_mask", "shelf_rule_mask_version"),
+                                         ingredients_mask(["GLYCOLIC ACID"])))
+        # Stored masks are used as is: ingredients are not matched again
+        with patch("app.services.conflict_rules.AliasIndex.match", side_effect=AssertionError):
+            second = GuardianAgent(llm=NamedLLM("a"), db_session=db_session).run("serum", user_id=-1)
+
+    assert stored is not None and retinol.rule_mask == stored
+    assert first["safety_payload"]["blocked"] and second["safety_payload"]["blocked"]
+
+
+def test_safety_gate_matches_label_qualifiers(db_session):
+    acid = SimpleNamespace(id=4, name="Peel", brand="B", description="", ingredients_text="Aqua, Mandelic Acid (AHA)",
+                           metadata_info={}, rule_mask=None, rule_mask_version=None)
+    shelf = {"user_context": {"shelf_ingredients": ["Niacinamide"], "shelf_products": []}}
+    with patch("app.guardian_agent.rag.hybrid_search", return_value=[acid]), \
+            patch("app.guardian_agent.node_get_shelf", return_value=shelf):
+        state = GuardianAgent(llm=NamedLLM("a"), db_session=db_session).run("peel", user_id=-1)
+
+    assert state["candidate_products"][0]["ingredients"] == ["Aqua", "Mandelic Acid (AHA)"]
+    assert state["safety_payload"]["conflicts"]
@@ -0,0 +1,207 @@
+# Tests for Idempotency-Key handling on /chat/ and /vision/scan
+import threading
+import uuid
+from unittest.mock import patch
+
+import pytest
+
+from app.services.cancellation import CancellationToken
+from app.services.idempotency import (
+    IdempotencyStore,
+    IdempotencyConflict,
+    RecordedStream,
+    request_fingerprint,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestIdempotencyStore:
+
+    def test_same_key_returns_same_value(self):
+        store = IdempotencyStore()
+        first, created = store.get_or_create(("chat", 1, "k"), "fp", object)
+        second, created_again = store.get_or_create(("chat", 1, "k"), "fp", object)
+        assert created and not created_again
+        assert first is second
+
+    def test_keys_are_scoped_per_user(self):
+        store = IdempotencyStore()
+        a, _ = store.get_or_create(("chat", 1, "k"), "fp", object)
+        b, created = store.get_or_create(("chat", 2, "k"), "fp", object)
+        assert created and a is not b
+
+    def test_reuse_with_different_body_conflicts(self):
+        store = IdempotencyStore()
+        store.get_or_create(("chat", 1, "k"), request_fingerprint({"message": "a"}), object)
+        with pytest.raises(IdempotencyConflict):
+            store.get_or_create(("chat", 1, "k"), request_fingerprint({"message": "b"}), object)
+
+    def test_entries_expire(self):
+        clock = FakeClock()
+        store = IdempotencyStore(ttl_seconds=10, clock=clock)
+        first, _ = store.get_or_create(("scan", 1, "k"), "fp", object)
+        clock.now = 11
+        second, created = store.get_or_create(("scan", 1, "k"), "fp", object)
+        assert created and first is not second
+
+
+class TestRecordedStream:
+
+    def test_late_follower_gets_whole_stream(self):
+        turn = RecordedStream()
+        release = threading.Event()
+
+        def chunks():
+            yield "a\n"
+            release.wait(2)
+            yield "b\n"
+
+        turn.start(chunks())
+        first = turn.follow()
+        assert next(first) == "a\n"
+        second = turn.follow()  # retry attaches mid-stream
+        assert next(second) == "a\n"
+        release.set()
+        assert list(first) == ["b\n"]
+        assert list(second) == ["b\n"]
+        assert turn.completed
+        assert list(turn.follow()) == ["a\n", "b\n"]  # replay after completion
+
+    def test_cancelled_only_when_last_follower_leaves(self):
+        turn = RecordedStream()
+        release = threading.Event()
+        abandoned = threading.Event()
+
+        def chunks():
+            yield "a\n"
+            release.wait(2)
+            yield "b\n"
+
+        turn.start(chunks(), on_abandon=abandoned.set)
+        original, retry = turn.follow(), turn.follow()
+        next(original), next(retry)
+
+        original.close()  # first connection dropped
+        assert not turn.token.cancelled
+        retry.close()
+        assert turn.token.cancelled
+
+        release.set()
+        assert abandoned.wait(2)
+        assert not turn.completed
+
+    def test_follower_stops_when_its_client_leaves(self):
+        turn = RecordedStream()
+        stop = CancellationToken()
+        follower = turn.follow(stop, poll_seconds=0.01)
+        stop.cancel()
+        assert list(follower) == []
+
+
+@pytest.fixture
+def idem_user(db_session):
+    from main import app
+    from app import models
+    from app.dependencies import get_current_user
+
+    social_id = f"idem_{uuid.uuid4().hex[:8]}"  # Unique per run: rows outlive the test
+    user = models.User(email=f"{social_id}@test.com", social_provider="test", social_id=social_id)
+    db_session.add(user)
+    db_session.commit()
+    app.dependency_overrides[get_current_user] = lambda: user
+    yield user
+    app.dependency_overrides.pop(get_current_user, None)
+    db_session.query(models.UserProduct).filter(models.UserProduct.user_id == user.id).delete()
+    db_session.delete(user)
+    db_session.commit()
+
+
+def test_chat_retry_replays_without_second_run(client, idem_user):
+    from app.agent import SkincareAgent
+
+    runs = []
+    original = SkincareAgent.run_stream
+
+    def counting_run_stream(self, *args, **kwargs):
+        runs.append(args[0])
+        yield from original(self, *args, **kwargs)
+
+    headers = {"X-Goog-Api-Key": "mock_idem", "Idempotency-Key": "retry-1"}
+    with patch.object(SkincareAgent, "run_stream", counting_run_stream), \
+            patch.dict("os.environ", {"OPENAI_API_KEY": ""}):
+        first = client.post("/chat/", json={"message": "hello there"}, headers=headers)
+        second = client.post("/chat/", json={"message": "hello there"}, headers=headers)
+        conflict = client.post("/chat/", json={"message": "something else"}, headers=headers)
+
+    assert first.status_code == 200 and second.status_code == 200
+    assert second.text == first.text
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert runs == ["hello there"]
+    assert conflict.status_code == 422
+
+
+def closing_session(closed):
+    from app.database import engine
+    from sqlalchemy.orm import Session
+
+    session = Session(bind=engine)
+    close = session.close
+    session.close = lambda: (close(), closed.set())
+    return session
+
+
+def test_recorded_turn_owns_its_session(client, idem_user, db_session):
+    from main import app
+    from app import database
+    from app.agent import SkincareAgent
+
+    sessions = []
+    original = SkincareAgent.run_stream
+
+    def recording_run_stream(self, *args, **kwargs):
+        sessions.append(self.db)
+        yield from original(self, *args, **kwargs)
+
+    def request_db():
+        yield db_session
+
+    closed = threading.Event()
+    app.dependency_overrides[database.get_db] = request_db
+    headers = {"X-Goog-Api-Key": "mock_idem", "Idempotency-Key": f"session-{uuid.uuid4().hex[:8]}"}
+    try:
+        with patch.object(SkincareAgent, "run_stream", recording_run_stream), \
+                patch.dict("os.environ", {"OPENAI_API_KEY": ""}), \
+                patch("app.database.SessionLocal", side_effect=lambda: closing_session(closed)):
+            response = client.post("/chat/", json={"message": "hello there"}, headers=headers)
+    finally:
+        app.dependency_overrides.pop(database.get_db, None)
+
+    assert response.status_code == 200
+    # The turn ran on its own session, not the request's, and closed it when it ended
+    assert len(sessions) == 1 and sessions[0] is not db_session
+    assert closed.wait(timeout=2)
+
+
+def test_scan_retry_returns_same_job(client, idem_user, db_session):
+    from app import models
+
+    headers = {"Idempotency-Key": "scan-1"}
+    files = {"file": ("label.jpg", b"fake-image-bytes", "image/jpeg")}
+    with patch("app.routers.vision.process_scan_job") as process:
+        first = client.post("/vision/scan", files=files, headers=headers)
+        second = client.post("/vision/scan", files=files, headers=headers)
+
+    assert first.status_code == 200 and second.status_code == 200
+    assert second.json()["job_id"] == first.json()["job_id"]
+    assert second.json()["user_product_id"] == first.json()["user_product_id"]
+    assert process.call_count == 1
+    placeholders = db_session.query(models.UserProduct).filter(
+        models.UserProduct.user_id == idem_user.id).count()
+    assert placeholders == 1
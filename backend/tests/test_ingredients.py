@@ -0,0 +1,73 @@
+# Tests for the central ingredient canonicalizer
+import pytest
+
+from app.services.ingredients import (
+    canonical_ingredient, canonical_ingredients, ingredient_match_names, parse_ingredient_list, parse_label_list,
+)
+from app.services.conflict_rules import check_routine_conflicts
+from app.tools.ingredient_checker import ingredient_checker
+
+
+@pytest.mark.parametrize("raw,canonical", [
+    ("Aqua/Water/Eau", "WATER"),
+    ("AQUA (WATER)", "WATER"),
+    ("Niacinamide 10%", "NIACINAMIDE"),
+    ("  niacinamide  ", "NIACINAMIDE"),
+    ("Tocopherol (Vitamin E)", "TOCOPHEROL"),
+    ("Vitamin E", "TOCOPHEROL"),
+    ("*Organic Aloe Barbadensis Leaf Juice", "ORGANIC ALOE BARBADENSIS LEAF JUICE"),
+    ("Salicylic Acid 2.5 %.", "SALICYLIC ACID"),
+    ("Parfum (Fragrance)", "FRAGRANCE"),
+    # "/" inside a name is not a list of alternatives
+    ("Caprylic/Capric Triglyceride", "CAPRYLIC/CAPRIC TRIGLYCERIDE"),
+    ("Acrylates/C10-30 Alkyl Acrylate Crosspolymer", "ACRYLATES/C10-30 ALKYL ACRYLATE CROSSPOLYMER"),
+    ("Mandelic Acid (AHA)", "MANDELIC ACID"),
+    ("", ""),
+    ("10%", ""),
+])
+def test_canonical_ingredient(raw, canonical):
+    assert canonical_ingredient(raw) == canonical
+
+
+def test_parse_ingredient_list():
+    text = "Ingredients: Aqua (Water), Glycerin, Niacinamide 5%, Sodium Hyaluronate, Water, Parfum/Fragrance."
+    assert parse_ingredient_list(text) == ["WATER", "GLYCERIN", "NIACINAMIDE", "SODIUM HYALURONATE", "FRAGRANCE"]
+    # Commas inside parentheses do not split
+    assert parse_ingredient_list("Aqua (Water, Eau), Glycerin") == ["WATER", "GLYCERIN"]
+    assert parse_ingredient_list(None) == []
+
+
+def test_canonical_forms_are_memoized():
+    canonical_ingredient.cache_clear()
+    canonical_ingredients(["Aqua (Water)", "Glycerin"] * 50)
+    info = canonical_ingredient.cache_info()
+    assert (info.misses, info.hits) == (2, 98)
+
+
+def test_consumers_share_canonical_forms():
+    # Label spellings match the rule engine's names
+    conflicts = check_routine_conflicts(["Retinol 1%"], ["Glycolic Acid (AHA) 7%"])
+    assert conflicts and conflicts[0]["risk_level"] == "CRITICAL"
+    assert ingredient_checker.invoke({"ingredients": "Aqua, Tocopherol", "allergy": "Vitamin E"}) \
+        == "WARNING: Contains Vitamin E!"
+    assert ingredient_checker.invoke({"ingredients": "Aqua, Glycerin", "allergy": "peanut"}) == "Safe."
+
+
+def test_match_names_keep_qualifiers():
+    assert ingredient_match_names("Mandelic Acid (AHA) 5%") == ("MANDELIC ACID (AHA) 5%", "MANDELIC ACID", "AHA")
+    assert parse_label_list("Ingredients: Aqua, Mandelic Acid (AHA), Water") == ["Aqua", "Mandelic Acid (AHA)"]
+
+
+@pytest.mark.parametrize("acid", ["Mandelic Acid (AHA)", "Lactobionic Acid (AHA)"])
+@pytest.mark.parametrize("other", [
+    "Salicylic Acid", "Palmitoyl Tripeptide-1 (Peptides)", "Jojoba Beads (Physical Scrub)", "Niacinamide",
+])
+def test_aha_qualifier_still_raises_conflicts(acid, other):
+    # The canonical name alone ("MANDELIC ACID") matches no AHA rule side
+    assert check_routine_conflicts(parse_label_list(acid), [other])
+    assert check_routine_conflicts([other], parse_label_list(acid))
+
+
+@pytest.mark.parametrize("other", ["Glycolic Acid", "Retinol"])
+def test_bha_qualifier_still_raises_conflicts(other):
+    assert check_routine_conflicts(parse_label_list("Betaine Salicylate (BHA)"), [other])
@@ -0,0 +1,120 @@
+# Tests for the local intent router in front of the tool-decision LLM call
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.agent import SkincareAgent
+from app.services.intent_router import (
+    route_intent,
+    evaluate_router,
+    ANSWER,
+    CALL_TOOL,
+    LLM_DECIDES,
+)
+
+
+LABELLED_PATH = os.path.join(os.path.dirname(__file__), "intent_golden_set.json")
+
+
+@pytest.mark.parametrize("message,intent,action", [
+    ("hi", "chat", ANSWER),
+    ("Thanks so much!", "chat", ANSWER),
+    ("Can I use bleach to whiten my skin?", "chat", ANSWER),
+    ("I need a cleanser for oily skin.", "product_retriever", CALL_TOOL),
+    ("I need something for oily skin.", "product_retriever", LLM_DECIDES),
+    ("Where can I buy CeraVe?", "store_locator", CALL_TOOL),
+    ("Is CeraVe safe if I am allergic to glycerin?", "ingredient_checker", LLM_DECIDES),
+    ("Tell me about my week", None, LLM_DECIDES),
+])
+def test_rules(message, intent, action):
+    decision = route_intent(message)
+    assert (decision.intent, decision.action) == (intent, action)
+
+
+def test_retrieval_args_are_deterministic():
+    decision = route_intent("I have very dry skin, what moisturisers do you recommend?")
+    assert decision.tool_name == "product_retriever"
+    assert decision.tool_args == {"query": "moisturizer", "skin_type": "dry"}
+
+
+def test_retrieval_without_a_product_type_goes_to_the_llm():
+    # The whole sentence is no keyword query; the LLM writes one
+    decision = route_intent("I have very dry skin, what do you recommend?")
+    assert (decision.intent, decision.action) == ("product_retriever", LLM_DECIDES)
+
+
+def test_follow_ups_only_answer_directly_with_history():
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "Hello!"}]
+    assert route_intent("Why?", history).action == ANSWER
+    assert route_intent("Why?").action == LLM_DECIDES
+    # Mentions products: might need a fresh search
+    assert route_intent("Why that sunscreen?", history).action == LLM_DECIDES
+
+
+def test_images_always_go_to_the_llm():
+    assert route_intent("hi", image_base64="abc").action == LLM_DECIDES
+
+
+def test_labelled_set_accuracy():
+    with open(LABELLED_PATH) as f:
+        report = evaluate_router(json.load(f))
+    # A wrong skip answers without the LLM on the wrong intent; misses only cost the decision call
+    assert report["wrong_skips"] == 0, report["mismatches"]
+    assert report["accuracy"] >= 0.8, report["mismatches"]
+    assert report["llm_decisions_skipped"] >= 0.5
+
+
+class RecordingLLM:
+    """Records which calls the agent makes."""
+
+    model_name = "router-stub"
+
+    def __init__(self):
+        self.calls = []
+
+    def bind_tools(self, tools):
+        self.calls.append("bind_tools")
+        return self
+
+    def invoke(self, messages):
+        self.calls.append("invoke")
+        return AIMessage(content="decided")
+
+    def stream(self, messages):
+        self.calls.append("stream")
+        yield AIMessageChunk(content="streamed")
+
+
+@pytest.fixture
+def router_enabled(monkeypatch):
+    monkeypatch.setenv("INTENT_ROUTER_ENABLED", "1")
+
+
+def test_agent_streams_small_talk_without_tools(router_enabled):
+    llm = RecordingLLM()
+    events = [json.loads(e) for e in SkincareAgent(llm=llm, db_session=None).run_stream("hello!", [])]
+
+    assert llm.calls == ["stream"]
+    assert events == [{"type": "text", "content": "streamed"}]
+
+
+def test_agent_calls_retriever_up_front(router_enabled):
+    llm = RecordingLLM()
+    with patch("app.agent.rag.hybrid_search", return_value=[]) as search:
+        agent = SkincareAgent(llm=llm, db_session=None)
+        list(agent.run_stream("Recommend a moisturizer for oily skin", [], include_metrics=True))
+
+    assert "invoke" not in llm.calls
+    assert search.call_args.kwargs["filters"] == {"skin_type": "oily"}
+    assert search.call_args.args[1] == "moisturizer"
+    assert agent.turn_metrics.route["action"] == CALL_TOOL
+
+
+def test_router_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("INTENT_ROUTER_ENABLED", raising=False)
+    llm = RecordingLLM()
+    list(SkincareAgent(llm=llm, db_session=None).run_stream("hello!", []))
+    assert "invoke" in llm.calls
@@ -0,0 +1,183 @@
+# Tests for the per-provider LLM concurrency limiter
+import gc
+import threading
+import time
+import uuid
+from unittest.mock import patch
+
+import pytest
+
+from app.services.llm_limiter import (
+    ProviderLimiter,
+    LimiterOverloaded,
+    LIMITER_QUEUE_DEPTH,
+    LimitedChatModel,
+    get_limiter,
+)
+
+
+class TestProviderLimiter:
+
+    def test_grants_up_to_concurrency(self):
+        limiter = ProviderLimiter("t", rate_per_second=100, burst=100, max_concurrency=2, max_queue=0)
+        limiter.acquire()
+        limiter.acquire()
+        assert limiter.in_flight == 2
+
+        with pytest.raises(LimiterOverloaded) as exc:
+            limiter.acquire()
+        assert exc.value.reason == "queue_full"
+        assert exc.value.retry_after >= 1
+
+    def test_token_bucket_limits_rate(self):
+        limiter = ProviderLimiter("t", rate_per_second=1, burst=1, max_concurrency=10,
+                                  max_queue=5, max_wait_seconds=0.05)
+        limiter.acquire().release()
+
+        # Bucket is empty and refills at 1/s: the waiter times out
+        with pytest.raises(LimiterOverloaded) as exc:
+            limiter.acquire()
+        assert exc.value.reason == "queue_timeout"
+        assert limiter.waiting == 0
+
+    def test_release_wakes_waiter(self):
+        limiter = ProviderLimiter("t", rate_per_second=100, burst=100, max_concurrency=1,
+                                  max_queue=1, max_wait_seconds=2)
+        first = limiter.acquire()
+        granted = []
+
+        def waiter():
+            granted.append(limiter.acquire())
+
+        thread = threading.Thread(target=waiter)
+        thread.start()
+        while limiter.waiting == 0:
+            time.sleep(0.001)
+        assert LIMITER_QUEUE_DEPTH.value(provider="t") >= 1
+
+        first.release()
+        thread.join(timeout=2)
+        assert len(granted) == 1
+        assert limiter.in_flight == 1
+
+    def test_lease_release_is_idempotent(self):
+        limiter = ProviderLimiter("t", max_concurrency=1)
+        lease = limiter.acquire()
+        lease.release()
+        lease.release()
+        assert limiter.in_flight == 0
+
+    def test_wrapped_stream_releases_on_close(self):
+        limiter = ProviderLimiter("t", max_concurrency=1)
+        stream = limiter.acquire().wrap(iter(["a\n", "b\n"]))
+        assert next(stream) == "a\n"
+        stream.close()  # client disconnected
+        assert limiter.in_flight == 0
+
+    def test_unstarted_stream_releases_on_gc(self):
+        limiter = ProviderLimiter("t", max_concurrency=1)
+        stream = limiter.acquire().wrap(iter(["a\n"]))
+        del stream
+        gc.collect()
+        assert limiter.in_flight == 0
+
+    def test_try_acquire_never_waits(self):
+        limiter = ProviderLimiter("t", rate_per_second=100, burst=100, max_concurrency=1,
+                                  max_queue=5, max_wait_seconds=5)
+        limiter.try_acquire()
+        start = time.perf_counter()
+        with pytest.raises(LimiterOverloaded) as exc:
+            limiter.try_acquire()
+        assert exc.value.reason == "busy"
+        assert time.perf_counter() - start < 0.1
+        assert limiter.waiting == 0
+
+    def test_admit_waits_for_a_slot_that_frees_up(self):
+        limiter = ProviderLimiter("t", rate_per_second=100, burst=100, max_concurrency=1,
+                                  max_queue=5, max_wait_seconds=5, admission_wait_seconds=2)
+        held = limiter.acquire()
+        threading.Timer(0.05, held.release).start()
+        limiter.admit().release()  # Busy, but the queue is empty: the turn is admitted
+        assert limiter.in_flight == 0
+
+    def test_admit_rejects_only_a_full_queue_or_a_long_wait(self):
+        limiter = ProviderLimiter("t", rate_per_second=100, burst=100, max_concurrency=1,
+                                  max_queue=0, max_wait_seconds=5)
+        limiter.acquire()
+        with pytest.raises(LimiterOverloaded) as exc:
+            limiter.admit()
+        assert exc.value.reason == "queue_full"
+
+        limiter.max_queue = 1
+        limiter.admission_wait_seconds = 0.05
+        with pytest.raises(LimiterOverloaded) as exc:
+            limiter.admit()
+        assert exc.value.reason == "queue_timeout"
+        assert limiter.waiting == 0
+
+
+class RecordingChatModel:
+    model_name = "recording"
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.in_flight_during_calls = []
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        self.in_flight_during_calls.append(self.limiter.in_flight)
+        return "decided"
+
+    def stream(self, messages):
+        self.in_flight_during_calls.append(self.limiter.in_flight)
+        yield "a"
+        yield "b"
+
+
+def test_limited_model_holds_a_slot_per_call_only():
+    limiter = ProviderLimiter("t", rate_per_second=100, burst=100, max_concurrency=1, max_queue=0)
+    inner = RecordingChatModel(limiter)
+    llm = LimitedChatModel(inner, limiter, limiter.admit())
+
+    assert llm.model_name == "recording"
+    assert llm.bind_tools([]).invoke([]) == "decided"  # Uses the admission slot
+    assert limiter.in_flight == 0  # Free between calls (e.g. while tools run)
+
+    stream = llm.stream([])
+    assert next(stream) == "a"
+    assert limiter.in_flight == 1
+    assert list(stream) == ["b"]
+    assert limiter.in_flight == 0
+    assert inner.in_flight_during_calls == [1, 1]
+
+
+def test_limiters_are_per_key():
+    assert get_limiter("google", "key-a") is get_limiter("google", "key-a")
+    assert get_limiter("google", "key-a") is not get_limiter("google", "key-b")
+    assert get_limiter("google", "key-a") is not get_limiter("openai", "key-a")
+
+
+def test_chat_returns_503_when_overloaded(client, db_session):
+    from main import app
+    from app import models
+    from app.dependencies import get_current_user
+
+    social_id = f"limiter_{uuid.uuid4().hex[:8]}"  # Unique per run: rows outlive the test
+    user = models.User(email=f"{social_id}@test.com", social_provider="test", social_id=social_id)
+    db_session.add(user)
+    db_session.commit()
+
+    full = ProviderLimiter("mock", max_concurrency=0, max_queue=0, rate_per_second=2)
+    app.dependency_overrides[get_current_user] = lambda: user
+    try:
+        with patch("app.routers.chat.get_limiter", return_value=full), \
+                patch.dict("os.environ", {"OPENAI_API_KEY": ""}):
+            response = client.post("/chat/", json={"message": "hello"},
+                                   headers={"X-Goog-Api-Key": "mock_limiter"})
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
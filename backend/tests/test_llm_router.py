@@ -0,0 +1,205 @@
+# Tests for hedged LLM requests, using local OpenAI-compatible stub servers
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+
+from app.services.llm_limiter import ProviderLimiter
+from app.services.llm_router import (
+    HedgedChatModel,
+    ProviderRoute,
+    ProviderDeadlineExceeded,
+    LLM_PROVIDER_FIRST_RESPONSE,
+    hedge_budget,
+)
+from app.services.metrics import MetricsRegistry
+
+
+class StubLLMServer:
+    """
+    Minimal /v1/chat/completions server. Waits `delay` seconds before the first
+    byte, then answers `text` (as SSE when stream=true). `fail` answers HTTP 500.
+    """
+
+    def __init__(self, text: str, delay: float = 0.0, fail: bool = False):
+        self.text = text
+        self.delay = delay
+        self.fail = fail
+        self.requests = 0
+        self.disconnects = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                stub.requests += 1
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep(stub.delay)
+                try:
+                    if stub.fail:
+                        self.send_response(500)
+                        self.send_header("Content-Type", "application/json")
+                        self.end_headers()
+                        self.wfile.write(b'{"error": {"message": "boom"}}')
+                    elif body.get("stream"):
+                        self._stream()
+                    else:
+                        self._complete()
+                except (BrokenPipeError, ConnectionResetError):
+                    stub.disconnects += 1
+
+            def _complete(self):
+                payload = {
+                    "id": "cmpl", "object": "chat.completion", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": stub.text}}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                }
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for word in stub.text.split(" "):
+                    chunk = {
+                        "id": "cmpl", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                        "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def llm(self):
+        return ChatOpenAI(model="stub", api_key="test", base_url=self.base_url,
+                          temperature=0, max_retries=0)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+MESSAGES = [HumanMessage(content="What does niacinamide do?")]
+
+
+def routes(*servers):
+    return [ProviderRoute(f"p{i}", s.llm()) for i, s in enumerate(servers)]
+
+
+def test_fast_primary_is_not_hedged():
+    with StubLLMServer("primary answer") as primary, StubLLMServer("secondary answer") as secondary:
+        model = HedgedChatModel(routes(primary, secondary), hedge_after=1.0)
+        result = model.invoke(MESSAGES)
+
+    assert result.content == "primary answer"
+    assert secondary.requests == 0
+    assert model.last_winner == "p0"
+
+
+def test_slow_primary_is_hedged_and_secondary_wins():
+    with StubLLMServer("primary answer", delay=3.0) as primary, \
+            StubLLMServer("secondary answer") as secondary:
+        model = HedgedChatModel(routes(primary, secondary), hedge_after=0.1)
+        start = time.perf_counter()
+        result = model.invoke(MESSAGES)
+        elapsed = time.perf_counter() - start
+
+    assert result.content == "secondary answer"
+    assert elapsed < 2.0
+    assert primary.requests == 1 and secondary.requests == 1
+
+
+def test_streaming_hedge_returns_winner_stream_only():
+    with StubLLMServer("slow words here", delay=3.0) as primary, \
+            StubLLMServer("fast words here") as secondary:
+        model = HedgedChatModel(routes(primary, secondary), hedge_after=0.1)
+        text = "".join(chunk.content for chunk in model.stream(MESSAGES))
+
+    assert text.strip() == "fast words here"
+    assert model.last_winner == "p1"
+
+
+def test_failing_primary_fails_over_immediately():
+    with StubLLMServer("", fail=True) as primary, StubLLMServer("backup") as secondary:
+        model = HedgedChatModel(routes(primary, secondary), hedge_after=5.0)
+        start = time.perf_counter()
+        result = model.invoke(MESSAGES)
+
+    assert result.content == "backup"
+    assert time.perf_counter() - start < 2.0
+
+
+def test_deadline_exceeded():
+    with StubLLMServer("late", delay=2.0) as primary, StubLLMServer("late too", delay=2.0) as secondary:
+        model = HedgedChatModel(routes(primary, secondary), hedge_after=0.05, deadline_seconds=0.3)
+        with pytest.raises(ProviderDeadlineExceeded):
+            model.invoke(MESSAGES)
+
+
+def test_hedge_budget_uses_latency_percentile(monkeypatch):
+    monkeypatch.setenv("LLM_HEDGE_MIN_SAMPLES", "10")
+    monkeypatch.setenv("LLM_HEDGE_DEFAULT_SECONDS", "7")
+    hist = MetricsRegistry().histogram("first_response", "test", ["provider", "call"], buckets=(0.5, 1, 2))
+
+    assert hedge_budget("p", "stream", hist) == 7.0  # not enough samples yet
+    for _ in range(20):
+        hist.observe(0.8, provider="p", call="stream")
+    assert 0.5 <= hedge_budget("p", "stream", hist) <= 1.0
+    assert hedge_budget("p", "invoke", hist) == 7.0  # Per call type
+
+
+def test_winner_first_response_is_observed_per_provider():
+    before = LLM_PROVIDER_FIRST_RESPONSE.count(provider="p0", call="stream")
+    with StubLLMServer("some words") as primary:
+        model = HedgedChatModel(routes(primary), hedge_after=1.0)
+        list(model.stream(MESSAGES))
+    assert LLM_PROVIDER_FIRST_RESPONSE.count(provider="p0", call="stream") == before + 1
+
+
+def test_hedge_leg_takes_a_limiter_slot():
+    secondary_slots = ProviderLimiter("p1", rate_per_second=100, burst=100, max_concurrency=1, max_queue=0)
+    with StubLLMServer("slow words here", delay=3.0) as primary, \
+            StubLLMServer("fast words here") as secondary:
+        legs = routes(primary, secondary)
+        legs[1].limiter = secondary_slots
+        model = HedgedChatModel(legs, hedge_after=0.1)
+        stream = model.stream(MESSAGES)
+        next(stream)
+        assert secondary_slots.in_flight == 1  # Held while the winning stream runs
+        list(stream)
+    assert secondary_slots.in_flight == 0
+
+
+def test_hedge_is_skipped_when_the_secondary_is_saturated():
+    busy = ProviderLimiter("p1", max_concurrency=0, max_queue=0)
+    with StubLLMServer("primary answer", delay=0.3) as primary, \
+            StubLLMServer("secondary answer") as secondary:
+        legs = routes(primary, secondary)
+        legs[1].limiter = busy
+        result = HedgedChatModel(legs, hedge_after=0.05).invoke(MESSAGES)
+
+    assert result.content == "primary answer"
+    assert secondary.requests == 0
@@ -0,0 +1,80 @@
+# Tests for the materialized catalogue product conflict graph
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app import models
+from app.database import Base, add_missing_columns
+from app.services.product_conflicts import product_pair_conflicts, refresh_product_conflicts
+
+
+@pytest.fixture
+def catalogue(db_session):
+    db_session.query(models.ProductConflict).delete()
+    db_session.query(models.Product).filter(models.Product.source == "conflict-test").delete()
+    products = {
+        name: models.Product(name=name, brand="Test", ingredients_text=ingredients, source="conflict-test")
+        for name, ingredients in [
+            ("retinol", "Aqua, Retinol 1%"),
+            ("glycolic", "Water, Glycolic Acid"),
+            ("niacinamide", "Niacinamide 10%, Zinc PCA"),
+            ("vitamin_c", "Aqua, Ascorbic Acid"),
+            ("plain", "Water, Glycerin"),
+        ]
+    }
+    db_session.add_all(products.values())
+    db_session.commit()
+    yield products
+    db_session.query(models.ProductConflict).delete()
+    db_session.query(models.Product).filter(models.Product.source == "conflict-test").delete()
+    db_session.commit()
+
+
+def levels(db, a, b):
+    return sorted(c["risk_level"] for c in product_pair_conflicts(db, a.id, b.id))
+
+
+def test_full_build_materializes_pairs(db_session, catalogue):
+    stats = refresh_product_conflicts(db_session, full=True)
+    assert stats["mode"] == "full" and stats["conflicts"] >= 2
+
+    c = catalogue
+    assert levels(db_session, c["retinol"], c["glycolic"]) == ["CRITICAL"]
+    assert levels(db_session, c["vitamin_c"], c["niacinamide"]) == ["WARNING"]
+    assert levels(db_session, c["plain"], c["retinol"]) == []
+    # Either order, ingredient_a on the asked product's side
+    assert product_pair_conflicts(db_session, c["glycolic"].id, c["retinol"].id)[0]["ingredient_a"] == "GLYCOLIC ACID"
+    assert product_pair_conflicts(db_session, c["retinol"].id, c["glycolic"].id)[0]["ingredient_a"] == "RETINOL"
+
+
+def test_incremental_refresh_only_touches_changed_products(db_session, catalogue):
+    refresh_product_conflicts(db_session, full=True)
+    assert refresh_product_conflicts(db_session)["recomputed"] == 0  # Nothing changed
+
+    c = catalogue
+    c["plain"].ingredients_text = "Water, Benzoyl Peroxide"
+    db_session.commit()
+    stats = refresh_product_conflicts(db_session, product_ids=[c["plain"].id])
+    assert (stats["mode"], stats["recomputed"]) == ("incremental", 1)
+    assert levels(db_session, c["plain"], c["retinol"]) == ["CRITICAL"]
+    assert levels(db_session, c["plain"], c["vitamin_c"]) == ["CRITICAL"]
+    assert levels(db_session, c["retinol"], c["glycolic"]) == ["CRITICAL"]  # Untouched rows kept
+
+
+def test_product_conflicts_endpoint(client, db_session, catalogue):
+    refresh_product_conflicts(db_session, full=True)
+    c = catalogue
+    response = client.get("/safety/product-conflicts",
+                          params={"product_id": c["retinol"].id, "other_product_id": c["glycolic"].id})
+    assert response.status_code == 200
+    assert response.json()["has_critical"] is True
+
+
+def test_existing_products_table_gains_mask_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR, ingredients_text TEXT)"))
+    Base.metadata.create_all(bind=engine)  # Leaves the existing table as is
+
+    assert set(add_missing_columns(engine)) >= {"products.rule_mask", "products.rule_mask_version"}
+    assert {"rule_mask", "rule_mask_version"} <= {c["name"] for c in inspect(engine).get_columns("products")}
+    assert add_missing_columns(engine) == []
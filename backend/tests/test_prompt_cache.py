@@ -0,0 +1,74 @@
+# Tests for the prefix-cache friendly prompt layout
+import json
+import uuid
+
+from langchain_core.messages import AIMessage
+
+from app import models
+from app.agent import SkincareAgent, SYSTEM_PREFIX
+from app.services.prompt_cache import prefix_hash, PROMPT_PREFIX_TURNS
+from app.tools.registry import get_tool_specs
+
+
+class CapturingLLM:
+    """Answers without tools, reporting a provider prompt-cache hit, and keeps the prompt."""
+
+    model_name = "prefix-stub"
+
+    def __init__(self):
+        self.prompts = []
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        self.prompts.append(messages)
+        return AIMessage(content="ok", usage_metadata={
+            "input_tokens": 900, "output_tokens": 10, "total_tokens": 910,
+            "input_token_details": {"cache_read": 512},
+        })
+
+
+def system_text(llm, index=-1):
+    return llm.prompts[index][0].content
+
+
+def test_prefix_is_identical_across_users_and_turns(db_session):
+    social_id = f"prefix_{uuid.uuid4().hex[:8]}"  # Unique per run: rows outlive the test
+    user = models.User(email=f"{social_id}@test.com", social_provider="test", social_id=social_id)
+    db_session.add(user)
+    db_session.commit()
+    db_session.add(models.UserProduct(user_id=user.id, product_name="Magic Cream", status="active"))
+    db_session.commit()
+
+    llm = CapturingLLM()
+    agent = SkincareAgent(llm=llm, db_session=db_session)
+    list(agent.run_stream("Tell me about my week", [], user_id=user.id, user_location="Paris"))
+    list(agent.run_stream("Tell me about my week", [], image_base64="abc"))
+
+    personal, anonymous = system_text(llm, 0), system_text(llm, 1)
+    assert personal.startswith(SYSTEM_PREFIX) and anonymous.startswith(SYSTEM_PREFIX)
+    # Volatile sections come after the stable prefix, per-turn hints last
+    assert personal.index("Magic Cream") > len(SYSTEM_PREFIX)
+    assert personal.rstrip().endswith("<location>Paris</location>")
+    assert "<image_context>" in anonymous[len(SYSTEM_PREFIX):]
+
+
+def test_prefix_hash_tracks_prompt_and_tools():
+    specs = get_tool_specs()
+    assert prefix_hash(SYSTEM_PREFIX, specs) == prefix_hash(SYSTEM_PREFIX, list(specs))
+    assert prefix_hash(SYSTEM_PREFIX, specs) != prefix_hash(SYSTEM_PREFIX)
+    assert prefix_hash(SYSTEM_PREFIX + " ", specs) != prefix_hash(SYSTEM_PREFIX, specs)
+
+
+def test_turn_reports_prefix_and_cached_tokens():
+    expected = prefix_hash(SYSTEM_PREFIX, get_tool_specs())
+    before = PROMPT_PREFIX_TURNS.value(prefix=expected)
+
+    agent = SkincareAgent(llm=CapturingLLM(), db_session=None)
+    events = [json.loads(e) for e in agent.run_stream("Tell me about my week", [], include_metrics=True)]
+
+    metrics = events[-1]["content"]
+    assert metrics["prompt_prefix"] == expected
+    assert metrics["cached_input_tokens"] == 512
+    assert PROMPT_PREFIX_TURNS.value(prefix=expected) == before + 1
@@ -0,0 +1,73 @@
+# Tests for the schedule-aware routine audit
+from types import SimpleNamespace
+
+from app import models
+from app.services.routine_audit import audit_routine
+from app.services.shelf_ingredients import ingredients_from_notes, set_product_ingredients
+
+
+def item(item_id, ingredients, period="pm", frequency_type="daily", frequency_details=None):
+    product = SimpleNamespace(product_name=f"Product {item_id}",
+                              ingredient_rows=[SimpleNamespace(name=ingredients.upper(), label=ingredients)]) if ingredients else None
+    return SimpleNamespace(id=item_id, name=f"Step {item_id}", user_product=product, period=period,
+                           frequency_type=frequency_type, frequency_details=frequency_details)
+
+
+def pairs(audit):
+    return [(c["item_a"]["id"], c["item_b"]["id"], c["risk_level"]) for c in audit["conflicts"]]
+
+
+def test_same_period_conflicts_only():
+    retinol_pm = item(1, "Retinol")
+    aha_am = item(2, "Glycolic Acid", period="am")
+    assert pairs(audit_routine([retinol_pm, aha_am])) == []
+
+    aha_pm = item(3, "Glycolic Acid")
+    audit = audit_routine([retinol_pm, aha_am, aha_pm])
+    assert pairs(audit) == [(1, 3, "CRITICAL")]
+    assert audit["conflicts"][0]["periods"] == ["pm"] and audit["conflicts"][0]["certain"]
+
+
+def test_label_qualifiers_are_audited():
+    # Canonical "MANDELIC ACID" matches no AHA rule; the stored label does
+    assert pairs(audit_routine([item(1, "Mandelic Acid (AHA)"), item(2, "Retinol")]))
+
+
+def test_days_of_week_must_overlap():
+    retinol = item(1, "Retinol", frequency_type="days_of_week", frequency_details=[0, 2, 4])
+    aha_weekend = item(2, "Glycolic Acid", frequency_type="days_of_week", frequency_details=[5, 6])
+    aha_friday = item(3, "Lactic Acid", frequency_type="days_of_week", frequency_details=[4])
+    audit = audit_routine([retinol, aha_weekend, aha_friday])
+    assert pairs(audit) == [(1, 3, "CRITICAL")]
+    assert audit["conflicts"][0]["days"] == ["fri"]
+
+
+def test_interval_overlaps_are_possible_and_unknown_items_listed():
+    retinol = item(1, "Retinol", frequency_type="interval", frequency_details={"every_n_days": 3})
+    aha = item(2, "Glycolic Acid")
+    cleanser = item(3, None)
+    audit = audit_routine([retinol, aha, cleanser])
+    assert pairs(audit) == [(1, 2, "CRITICAL")]
+    assert audit["conflicts"][0]["certain"] is False
+    assert audit["unchecked_items"] == [3] and audit["checked_items"] == 2
+
+
+def test_audit_endpoint(client, db_session):
+    login = client.post("/auth/google", json={"id_token": "mock_routine_audit", "tos_agreed": True}).json()
+    headers = {"Authorization": f"Bearer {login['access_token']}"}
+    user_id = db_session.query(models.User).filter(models.User.email == "mock_user_routine_audit@example.com").one().id
+
+    db_session.query(models.RoutineItem).filter(models.RoutineItem.user_id == user_id).delete()
+    for name, notes, period in [("Retinol Serum", "Ingredients: Retinol", "pm"),
+                                ("AHA Toner", "Ingredients: Glycolic Acid", "am"),
+                                ("BP Wash", "Ingredients: Benzoyl Peroxide", "pm")]:
+        product = models.UserProduct(user_id=user_id, product_name=name, status="active", notes=notes)
+        set_product_ingredients(product, ingredients_from_notes(notes))
+        db_session.add(product)
+        db_session.flush()
+        db_session.add(models.RoutineItem(user_id=user_id, user_product_id=product.id, name=name, period=period))
+    db_session.commit()
+
+    data = client.get("/safety/audit-routine", headers=headers).json()
+    assert data["checked_items"] == 3 and data["has_critical"] is True
+    assert [(c["item_a"]["name"], c["item_b"]["name"]) for c in data["conflicts"]] == [("Retinol Serum", "BP Wash")]
@@ -0,0 +1,94 @@
+# Tests for the incrementally maintained routine ingredient profile
+import uuid
+
+from app import models, schemas
+from app.routers.user_products import add_product
+from app.services.routine_profile import get_routine_profile, rebuild_routine_profile
+
+
+def login(client, name):
+    token = client.post("/auth/google", json={"id_token": f"mock_{name}_{uuid.uuid4().hex[:8]}", "tos_agreed": True}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def add(client, headers, name, ingredients):
+    return client.post("/products/", headers=headers, json={
+        "product_name": name, "notes": f"Ingredients: {ingredients}"}).json()
+
+
+def profile_counts(db_session, user_id):
+    db_session.expire_all()
+    return db_session.query(models.RoutineProfile).filter(models.RoutineProfile.user_id == user_id).one().ingredient_counts
+
+
+def test_profile_follows_routine_changes(client, db_session):
+    headers = login(client, "routine_profile")
+    serum = add(client, headers, "Retinol Serum", "Squalane, Retinol")
+    cream = add(client, headers, "Night Cream", "Squalane, Ceramide NP")
+    user_id = serum["user_id"]
+    steps = client.get("/routine/", headers=headers).json()["pm"]  # Seeds the default routine
+
+    assert get_routine_profile(db_session, user_id).ingredient_counts == {}
+    db_session.commit()
+
+    client.put(f"/routine/item/{steps[0]['id']}", headers=headers, json={"user_product_id": serum["id"]})
+    client.put(f"/routine/item/{steps[1]['id']}", headers=headers, json={"user_product_id": cream["id"]})
+    assert profile_counts(db_session, user_id) == {"Ceramide NP": 1, "Retinol": 1, "Squalane": 2}
+
+    client.put(f"/products/{cream['id']}", headers=headers, json={
+        "product_name": "Night Cream", "notes": "Ingredients: Squalane, Panthenol"})
+    assert profile_counts(db_session, user_id) == {"Panthenol": 1, "Retinol": 1, "Squalane": 2}
+
+    client.put(f"/products/{cream['id']}", headers=headers, json={"product_name": "Night Cream", "notes": "Empty soon"})
+    assert profile_counts(db_session, user_id) == {"Retinol": 1, "Squalane": 1}
+    assert db_session.query(models.UserProductIngredient).filter(
+        models.UserProductIngredient.user_product_id == cream["id"]).count() == 0
+
+    client.put(f"/products/{cream['id']}", headers=headers, json={
+        "product_name": "Night Cream", "notes": "Ingredients: Squalane, Panthenol"})
+    client.delete(f"/products/{serum['id']}", headers=headers)
+    counts = profile_counts(db_session, user_id)
+    assert counts == {"Panthenol": 1, "Squalane": 1}
+    assert rebuild_routine_profile(db_session, user_id).ingredient_counts == counts
+
+
+def test_add_product_checks_against_profile(client, db_session):
+    headers = login(client, "routine_profile_check")
+    serum = add(client, headers, "Retinol Serum", "Retinol")
+    step = client.get("/routine/", headers=headers).json()["pm"][0]
+    client.put(f"/routine/item/{step['id']}", headers=headers, json={"user_product_id": serum["id"]})
+
+    user = db_session.get(models.User, serum["user_id"])
+    response = add_product(schemas.UserProductCreate(product_name="Peel", notes="Ingredients: Glycolic Acid"),
+                           current_user=user, db=db_session)
+    warning = response.__dict__["safety_warning"]
+    assert warning["has_critical"] is True
+    assert [(c["ingredient_a"], c["ingredient_b"]) for c in warning["conflicts"]] == [("GLYCOLIC ACID", "RETINOL")]
+
+
+def test_label_qualifiers_count_in_the_profile(client, db_session):
+    headers = login(client, "routine_profile_label")
+    peel = add(client, headers, "Peel", "Aqua, Mandelic Acid (AHA)")
+    step = client.get("/routine/", headers=headers).json()["pm"][0]
+    client.put(f"/routine/item/{step['id']}", headers=headers, json={"user_product_id": peel["id"]})
+
+    user = db_session.get(models.User, peel["user_id"])
+    response = add_product(schemas.UserProductCreate(product_name="Toner", notes="Ingredients: Niacinamide"),
+                           current_user=user, db=db_session)
+    # "MANDELIC ACID" alone matches no AHA rule; the stored label does
+    assert response.__dict__["safety_warning"] is not None
+
+
+def test_profile_is_deleted_with_its_user(db_session):
+    social_id = f"routine_profile_delete_{uuid.uuid4().hex[:8]}"
+    user = models.User(email=f"{social_id}@test.com", social_provider="test", social_id=social_id)
+    db_session.add(user)
+    db_session.commit()
+    get_routine_profile(db_session, user.id).ingredient_counts = {"Retinol": 1}
+    db_session.commit()
+    user_id = user.id
+
+    db_session.delete(user)
+    db_session.commit()
+    # Otherwise a stale profile would attach to the next user given this id
+    assert db_session.query(models.RoutineProfile).filter(models.RoutineProfile.user_id == user_id).count() == 0
@@ -1,11 +1,22 @@
 # Tests for Safety Guard Conflict Engine
+import random
+from types import SimpleNamespace
+
 import pytest
 from app.services.conflict_rules import (
+    CONFLICT_RULES,
+    ConflictRule,
+    check_batch_conflicts,
+    check_mask_conflicts,
+    get_alias_index,
     check_routine_conflicts,
     check_ingredient_match,
     normalize_ingredient,
     RiskLevel
 )
+from app.services import conflict_rules
+from app.services.ingredients import canonical_ingredient
+from app.services.rule_masks import current_mask, decode_mask, refresh_rule_mask
 
 
 class TestNormalization:
@@ -139,3 +150,127 @@ class TestReverseConflictDetection:
         assert len(conflicts_b) >= 1
         assert conflicts_a[0]["risk_level"] == "CRITICAL"
         assert conflicts_b[0]["risk_level"] == "CRITICAL"
+
+
+class TestCompiledIndex:
+    """The compiled alias index must agree with check_ingredient_match."""
+
+    @staticmethod
+    def reference_conflicts(product_ingredients, routine_ingredients):
+        found = []
+        for rule in CONFLICT_RULES:
+            def has(ingredients, name, aliases):
+                return any(i.strip() and (check_ingredient_match(i, name, aliases) or
+                                          check_ingredient_match(canonical_ingredient(i), name, aliases))
+                           for i in ingredients)
+            if has(product_ingredients, rule.ingredient_a, rule.ingredient_a_aliases) and \
+                    has(routine_ingredients, rule.ingredient_b, rule.ingredient_b_aliases):
+                found.append((rule.ingredient_a, rule.ingredient_b))
+            elif has(product_ingredients, rule.ingredient_b, rule.ingredient_b_aliases) and \
+                    has(routine_ingredients, rule.ingredient_a, rule.ingredient_a_aliases):
+                found.append((rule.ingredient_b, rule.ingredient_a))
+        return sorted(found)
+
+    def test_matches_reference_engine(self):
+        rng = random.Random(7)
+        vocabulary = ["Water", "Glycerin", "Squalane", "Acid", "peptide", "C", "Retinol 1%",
+                      "Vitamin B3", "Nicotinamide (Vitamin B3)", "Aqua (Water)", "*BHA"]
+        for rule in CONFLICT_RULES:
+            vocabulary += [rule.ingredient_a.title(), rule.ingredient_b.lower()]
+            vocabulary += rule.ingredient_a_aliases + [f"Sodium {a}" for a in rule.ingredient_b_aliases]
+        for _ in range(300):
+            product = rng.sample(vocabulary, rng.randint(0, 6))
+            routine = rng.sample(vocabulary, rng.randint(0, 12))
+            found = sorted((c["ingredient_a"], c["ingredient_b"])
+                           for c in check_routine_conflicts(product, routine))
+            assert found == self.reference_conflicts(product, routine), (product, routine)
+
+    def test_blank_ingredients_match_nothing(self):
+        assert check_routine_conflicts(["", "  "], ["Glycolic Acid"]) == []
+
+    def test_large_routine(self):
+        # Latency is tracked by benchmarks/bench_safety.py, not asserted here
+        routine = [f"Ingredient {i}" for i in range(95)] + ["Glycolic Acid", "Niacinamide"]
+        product = [f"Extract {i}" for i in range(30)] + ["Retinol"]
+        conflicts = check_routine_conflicts(product, routine)
+        assert conflicts[0]["risk_level"] == "CRITICAL"
+        assert ("RETINOL", "GLYCOLIC ACID") in [(c["ingredient_a"], c["ingredient_b"]) for c in conflicts]
+
+
+class TestBatchConflicts:
+    """Many candidates against one routine."""
+
+    ROUTINE = ["Glycolic Acid", "Niacinamide", "Water"]
+    CANDIDATES = [["Retinol", "Water"], ["Glycerin"], [], ["Vitamin C", "Copper Peptides"]]
+
+    def test_batch_matches_single_checks(self):
+        batch = check_batch_conflicts(self.CANDIDATES, self.ROUTINE)
+        assert batch == [check_routine_conflicts(c, self.ROUTINE) for c in self.CANDIDATES]
+        assert batch[0][0]["risk_level"] == "CRITICAL"
+        assert batch[1] == [] and batch[2] == []
+
+    def test_batch_endpoint(self, client):
+        response = client.post("/safety/check-routine-batch", json={
+            "candidates": [{"id": str(i), "ingredients": c} for i, c in enumerate(self.CANDIDATES)],
+            "routine_ingredients": self.ROUTINE,
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert data["has_critical"] is True
+        assert [r["id"] for r in data["results"]] == ["0", "1", "2", "3"]
+        assert [r["has_conflicts"] for r in data["results"]] == [True, False, False, True]
+        assert data["results"][1]["message"] == "No conflicts detected. Safe to add to routine."
+
+
+class TestRuleMasks:
+    """Precomputed rule-side bitmasks."""
+
+    def test_mask_conflicts_match_set_based_check(self):
+        index = get_alias_index()
+        rng = random.Random(11)
+        vocabulary = ["Water", "Glycerin", "Retinol", "Glycolic Acid", "Vitamin C", "Niacinamide",
+                      "Benzoyl Peroxide", "Salicylic Acid", "Copper Peptides", "Wax", "Azelaic Acid"]
+        for _ in range(200):
+            product = rng.sample(vocabulary, rng.randint(0, 4))
+            routine = rng.sample(vocabulary, rng.randint(0, 6))
+            assert check_mask_conflicts(index.mask(product), index.mask(routine)) == \
+                check_routine_conflicts(product, routine)
+
+    def test_product_masks_follow_the_ingredients(self):
+        product = SimpleNamespace(ingredients_text="Aqua, Retinol 1%", rule_mask=None, rule_mask_version=None)
+        refresh_rule_mask(product)
+        stored_mask, stored_version = product.rule_mask, product.rule_mask_version
+
+        # Rewritten by a writer that does not refresh masks: the stored one no longer passes as current
+        product.ingredients_text = "Aqua, Glycolic Acid"
+        assert current_mask(stored_mask, stored_version, ["WATER", "GLYCOLIC ACID"]) == \
+            get_alias_index().mask(["Glycolic Acid"])
+        assert refresh_rule_mask(product) is True
+        assert product.rule_mask != stored_mask
+        assert current_mask(product.rule_mask, product.rule_mask_version, ["WATER", "GLYCOLIC ACID"]) == \
+            decode_mask(product.rule_mask)
+
+    def test_product_masks_keep_label_qualifiers(self):
+        product = SimpleNamespace(ingredients_text="Aqua, Mandelic Acid (AHA)", rule_mask=None, rule_mask_version=None)
+        refresh_rule_mask(product)
+        niacinamide = get_alias_index().mask(["Niacinamide"])
+        assert check_mask_conflicts(decode_mask(product.rule_mask), niacinamide)
+
+        # Same canonical names, different matched names: the qualified mask is not current
+        plain = ["Aqua", "Mandelic Acid"]
+        assert current_mask(product.rule_mask, product.rule_mask_version, plain) == get_alias_index().mask(plain)
+        assert not check_mask_conflicts(get_alias_index().mask(plain), niacinamide)
+
+    def test_product_masks_follow_the_rule_set(self, monkeypatch):
+        product = SimpleNamespace(ingredients_text="Aqua, Retinol 1%", rule_mask=None, rule_mask_version=None)
+        assert refresh_rule_mask(product) is True
+        assert refresh_rule_mask(product) is False
+        stored = product.rule_mask
+
+        extra = ConflictRule("RETINOL", [], "BAKUCHIOL", [], RiskLevel.ADVICE, "redundant",
+                             "Two retinoid-like actives.", "Pick one.", "Test")
+        monkeypatch.setattr(conflict_rules, "CONFLICT_RULES", CONFLICT_RULES + [extra])
+        assert refresh_rule_mask(product) is True  # New rules version
+        assert product.rule_mask != stored
+        conflicts = check_mask_conflicts(decode_mask(product.rule_mask), get_alias_index().mask(["Bakuchiol"]))
+        assert [c["ingredient_b"] for c in conflicts] == ["BAKUCHIOL"]
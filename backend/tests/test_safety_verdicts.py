@@ -0,0 +1,213 @@
+# Tests for cached Tier-2 safety verdicts
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from app import models
+from app.guardian_agent import node_safety_gate
+from app.services.safety_verdicts import (
+    SafetyVerdictCache,
+    ingredient_fingerprint,
+    parse_verdict,
+    tier2_enabled,
+    tier2_verdicts,
+    verdict_cache,
+)
+
+
+VERDICT = {
+    "risk_level": "WARNING",
+    "conflicts": [{"ingredient_a": "copper peptides", "ingredient_b": "ascorbic acid",
+                   "risk_level": "WARNING", "interaction_type": "Deactivation",
+                   "reasoning": "Vitamin C oxidizes copper peptides.",
+                   "recommended_adjustment": "Use them at different times."}],
+}
+
+
+@pytest.fixture(autouse=True)
+def empty_verdict_store(db_session, monkeypatch):
+    # Verdicts are committed; start every test from an empty store
+    db_session.query(models.SafetyVerdict).delete()
+    db_session.commit()
+    verdict_cache.clear()
+    monkeypatch.setenv("SAFETY_TIER2_ENABLED", "1")
+
+
+def shelf_context(*products):
+    """user_context of a shelf holding products with these ingredient lists."""
+    return {
+        "shelf_ingredients": [i for ingredients in products for i in ingredients],
+        "shelf_products": [{"name": f"Shelf {n}", "ingredients": ingredients} for n, ingredients in enumerate(products)],
+    }
+
+
+class VerdictLLM:
+    model_name = "tier2-stub"
+
+    def __init__(self, content=json.dumps(VERDICT)):
+        self.content = content
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        return AIMessage(content=self.content)
+
+
+def test_fingerprint_is_canonical():
+    a = ingredient_fingerprint(["Water", "Copper  Peptides"], ["Ascorbic Acid", "glycerin"])
+    b = ingredient_fingerprint(["copper peptides", "water", "WATER"], ["glycerin", "ascorbic acid"])
+    assert a == b
+    # Candidate and shelf sides are not interchangeable
+    assert a != ingredient_fingerprint(["ascorbic acid", "glycerin"], ["water", "copper peptides"])
+
+
+def test_parse_verdict():
+    verdict = parse_verdict("```json\n" + json.dumps(VERDICT) + "\n```")
+    assert verdict["risk_level"] == "WARNING"
+    assert verdict["conflicts"][0]["source"] == "Tier 2 LLM analysis"
+    assert parse_verdict("looks fine to me") is None
+    assert parse_verdict('{"risk_level": "MAYBE"}') is None
+
+
+def test_llm_runs_only_on_misses_and_verdicts_persist(db_session):
+    llm = VerdictLLM()
+    product = {"name": "Peptide Serum", "ingredients": ["Water", "Copper Peptides"]}
+    shelf = [{"name": "Vitamin C Serum", "ingredients": ["Ascorbic Acid"]}]
+
+    cache = SafetyVerdictCache()
+    first = tier2_verdicts(llm, [product], shelf, db_session, cache=cache)
+    second = tier2_verdicts(llm, [dict(product, ingredients=["copper peptides", "water"])], shelf,
+                            db_session, cache=cache)
+    assert llm.calls == 1
+    assert first[0][1] == second[0][1]
+
+    # A fresh process finds the verdict in the table
+    restarted = tier2_verdicts(llm, [product], shelf, db_session, cache=SafetyVerdictCache())
+    assert llm.calls == 1 and restarted[0][1]["risk_level"] == "WARNING"
+    row = db_session.query(models.SafetyVerdict).filter_by(
+        fingerprint=ingredient_fingerprint(product["ingredients"], ["Ascorbic Acid"])).one()
+    assert row.model == "tier2-stub"
+
+
+def test_unusable_verdicts_are_not_cached(db_session):
+    llm = VerdictLLM(content="I cannot tell.")
+    product = {"name": "Mystery", "ingredients": ["unobtainium"]}
+    cache = SafetyVerdictCache()
+    shelf = [{"name": "Cream", "ingredients": ["glycerin"]}]
+    assert tier2_verdicts(llm, [product], shelf, db_session, cache=cache) == []
+    assert tier2_verdicts(llm, [product], shelf, db_session, cache=cache) == []
+    assert llm.calls == 2
+
+
+def test_safety_gate_skips_tier2_for_flagged_products(db_session):
+    llm = VerdictLLM()
+    state = {
+        "candidate_products": [
+            {"name": "Retinol Night", "ingredients": ["retinol"]},
+            {"name": "Bakuchiol Oil", "ingredients": ["bakuchiol", "squalane"]},
+        ],
+        "user_context": shelf_context(["salicylic acid"]),
+    }
+    payload = node_safety_gate(state, db_session, llm)["safety_payload"]
+
+    assert llm.calls == 1  # Only the product Tier 1 did not flag
+    tier2 = [c for c in payload["conflicts"] if c["source"] == "Tier 2 LLM analysis"]
+    assert [c["product_name"] for c in tier2] == ["Bakuchiol Oil"]
+    assert payload["risk_level"] == "WARNING"
+
+    node_safety_gate(state, db_session, llm)
+    assert llm.calls == 1  # Repeat check served from the verdict cache
+
+
+class BlockedLLM(VerdictLLM):
+    """Answers only once released."""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+        self.answered = threading.Event()
+
+    def invoke(self, messages):
+        self.release.wait(5)
+        response = super().invoke(messages)
+        self.answered.set()
+        return response
+
+
+def test_slow_tier2_falls_back_to_tier1(db_session):
+    llm = BlockedLLM()
+    state = {
+        "candidate_products": [
+            {"name": "BHA Toner", "ingredients": ["salicylic acid"]},
+            {"name": "Bakuchiol Oil", "ingredients": ["bakuchiol", "squalane"]},
+        ],
+        "user_context": shelf_context(["glycolic acid"]),
+    }
+    try:
+        result = node_safety_gate(state, db_session, llm, tier2_timeout=0.05)
+        assert not llm.answered.is_set()
+    finally:
+        llm.release.set()
+
+    assert result["degradations"] == [{"node": "safety_gate", "degradation": "tier1_only"}]
+    payload = result["safety_payload"]  # Tier 1 alone
+    assert payload["risk_level"] == "WARNING"
+    assert [c["product_name"] for c in payload["conflicts"]] == ["BHA Toner"]
+
+    # The late verdict is kept for the next check
+    assert llm.answered.wait(5)
+    fingerprint = ingredient_fingerprint(["bakuchiol", "squalane"], ["glycolic acid"])
+    deadline = time.time() + 2
+    while verdict_cache.get(fingerprint) is None and time.time() < deadline:
+        time.sleep(0.01)
+    assert node_safety_gate(state, db_session, llm, tier2_timeout=0.05).get("degradations") is None
+    assert llm.calls == 1
+
+
+def test_exhausted_deadline_skips_tier2(db_session):
+    llm = VerdictLLM()
+    state = {"candidate_products": [{"name": "Bakuchiol Oil", "ingredients": ["bakuchiol"]}],
+             "user_context": shelf_context(["glycolic acid"])}
+    result = node_safety_gate(state, db_session, llm, tier2_timeout=0)
+    assert llm.calls == 0
+    assert result["safety_payload"]["risk_level"] == "SAFE"
+    assert result["degradations"] == [{"node": "safety_gate", "degradation": "tier1_only"}]
+
+
+def test_verdicts_are_keyed_per_shelf_product(db_session):
+    llm = VerdictLLM()
+    product = {"name": "Peptide Serum", "ingredients": ["Copper Peptides"]}
+    vitamin_c = {"name": "Vitamin C Serum", "ingredients": ["Ascorbic Acid"]}
+    cream = {"name": "Cream", "ingredients": ["Glycerin"]}
+
+    tier2_verdicts(llm, [product], [vitamin_c], db_session)
+    assert llm.calls == 1
+    # A new shelf product only costs its own pair
+    assert len(tier2_verdicts(llm, [product], [vitamin_c, cream], db_session)) == 2
+    assert llm.calls == 2
+
+
+def test_safety_gate_honours_the_verdict_risk_level(db_session):
+    llm = VerdictLLM(content=json.dumps({"risk_level": "WARNING", "conflicts": []}))
+    state = {"candidate_products": [{"name": "Bakuchiol Oil", "ingredients": ["bakuchiol"]}],
+             "user_context": shelf_context(["squalane"])}
+    payload = node_safety_gate(state, db_session, llm)["safety_payload"]
+    assert payload["risk_level"] == "WARNING"
+    assert payload["conflicts"] == []
+
+
+def test_tier2_is_off_by_default(monkeypatch):
+    monkeypatch.delenv("SAFETY_TIER2_ENABLED")
+    assert tier2_enabled() is False
+
+
+def test_expired_stored_verdicts_are_ignored(db_session):
+    fingerprint = ingredient_fingerprint(["Copper Peptides"], ["Ascorbic Acid"])
+    db_session.add(models.SafetyVerdict(fingerprint=fingerprint, risk_level="WARNING", conflicts=[],
+                                        expires_at=datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=1)))
+    db_session.commit()
+    assert SafetyVerdictCache().get(fingerprint, db_session) is None
@@ -0,0 +1,177 @@
+# Tests for the Semantic Response Cache
+import json
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage
+
+from app.agent import SkincareAgent, SYSTEM_PREFIX, ANONYMOUS_CONTEXT
+from app.services.semantic_cache import (
+    SemanticResponseCache,
+    is_generic_question,
+    hashed_embedding,
+    ingredient_entities,
+)
+
+
+class CountingLLM:
+    """Minimal LLM stub that answers without tools and counts calls."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        self.calls += 1
+        return AIMessage(content="Niacinamide strengthens the skin barrier.")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestGenericDetection:
+
+    def test_generic_questions(self):
+        assert is_generic_question("What does niacinamide do?") is True
+        assert is_generic_question("AM vs PM retinol") is True
+
+    def test_personal_questions(self):
+        assert is_generic_question("Can I use retinol with my vitamin C?") is False
+        assert is_generic_question("What should go in the routine tonight?") is False
+
+    def test_context_disqualifies(self):
+        history = [{"role": "user", "content": "hi"}]
+        assert is_generic_question("What does niacinamide do?", chat_history=history) is False
+        assert is_generic_question("What does niacinamide do?", image_base64="abc") is False
+        assert is_generic_question("What does niacinamide do?", user_location="NYC") is False
+
+
+class TestSemanticResponseCache:
+
+    def test_near_duplicate_hit(self):
+        cache = SemanticResponseCache(enabled=True)
+        cache.store("What does niacinamide do?", ['{"type": "text"}\n'])
+
+        assert cache.lookup("what does niacinamide do") == ['{"type": "text"}\n']
+        assert cache.lookup("Is sunscreen needed indoors?") is None
+
+    def test_similarity_is_normalized(self):
+        a = hashed_embedding("AM vs PM retinol")
+        b = hashed_embedding("am vs pm retinol?!")
+        assert abs(float(a @ b) - 1.0) < 1e-6
+
+    def test_paraphrase_hit(self):
+        cache = SemanticResponseCache(enabled=True)
+        cache.store("AM vs PM retinol", ["x\n"])
+        assert cache.lookup("retinol AM or PM") == ["x\n"]
+
+    def test_different_ingredients_never_match(self):
+        cache = SemanticResponseCache(enabled=True)
+        cache.store("can retinol be used with vitamin c", ["x\n"])
+        for question in ["can retinol be used with vitamin a",
+                         "can retinol be used with vitamin c and niacinamide",
+                         "can tretinoin be used with vitamin c",
+                         "can it be used with vitamin c"]:
+            assert cache.lookup(question) is None, question
+
+    def test_ingredient_entities_are_canonical(self):
+        assert ingredient_entities("Vitamin A or retinol?") == {"RETINOL"}
+        assert ingredient_entities("L-ascorbic acid with BHA") == {"ASCORBIC ACID", "SALICYLIC ACID"}
+        assert ingredient_entities("Is sunscreen needed indoors?") == set()
+
+    def test_namespace_isolation(self):
+        cache = SemanticResponseCache(enabled=True)
+        cache.store("What does niacinamide do?", ["x\n"], namespace="model-a")
+        assert cache.lookup("What does niacinamide do?", namespace="model-b") is None
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = SemanticResponseCache(enabled=True, ttl_seconds=10, clock=clock)
+        cache.store("What does niacinamide do?", ["x\n"])
+
+        clock.now = 5
+        assert cache.lookup("What does niacinamide do?") == ["x\n"]
+        clock.now = 11
+        assert cache.lookup("What does niacinamide do?") is None
+
+    def test_hit_rate(self):
+        cache = SemanticResponseCache(enabled=True)
+        cache.store("What does niacinamide do?", ["x\n"])
+        cache.lookup("What does niacinamide do?")
+        cache.lookup("Unrelated question about sunscreen")
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_max_entries(self):
+        cache = SemanticResponseCache(enabled=True, max_entries=2)
+        for q in ["retinol basics", "sunscreen basics", "vitamin c basics"]:
+            cache.store(q, ["x\n"])
+        assert cache.stats()["entries"] == 2
+
+
+class TestAgentIntegration:
+
+    def test_generic_answer_replayed(self):
+        cache = SemanticResponseCache(enabled=True)
+        llm = CountingLLM()
+
+        with patch("app.agent.response_cache", cache):
+            agent = SkincareAgent(llm=llm, db_session=None)
+            first = list(agent.run_stream("What does niacinamide do?", [], user_id=1))
+            second = list(agent.run_stream("what does niacinamide do", [], user_id=2))
+
+        assert llm.calls == 1
+        assert first == second
+        assert json.loads(first[0])["type"] == "text"
+
+    def test_cached_answer_is_generated_with_a_consistent_general_prompt(self):
+        cache = SemanticResponseCache(enabled=True)
+        llm = CountingLLM()
+        prompts = []
+        llm.invoke = lambda messages: prompts.append(messages[0].content) or AIMessage(content="ok")
+
+        with patch("app.agent.response_cache", cache), \
+                patch.object(SkincareAgent, "build_user_context", side_effect=AssertionError):
+            list(SkincareAgent(llm=llm, db_session=None).run_stream("What does niacinamide do?", [], user_id=1))
+
+        assert prompts == [SYSTEM_PREFIX + ANONYMOUS_CONTEXT]
+        # The instructions it switches off are the ones that need the user's data
+        for line in SYSTEM_PREFIX.splitlines():
+            if line[:2] in ("1.", "2.", "3."):
+                assert any(word in line for word in ("THEIR", "HISTORY", "SPECIFIC"))
+
+    def test_personal_question_bypasses_cache(self):
+        cache = SemanticResponseCache(enabled=True)
+        llm = CountingLLM()
+
+        with patch("app.agent.response_cache", cache):
+            agent = SkincareAgent(llm=llm, db_session=None)
+            list(agent.run_stream("Is my moisturizer ok?", []))
+            list(agent.run_stream("Is my moisturizer ok?", []))
+
+        assert llm.calls == 2
+        assert cache.stats()["entries"] == 0
+
+    def test_disabled_cache_is_bypassed(self):
+        cache = SemanticResponseCache(enabled=False)
+        llm = CountingLLM()
+
+        with patch("app.agent.response_cache", cache):
+            agent = SkincareAgent(llm=llm, db_session=None)
+            list(agent.run_stream("What does niacinamide do?", []))
+            list(agent.run_stream("What does niacinamide do?", []))
+
+        assert llm.calls == 2
+
+
+def test_cache_stats_require_a_user(client):
+    assert client.get("/chat/cache/stats").status_code == 401
@@ -0,0 +1,64 @@
+# Tests for the user_product_ingredients table and its consumers
+import uuid
+
+from app import models
+from app.services.shelf_ingredients import backfill_from_notes, product_ingredients, product_match_names
+
+
+def login(client, name):
+    token = client.post("/auth/google", json={"id_token": f"mock_{name}_{uuid.uuid4().hex[:8]}", "tos_agreed": True}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_add_product_stores_canonical_ingredients(client, db_session):
+    headers = login(client, "shelf_ingredients_add")
+    response = client.post("/products/", headers=headers, json={
+        "product_name": "Barrier Serum",
+        "notes": "Ingredients: Aqua (Water), Niacinamide 10%, Vitamin E, Niacinamide",
+    })
+    assert response.status_code == 200
+    product = db_session.get(models.UserProduct, response.json()["id"])
+    assert product_ingredients(product) == ["WATER", "NIACINAMIDE", "TOCOPHEROL"]
+    assert product_match_names(product) == ["Aqua (Water)", "Niacinamide 10%", "Vitamin E"]
+
+    client.post("/products/", headers=headers, json={"product_name": "Plain Cream", "notes": "Ingredients: Glycerin"})
+    found = client.get("/products/", headers=headers, params={"ingredient": "nicotinamide"}).json()
+    assert [p["product_name"] for p in found] == ["Barrier Serum"]
+
+
+def test_backfill_from_notes(db_session):
+    user = new_user(db_session, "shelf_backfill")
+    legacy = models.UserProduct(user_id=user.id, product_name="Legacy Serum", status="active",
+                                notes="Ingredients: Aqua, Salicylic Acid 2%")
+    other = models.UserProduct(user_id=user.id, product_name="No List", status="active", notes="Smells nice")
+    db_session.add_all([legacy, other])
+    db_session.commit()
+
+    assert backfill_from_notes(db_session)["products"] >= 1
+    db_session.refresh(legacy)
+    db_session.refresh(other)
+    assert product_ingredients(legacy) == ["WATER", "SALICYLIC ACID"]
+    assert product_ingredients(other) == []
+    assert backfill_from_notes(db_session)["products"] == 0
+
+
+def new_user(db_session, name):
+    suffix = uuid.uuid4().hex[:8]
+    user = models.User(email=f"{name}_{suffix}@example.com", social_provider="google", social_id=f"{name}_{suffix}")
+    db_session.add(user)
+    db_session.flush()
+    return user
+
+
+def test_bulk_deleted_products_leave_no_rows(db_session):
+    user = new_user(db_session, "shelf_cascade")
+    product = models.UserProduct(user_id=user.id, product_name="Gone", status="active")
+    product.ingredient_rows = [models.UserProductIngredient(position=0, name="GLYCERIN", label="Glycerin")]
+    db_session.add(product)
+    db_session.commit()
+    product_id = product.id
+
+    db_session.query(models.UserProduct).filter(models.UserProduct.id == product_id).delete()
+    db_session.commit()
+    assert db_session.query(models.UserProductIngredient).filter(
+        models.UserProductIngredient.user_product_id == product_id).count() == 0
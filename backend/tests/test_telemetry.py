@@ -0,0 +1,112 @@
+# Tests for chat latency telemetry and server-side metrics
+import json
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.agent import SkincareAgent
+from app.services.metrics import MetricsRegistry
+from app.services.telemetry import TurnMetrics, CHAT_TURN_DURATION, CHAT_TOOL_DURATION
+
+
+class ToolThenSynthesisLLM:
+    """Calls ingredient_checker once, then streams a three-chunk answer with usage."""
+
+    model_name = "stub-model"
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        return AIMessage(
+            content="",
+            tool_calls=[{
+                "name": "ingredient_checker",
+                "args": {"ingredients": "Water, Retinol", "allergy": "peanut"},
+                "id": "call_1",
+            }],
+            usage_metadata={"input_tokens": 50, "output_tokens": 10, "total_tokens": 60},
+        )
+
+    def stream(self, messages):
+        yield AIMessageChunk(content="Looks ")
+        yield AIMessageChunk(content="safe ")
+        yield AIMessageChunk(content="to me.")
+
+
+class TestHistogram:
+
+    def test_percentiles(self):
+        hist = MetricsRegistry().histogram("latency", "test", ["model"], buckets=(1, 2, 4))
+        for value in [0.5] * 50 + [3.0] * 49 + [10.0]:
+            hist.observe(value, model="m")
+
+        assert hist.count(model="m") == 100
+        assert hist.percentile(50, model="m") <= 1
+        assert 2 <= hist.percentile(99, model="m") <= 4
+        assert hist.percentile(50, model="other") is None
+
+    def test_prometheus_render(self):
+        registry = MetricsRegistry()
+        registry.histogram("latency", "Latency", ["model"], buckets=(1,)).observe(0.5, model="m")
+        registry.gauge("depth", "Queue depth").set(3)
+
+        text = registry.render_prometheus()
+        assert '# TYPE latency histogram' in text
+        assert 'latency_bucket{model="m",le="1"} 1' in text
+        assert 'latency_bucket{model="m",le="+Inf"} 1' in text
+        assert 'depth 3' in text
+
+    def test_get_or_create(self):
+        registry = MetricsRegistry()
+        assert registry.counter("c", "x") is registry.counter("c", "x")
+
+
+class TestTurnMetrics:
+
+    def test_derived_values(self):
+        now = [0.0]
+        turn = TurnMetrics(model="m", clock=lambda: now[0])
+        now[0] = 1.0
+        turn.start_synthesis()
+        now[0] = 1.5
+        turn.mark_first_token()
+        for _ in range(10):
+            turn.record_synthesis_chunk(AIMessageChunk(content="x"))
+        now[0] = 2.0
+        turn.finish()
+
+        assert turn.ttft == 1.5
+        assert turn.total == 2.0
+        assert turn.synthesis_tokens_per_second == 10.0
+
+
+class TestAgentMetricsEvent:
+
+    def test_trailing_metrics_event(self):
+        before = CHAT_TURN_DURATION.count(model="stub-model")
+        agent = SkincareAgent(llm=ToolThenSynthesisLLM(), db_session=None)
+        events = [json.loads(line) for line in agent.run_stream("is this safe?", [], include_metrics=True)]
+
+        assert events[-1]["type"] == "metrics"
+        metrics = events[-1]["content"]
+        assert metrics["model"] == "stub-model"
+        assert metrics["ttft_seconds"] is not None
+        assert metrics["tool_decision_seconds"] is not None
+        assert [t["name"] for t in metrics["tools"]] == ["ingredient_checker"]
+        assert metrics["synthesis_tokens"] == 3
+        assert metrics["total_tokens"] == 60
+
+        # Published server-side as well
+        assert CHAT_TURN_DURATION.count(model="stub-model") == before + 1
+        assert CHAT_TOOL_DURATION.count(tool="ingredient_checker") >= 1
+
+    def test_metrics_event_is_opt_in(self):
+        agent = SkincareAgent(llm=ToolThenSynthesisLLM(), db_session=None)
+        events = [json.loads(line) for line in agent.run_stream("is this safe?", [])]
+        assert all(e["type"] != "metrics" for e in events)
+
+
+def test_metrics_endpoint(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "chat_turn_duration_seconds" in response.text
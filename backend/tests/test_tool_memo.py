@@ -0,0 +1,123 @@
+# Tests for per-conversation tool memoization
+from unittest.mock import patch
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+from app.agent import SkincareAgent, create_tools
+from app.tools.memo import (
+    ToolMemo,
+    ConversationMemoStore,
+    memoize_tool,
+    normalize_arg,
+    use_tool_memo,
+)
+
+
+class TestNormalization:
+
+    def test_trivial_query_variants_match(self):
+        assert normalize_arg("Moisturizer for acne!") == normalize_arg("acne moisturizer")
+        assert normalize_arg("  CeraVe  ") == normalize_arg("cerave")
+
+    def test_different_queries_differ(self):
+        assert normalize_arg("oily moisturizer") != normalize_arg("dry moisturizer")
+
+    def test_non_strings_untouched(self):
+        assert normalize_arg(3) == 3
+
+
+class TestMemoizeTool:
+
+    def test_cached_within_memo(self):
+        calls = []
+
+        @memoize_tool
+        def lookup(query: str, skin_type: str = "all") -> str:
+            calls.append(query)
+            return f"result:{query}"
+
+        memo = ToolMemo()
+        with use_tool_memo(memo):
+            first = lookup("Moisturizer for acne")
+            second = lookup(query="acne moisturizer", skin_type="all")
+
+        assert first == second
+        assert len(calls) == 1
+        assert memo.hits == 1
+
+    def test_arguments_are_part_of_key(self):
+        calls = []
+
+        @memoize_tool
+        def lookup(query: str, skin_type: str = "all") -> str:
+            calls.append(query)
+            return query
+
+        with use_tool_memo(ToolMemo()):
+            lookup("moisturizer", skin_type="oily")
+            lookup("moisturizer", skin_type="dry")
+
+        assert len(calls) == 2
+
+    def test_no_active_memo_runs_every_time(self):
+        calls = []
+
+        @memoize_tool
+        def lookup(query: str) -> str:
+            calls.append(query)
+            return query
+
+        lookup("a")
+        lookup("a")
+        assert len(calls) == 2
+
+    def test_tool_schema_preserved(self):
+        product_retriever = create_tools(None)[0]
+        assert set(product_retriever.args) == {"query", "skin_type"}
+
+
+class TestConversationMemoStore:
+
+    def test_same_conversation_shares_memo(self):
+        store = ConversationMemoStore()
+        assert store.get(1, "conv-1") is store.get(1, "conv-1")
+        assert store.get(1, "conv-1") is not store.get(2, "conv-1")
+
+    def test_missing_conversation_id_gets_fresh_memo(self):
+        store = ConversationMemoStore()
+        assert store.get(1, None) is not store.get(1, None)
+
+    def test_expired_conversation_resets(self):
+        now = [0.0]
+        store = ConversationMemoStore(ttl_seconds=10, clock=lambda: now[0])
+        memo = store.get(1, "conv-1")
+        now[0] = 11
+        assert store.get(1, "conv-1") is not memo
+
+
+class RepeatingToolLLM:
+    """Always asks for product_retriever, then synthesizes."""
+
+    def bind_tools(self, tools):
+        return self
+
+    def invoke(self, messages):
+        return AIMessage(content="", tool_calls=[{
+            "name": "product_retriever",
+            "args": {"query": "Moisturizer for acne"},
+            "id": "call_1",
+        }])
+
+    def stream(self, messages):
+        yield AIMessageChunk(content="Here you go.")
+
+
+def test_agent_reuses_tool_results_across_turns():
+    memo = ToolMemo()
+    with patch("app.agent.rag.hybrid_search", return_value=[]) as search:
+        for _ in range(2):
+            agent = SkincareAgent(llm=RepeatingToolLLM(), db_session=None, tool_memo=memo)
+            list(agent.run_stream("find me an acne moisturizer", []))
+
+    assert search.call_count == 1
+    assert memo.hits == 1
@@ -0,0 +1,51 @@
+# Tests for the shared tool registry
+import time
+from unittest.mock import MagicMock, patch
+
+from app.agent import SkincareAgent
+from app.tools.registry import (
+    dispatch_tool,
+    get_tool_registry,
+    get_tool_specs,
+)
+
+
+def test_registry_contains_all_tools():
+    assert set(get_tool_registry()) == {"product_retriever", "ingredient_checker", "store_locator"}
+
+
+def test_specs_built_once():
+    assert get_tool_specs() is get_tool_specs()
+    names = [spec["function"]["name"] for spec in get_tool_specs()]
+    assert "product_retriever" in names
+    # The injected config must never leak into the schema the LLM sees
+    params = get_tool_specs()[names.index("product_retriever")]["function"]["parameters"]
+    assert "config" not in params["properties"]
+
+
+def test_dispatch_by_name():
+    assert dispatch_tool("ingredient_checker", {"ingredients": "Water, Peanut Oil", "allergy": "peanut"}) \
+        == "WARNING: Contains peanut!"
+
+
+def test_dispatch_unknown_tool():
+    assert dispatch_tool("does_not_exist", {}) == "Error: Tool not found"
+
+
+def test_dispatch_injects_db_session():
+    db = object()
+    with patch("app.tools.product_retriever.rag.hybrid_search", return_value=[]) as search:
+        dispatch_tool("product_retriever", {"query": "CeraVe"}, db=db)
+    assert search.call_args[0][0] is db
+
+
+def test_agent_construction_is_cheap():
+    llm = MagicMock()
+    start = time.perf_counter()
+    for _ in range(1000):
+        SkincareAgent(llm=llm, db_session=None)
+    elapsed = time.perf_counter() - start
+
+    # Tools are not rebuilt and bind_tools is deferred until first use
+    llm.bind_tools.assert_not_called()
+    assert elapsed < 0.5